@@ -0,0 +1,843 @@
+#!/usr/bin/env python3
+
+"""TEA collection benchmarks.
+
+Runs on synthetic collections of a given size. For developers."""
+
+import argparse
+import os
+import sys
+import time
+
+MEMORY_BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "test_data", "memory-baseline.json")
+
+
+def make_collection(artefacts: int, formats: int) -> dict:
+    """Create a synthetic raw collection structure.
+
+    Every third format is a CycloneDX SBOM, the rest are SPDX.
+    """
+    import uuid
+
+    colldict = dict()
+    colldict["tcoFormat"] = "TEA-collection"
+    colldict["specVersion"] = "1.0"
+    colldict["UUID"] = str(uuid.uuid4())
+    colldict["product_name"] = "Spaceship Mega3000 XL"
+    colldict["product_version"] = "23.43.34"
+    colldict["product_release_date"] = "20240423"
+    colldict["product_tei_id"] = "purl:spaceship"
+    colldict["version"] = 1
+    colldict["author_name"] = "Ford Prefect"
+    colldict["author_org"] = "The Heart of Gold, inc"
+    colldict["author_email"] = "ford.prefect@hog.example.com"
+    colldict["artefacts"] = list()
+    for artno in range(artefacts):
+        art = dict()
+        art["uuid"] = str(uuid.uuid4())
+        art["name"] = "Artefact {}".format(artno)
+        art["description"] = "Synthetic artefact number {}".format(artno)
+        art["author_name"] = "Ford Prefect"
+        art["author_org"] = "The Heart of Gold, inc"
+        art["author_email"] = "ford.prefect@hog.example.com"
+        art["formats"] = list()
+        for formno in range(formats):
+            form = dict()
+            form["uuid"] = str(uuid.uuid4())
+            form["bom-identifier"] = "urn:uuid:{}".format(uuid.uuid4())
+            if formno % 3 == 0:
+                form["mediatype"] = "application/cyclonedx"
+            else:
+                form["mediatype"] = "application/spdx"
+            form["category"] = None
+            form["url"] = "https://product.example.com/{}/{}.json".format(
+                artno, formno)
+            form["sigurl"] = None
+            form["hash"] = "sha256:{:064x}".format(artno * 1000 + formno)
+            form["size"] = 1024 * (formno + 1)
+            art["formats"].append(form)
+        colldict["artefacts"].append(art)
+    return colldict
+
+
+def timeit(function, rounds: int) -> float:
+    """Return the best wall time in seconds of a number of rounds."""
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_query(artefacts: int, formats: int, rounds: int, debug: bool):
+    """Compare a pushdown query with loading everything and filtering."""
+    import json
+    from tco import dict2object
+    from tea_collection import query
+
+    colltext = json.dumps(make_collection(artefacts, formats), indent=4)
+
+    def pushdown():
+        myquery = query(debug=debug)
+        myquery.add_field("artefact.name")
+        myquery.add_field("format.uuid")
+        myquery.add_filter("format.mediatype==application/cyclonedx")
+        return myquery.rows(colltext)
+
+    def load_all():
+        col = dict2object(json.loads(colltext), debug=debug)
+        result = list()
+        for art in col.collection["artefacts"]:
+            for form in art.artefact["formats"]:
+                if form.format["mediatype"] == "application/cyclonedx":
+                    result.append({
+                        "artefact.name": art.artefact["name"],
+                        "format.uuid": form.format["uuid"]})
+        return result
+
+    if len(pushdown()) != len(load_all()):
+        print("ERROR: Query and full load results differ")
+        return False
+    pushtime = timeit(pushdown, rounds)
+    loadtime = timeit(load_all, rounds)
+    print("Query benchmark: {} artefacts x {} formats, {} bytes".format(
+        artefacts, formats, len(colltext)))
+    print("  pushdown query:     {:8.2f} ms".format(pushtime * 1000))
+    print("  load and filter:    {:8.2f} ms".format(loadtime * 1000))
+    print("  speedup:            {:8.2f}x".format(loadtime / pushtime))
+    return True
+
+
+def bench_lazy(artefacts: int, formats: int, rounds: int, debug: bool):
+    """Compare eager and lazy dict2object when one artefact is used."""
+    from tco import dict2object
+
+    colldict = make_collection(artefacts, formats)
+
+    def eager():
+        col = dict2object(colldict, debug=debug)
+        return col.collection["artefacts"][0].get_struct()["name"]
+
+    def lazy():
+        col = dict2object(colldict, debug=debug, lazy=True)
+        return col.collection["artefacts"][0].get_struct()["name"]
+
+    if eager() != lazy():
+        print("ERROR: Eager and lazy results differ")
+        return False
+    eagertime = timeit(eager, rounds)
+    lazytime = timeit(lazy, rounds)
+    print("Lazy load benchmark: {} artefacts x {} formats, one used".format(
+        artefacts, formats))
+    print("  eager dict2object:  {:8.2f} ms".format(eagertime * 1000))
+    print("  lazy dict2object:   {:8.2f} ms".format(lazytime * 1000))
+    print("  speedup:            {:8.2f}x".format(eagertime / lazytime))
+    return True
+
+
+def bench_parallel(
+        artefacts: int, formats: int, rounds: int, workers: int, debug: bool):
+    """Compare serial and parallel validation of one large collection."""
+    from tco import dict2object
+
+    colldict = make_collection(artefacts, formats)
+
+    def serial():
+        return str(dict2object(colldict, debug=debug))
+
+    def parallel():
+        return str(dict2object(colldict, debug=debug, workers=workers))
+
+    # Collection UUIDs are generated, compare from the product name on
+    if serial().split("product_name")[1] != parallel().split(
+            "product_name")[1]:
+        print("ERROR: Serial and parallel results differ")
+        return False
+    serialtime = timeit(serial, rounds)
+    paralleltime = timeit(parallel, rounds)
+    print("Parallel validation benchmark: {} artefacts x {} formats, "
+          "{} workers".format(artefacts, formats, workers))
+    print("  serial:             {:8.2f} ms".format(serialtime * 1000))
+    print("  parallel:           {:8.2f} ms".format(paralleltime * 1000))
+    print("  speedup:            {:8.2f}x".format(serialtime / paralleltime))
+    return True
+
+
+def bench_compression(artefacts: int, formats: int, rounds: int, debug: bool):
+    """Report size, write and read time for each compression and level."""
+    import json
+    import os
+    import tempfile
+    from tco import _zstd_module
+    from tco import dict2object
+    from tco import getfile
+    from tco import write_collection
+
+    print("Compression benchmark: {} artefacts x {} formats".format(
+        artefacts, formats))
+    col = dict2object(make_collection(artefacts, formats), debug=debug)
+    variants = [(None, None, ".json")]
+    for level in (1, 6, 9):
+        variants.append(("gzip", level, ".json.gz"))
+        variants.append(("xz", level, ".json.xz"))
+    if _zstd_module() is not None:
+        for level in (1, 3, 19):
+            variants.append(("zstd", level, ".json.zst"))
+    else:
+        print("  (zstd not installed, skipped)")
+    print("  {:6} {:>5} {:>12} {:>10} {:>10}".format(
+        "comp", "level", "bytes", "write ms", "read ms"))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for compression, level, suffix in variants:
+            filename = os.path.join(tmpdir, "collection" + suffix)
+
+            def write():
+                return write_collection(
+                    col, filename, debug=debug,
+                    compression=compression, level=level)
+
+            def read():
+                return json.loads(getfile(filename, debug=debug))
+
+            writetime = timeit(write, rounds)
+            readtime = timeit(read, rounds)
+            print("  {:6} {:>5} {:>12} {:>10.2f} {:>10.2f}".format(
+                str(compression), str(level), os.path.getsize(filename),
+                writetime * 1000, readtime * 1000))
+    return True
+
+
+def bench_index(artefacts: int, formats: int, rounds: int, debug: bool):
+    """Time checking a new collection against a populated index."""
+    import os
+    import tempfile
+    from tea_collection import uuid_index
+
+    corpus = 20
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index = uuid_index(
+            os.path.join(tmpdir, "index.db"), debug=debug,
+            capacity=corpus * artefacts * (2 * formats + 1) * 2)
+        index.open()
+        start = time.perf_counter()
+        for _ in range(corpus):
+            index.add(make_collection(artefacts, formats))
+        filltime = time.perf_counter() - start
+        newcol = make_collection(artefacts, formats)
+
+        def check():
+            return index.check(newcol)
+
+        errors, _ = check()
+        if errors > 0:
+            print("ERROR: New collection conflicts with index")
+            return False
+        checktime = timeit(check, rounds)
+        print("Index benchmark: {} identifiers indexed".format(
+            index.filter.count))
+        print("  filter memory:      {:8d} bytes".format(
+            len(index.filter.to_bytes())))
+        print("  fill time:          {:8.2f} ms".format(filltime * 1000))
+        print("  check {:6d} ids:    {:8.2f} ms".format(
+            len(newcol["artefacts"]) * (2 * formats + 1) + 1,
+            checktime * 1000))
+        index.close()
+    return True
+
+
+def bench_history(artefacts: int, formats: int, rounds: int, debug: bool):
+    """Compare the history store with one full copy per version."""
+    import copy
+    import json
+    import os
+    import random
+    import tempfile
+    from tea_collection import history_store
+
+    versions = 50
+    random.seed(42)
+    colldict = make_collection(artefacts, formats)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = history_store(os.path.join(tmpdir, "store"), debug=debug)
+        fulldir = os.path.join(tmpdir, "full")
+        os.makedirs(fulldir)
+        fullsize = 0
+        for version in range(1, versions + 1):
+            # A small edit per version, like a moved URL or a new artefact
+            colldict = copy.deepcopy(colldict)
+            colldict["version"] = version
+            art = random.choice(colldict["artefacts"])
+            form = random.choice(art["formats"])
+            form["url"] = "https://mirror.example.com/{}".format(version)
+            if version % 10 == 0:
+                colldict["artefacts"].append(
+                    make_collection(1, formats)["artefacts"][0])
+            store.add(colldict)
+            fullname = os.path.join(fulldir, "{}.json".format(version))
+            with open(fullname, "w") as filehandle:
+                json.dump(colldict, filehandle, indent=4)
+            fullsize += os.path.getsize(fullname)
+        uuid = colldict["UUID"]
+
+        def rebuild():
+            for version in range(1, versions + 1):
+                store.get(uuid, version)
+
+        def load_full():
+            for version in range(1, versions + 1):
+                fullname = os.path.join(fulldir, "{}.json".format(version))
+                with open(fullname) as filehandle:
+                    json.load(filehandle)
+
+        if store.get(uuid, versions) != colldict:
+            print("ERROR: History store rebuilt a different version")
+            return False
+        rebuildtime = timeit(rebuild, rounds)
+        loadtime = timeit(load_full, rounds)
+        storesize = store.size(uuid)
+        print("History benchmark: {} versions, {} artefacts x {} formats"
+              .format(versions, artefacts, formats))
+        print("  full copies:        {:12d} bytes".format(fullsize))
+        print("  history store:      {:12d} bytes ({:.1f}%)".format(
+            storesize, 100.0 * storesize / fullsize))
+        print("  load full copy:     {:8.2f} ms/version".format(
+            loadtime * 1000 / versions))
+        print("  rebuild version:    {:8.2f} ms/version".format(
+            rebuildtime * 1000 / versions))
+    return True
+
+
+def bench_build(rounds: int, workers: int, debug: bool):
+    """Compare single pass threaded hashing with one read per digest."""
+    import hashlib
+    import os
+    import tempfile
+    from tco import build_collection
+
+    algorithms = ("sha256", "sha512", "sha1")
+    filecount = 16
+    filesize = 4 * 1024 * 1024
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for fileno in range(filecount):
+            with open(os.path.join(tmpdir, "{}.bin".format(fileno)),
+                      "wb") as filehandle:
+                filehandle.write(os.urandom(filesize))
+
+        def separate():
+            for fileno in range(filecount):
+                filename = os.path.join(tmpdir, "{}.bin".format(fileno))
+                for algorithm in algorithms:
+                    with open(filename, "rb") as filehandle:
+                        hashlib.file_digest(filehandle, algorithm)
+
+        def single_pass():
+            return build_collection(
+                tmpdir, debug=debug, algorithms=algorithms, workers=workers)
+
+        separatetime = timeit(separate, rounds)
+        buildtime = timeit(single_pass, rounds)
+    megabytes = filecount * filesize / (1024 * 1024)
+    print("Build benchmark: {} files, {:.0f} MB, digests {}".format(
+        filecount, megabytes, ",".join(algorithms)))
+    print("  read per digest:    {:8.2f} ms ({:.0f} MB/s)".format(
+        separatetime * 1000, megabytes / separatetime))
+    print("  single pass build:  {:8.2f} ms ({:.0f} MB/s)".format(
+        buildtime * 1000, megabytes / buildtime))
+    return True
+
+
+def bench_serialize(artefacts: int, formats: int, rounds: int, debug: bool):
+    """Time printing a collection again after editing one artefact."""
+    import json
+    from tco import dict2object
+
+    col = dict2object(make_collection(artefacts, formats), debug=debug)
+    if col is None:
+        print("ERROR: Synthetic collection did not validate")
+        return False
+    artlist = col.collection["artefacts"]
+
+    def full():
+        newcol = dict(col.collection)
+        newcol["artefacts"] = list()
+        for art in artlist:
+            newart = dict(art.get_struct())
+            newart["formats"] = art.get_formats()
+            newcol["artefacts"].append(newart)
+        return json.dumps(newcol, sort_keys=False, indent=4)
+
+    def edit():
+        artlist[len(artlist) // 2].set_name(str(time.perf_counter()))
+        artlist[0].artefact["formats"][0].set_size(time.perf_counter_ns())
+        return str(col)
+
+    if edit() != full():
+        print("ERROR: Cached output differs from full encoding")
+        return False
+    fulltime = timeit(full, rounds)
+    edittime = timeit(edit, rounds)
+    print("Serialize benchmark: {} artefacts, {} formats each".format(
+        artefacts, formats))
+    print("  full encoding:      {:8.2f} ms".format(fulltime * 1000))
+    print("  after small edit:   {:8.2f} ms".format(edittime * 1000))
+    return True
+
+
+def bench_shard(artefacts: int, formats: int, rounds: int, debug: bool):
+    """Compare single file and sharded collections for partial work."""
+    import json
+    import os
+    import tempfile
+    from tea_collection import sharded_collection
+
+    colldict = make_collection(artefacts, formats)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "collection.json")
+        sharddir = os.path.join(tmpdir, "sharded")
+        sharded = sharded_collection(sharddir, debug=debug)
+        sharded.write(colldict)
+        wanted = colldict["artefacts"][artefacts // 2]["uuid"]
+
+        def write_single():
+            with open(filename, "w", encoding="utf-8") as filehandle:
+                filehandle.write(json.dumps(colldict, indent=4))
+
+        def read_single():
+            with open(filename, "rb") as filehandle:
+                data = json.loads(filehandle.read())
+            return [art for art in data["artefacts"] if art["uuid"] == wanted]
+
+        def read_shard():
+            reader = sharded_collection(sharddir, debug=debug)
+            reader.open()
+            return reader.load([wanted])["artefacts"]
+
+        def edit_shard():
+            colldict["artefacts"][0]["description"] = str(time.perf_counter())
+            return sharded.write(colldict)
+
+        writetime = timeit(write_single, rounds)
+        if read_single() != read_shard():
+            print("ERROR: Sharded artefact differs from single file")
+            return False
+        singletime = timeit(read_single, rounds)
+        shardtime = timeit(read_shard, rounds)
+        edittime = timeit(edit_shard, rounds)
+    print("Shard benchmark: {} artefacts, {} formats each".format(
+        artefacts, formats))
+    print("  read 1 artefact, single file:  {:8.2f} ms".format(
+        singletime * 1000))
+    print("  read 1 artefact, sharded:      {:8.2f} ms".format(
+        shardtime * 1000))
+    print("  write after edit, single file: {:8.2f} ms".format(
+        writetime * 1000))
+    print("  write after edit, sharded:     {:8.2f} ms".format(
+        edittime * 1000))
+    return True
+
+
+def bench_async(artefacts: int, formats: int, rounds: int, debug: bool):
+    """Measure event loop lag while validating collections.
+
+    A ticker task sleeps in short steps and records how late it wakes
+    up. Validation with the blocking API stalls the loop for the whole
+    file, the asyncio API hands the work to the executor.
+    """
+    import asyncio
+    import json
+    import os
+    import tempfile
+    import tco
+
+    filecount = 4
+    tick = 0.005
+
+    async def measure(validate, files):
+        lags = list()
+        running = True
+
+        async def ticker():
+            loop = asyncio.get_running_loop()
+            while running:
+                start = loop.time()
+                await asyncio.sleep(tick)
+                lags.append(loop.time() - start - tick)
+
+        task = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        results = await validate(files)
+        elapsed = time.perf_counter() - start
+        running = False
+        await task
+        lags.sort()
+        if len(lags) == 0:
+            lags = [elapsed]
+        return (all(results), elapsed, lags[-1],
+                lags[int(len(lags) * 0.99)])
+
+    async def blocking(files):
+        return [tco.validate_collection(file, debug) for file in files]
+
+    async def native(files):
+        return await tco.validate_many_async(files, debug)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        files = list()
+        for fileno in range(filecount):
+            filename = os.path.join(tmpdir, "{}.json".format(fileno))
+            with open(filename, "w", encoding="utf-8") as filehandle:
+                json.dump(make_collection(artefacts, formats), filehandle)
+            files.append(filename)
+        print("Async benchmark: {} files of {} artefacts".format(
+            filecount, artefacts))
+        for name, validate in (("blocking", blocking), ("asyncio", native)):
+            best = None
+            for _ in range(rounds):
+                ok, elapsed, maxlag, p99lag = asyncio.run(
+                    measure(validate, files))
+                if not ok:
+                    print("ERROR: {} validation failed".format(name))
+                    return False
+                if best is None or maxlag < best[1]:
+                    best = (elapsed, maxlag, p99lag)
+            print("  {:9s} total {:8.2f} ms, loop lag max {:8.2f} ms, "
+                  "p99 {:8.2f} ms".format(
+                      name, best[0] * 1000, best[1] * 1000, best[2] * 1000))
+    return True
+
+
+def bench_pool(artefacts: int, formats: int, rounds: int, debug: bool):
+    """Time reading from the shared memory pool.
+
+    The first get_artefact() in a process decodes the slices of one
+    artefact and its formats, the first get_collection() all of them.
+    Later calls use the per process cache.
+    """
+    import os
+    from tea_collection import collection_pool
+
+    colldict = make_collection(artefacts, formats)
+    pool = collection_pool("tcobench-{}".format(os.getpid()), debug=debug)
+    if not pool.create([colldict]):
+        return False
+    uuid = colldict["UUID"]
+    artuuid = colldict["artefacts"][artefacts // 2]["uuid"]
+    try:
+        def raw():
+            view = pool.get_raw(uuid)
+            length = len(view)
+            view.release()
+            return length
+
+        def first_artefact():
+            pool._cache = dict()
+            return pool.get_artefact(artuuid)
+
+        def first():
+            pool._cache = dict()
+            return pool.get_collection(uuid)
+
+        def cached():
+            return pool.get_collection(uuid)
+
+        rawtime = timeit(raw, rounds)
+        arttime = timeit(first_artefact, rounds)
+        firsttime = timeit(first, rounds)
+        cachedtime = timeit(cached, rounds)
+        print("Pool benchmark: {} artefacts x {} formats, {} bytes".format(
+            artefacts, formats, pool._data.size))
+        print("  get_raw:            {:8.3f} ms".format(rawtime * 1000))
+        print("  first artefact:     {:8.3f} ms".format(arttime * 1000))
+        print("  first collection:   {:8.3f} ms".format(firsttime * 1000))
+        print("  cached collection:  {:8.3f} ms".format(cachedtime * 1000))
+    finally:
+        pool.unlink()
+    return True
+
+
+def measure_retained(function, count: int):
+    """Return bytes and blocks per item kept alive by function().
+
+    The function returns what it built, which is held while measuring."""
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    before = tracemalloc.take_snapshot()
+    kept = function()
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    size = 0
+    blocks = 0
+    for stat in after.compare_to(before, "filename"):
+        size += stat.size_diff
+        blocks += stat.count_diff
+    del kept
+    return size / count, blocks / count
+
+
+def measure_peak(function):
+    """Return the peak of traced memory while function() runs, above
+    what was allocated before."""
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    return peak - start
+
+
+def memory_metrics(scales: list, debug: bool) -> dict:
+    """Measure memory use of objects, loading and serializing."""
+    import json
+    import os
+    import tempfile
+    import tracemalloc
+    from tco import dict2object
+    from tco import validate_collection
+    from tea_collection import artefact
+    from tea_collection import collection
+    from tea_collection import format
+
+    metrics = dict()
+    tracemalloc.start()
+    try:
+        count = 1000
+        metrics["collection_bytes"], _ = measure_retained(
+            lambda: [collection(debug=debug) for _ in range(count)], count)
+        metrics["artefact_bytes"], _ = measure_retained(
+            lambda: [artefact(debug=debug) for _ in range(count)], count)
+        metrics["format_bytes"], _ = measure_retained(
+            lambda: [format(debug=debug) for _ in range(count)], count)
+
+        for artefacts, formats in scales:
+            scale = "{}x{}".format(artefacts, formats)
+            colldict = make_collection(artefacts, formats)
+            size, blocks = measure_retained(
+                lambda: dict2object(colldict, debug=debug), artefacts)
+            metrics["loaded_bytes_per_artefact@" + scale] = size
+            metrics["loaded_blocks_per_artefact@" + scale] = blocks
+            metrics["dict2object_peak_per_artefact@" + scale] = measure_peak(
+                lambda: dict2object(colldict, debug=debug)) / artefacts
+            col = dict2object(colldict, debug=debug)
+            metrics["str_peak_per_artefact@" + scale] = measure_peak(
+                lambda: str(col)) / artefacts
+            # The JSON fragments kept in the objects, not the text
+            col = dict2object(colldict, debug=debug)
+            size, _ = measure_retained(
+                lambda: str(col) and None, artefacts)
+            metrics["str_retained_per_artefact@" + scale] = size
+            del col
+            with tempfile.TemporaryDirectory() as tmpdir:
+                filename = os.path.join(tmpdir, "collection.json")
+                with open(filename, "w") as filehandle:
+                    json.dump(colldict, filehandle, indent=4)
+                filesize = os.path.getsize(filename)
+                # Warm up, so imports on first use are not counted
+                validate_collection(filename, debug=debug)
+                metrics["validate_peak_ratio@" + scale] = measure_peak(
+                    lambda: validate_collection(filename, debug=debug)
+                ) / filesize
+    finally:
+        tracemalloc.stop()
+    return metrics
+
+
+def bench_memory(baseline: str, update: bool, tolerance: float, debug: bool):
+    """Report memory metrics and compare them with a stored baseline.
+
+    Fails if a metric is more than tolerance above its baseline."""
+    import json
+    import platform
+
+    scales = [(10, 2), (100, 3), (1000, 3)]
+    metrics = memory_metrics(scales, debug)
+    print("Memory benchmark (tracemalloc)")
+    for name, value in metrics.items():
+        print("  {:45} {:12.1f}".format(name, value))
+
+    pyversion = ".".join(platform.python_version_tuple()[:2])
+    if update:
+        with open(baseline, "w") as filehandle:
+            json.dump(
+                {"python": pyversion, "metrics": metrics},
+                filehandle, indent=4)
+            filehandle.write("\n")
+        print("Baseline written to {}".format(baseline))
+        return True
+    try:
+        with open(baseline) as filehandle:
+            stored = json.load(filehandle)
+    except FileNotFoundError:
+        print("WARNING: No memory baseline {}, use --update-baseline"
+              .format(baseline))
+        return True
+    if stored.get("python") != pyversion:
+        print("WARNING: Baseline is from Python {}, this is {}".format(
+            stored.get("python"), pyversion))
+    ok = True
+    for name, value in metrics.items():
+        if name not in stored["metrics"]:
+            continue
+        limit = stored["metrics"][name] * (1 + tolerance)
+        if value > limit:
+            print("ERROR: Memory regression {}: {:.1f} > {:.1f} "
+                  "(baseline {:.1f})".format(
+                      name, value, limit, stored["metrics"][name]))
+            ok = False
+    if ok:
+        print("  all metrics within {:.0f}% of baseline".format(
+            tolerance * 100))
+    return ok
+
+
+def main():
+    """Run the selected benchmarks."""
+    parser = argparse.ArgumentParser(
+        description='Benchmarks for the TEA Collections library.')
+    parser.add_argument(
+        '-d', '--debug',
+        action="store_true",
+        help='Turn on debug output for developers')
+    parser.add_argument(
+        '--artefacts', '-a',
+        type=int,
+        default=2000,
+        help='Number of artefacts in the synthetic collection')
+    parser.add_argument(
+        '--formats', '-f',
+        type=int,
+        default=3,
+        help='Number of formats per artefact')
+    parser.add_argument(
+        '--rounds', '-r',
+        type=int,
+        default=5,
+        help='Rounds per measurement, the best is reported')
+    parser.add_argument(
+        '--query', '-q',
+        action="store_true",
+        help='Benchmark pushdown queries')
+    parser.add_argument(
+        '--lazy', '-l',
+        action="store_true",
+        help='Benchmark lazy loading')
+    parser.add_argument(
+        '--parallel', '-p',
+        action="store_true",
+        help='Benchmark parallel validation')
+    parser.add_argument(
+        '--workers', '-j',
+        type=int,
+        default=4,
+        help='Worker processes for --parallel, threads for --build')
+    parser.add_argument(
+        '--compression', '-c',
+        action="store_true",
+        help='Benchmark compressed input and output')
+    parser.add_argument(
+        '--index', '-i',
+        action="store_true",
+        help='Benchmark the identifier index')
+    parser.add_argument(
+        '--history', '-H',
+        action="store_true",
+        help='Benchmark the version history store')
+    parser.add_argument(
+        '--build', '-b',
+        action="store_true",
+        help='Benchmark building collections from files')
+    parser.add_argument(
+        '--serialize', '-S',
+        action="store_true",
+        help='Benchmark printing a collection after small edits')
+    parser.add_argument(
+        '--shard', '-s',
+        action="store_true",
+        help='Benchmark the sharded collection layout')
+    parser.add_argument(
+        '--async', '-A',
+        dest="async_",
+        action="store_true",
+        help='Benchmark event loop lag of the asyncio API')
+    parser.add_argument(
+        '--pool', '-P',
+        action="store_true",
+        help='Benchmark reading from the shared memory pool')
+    parser.add_argument(
+        '--memory', '-m',
+        action="store_true",
+        help='Measure memory use and compare with the baseline')
+    parser.add_argument(
+        '--baseline',
+        type=str,
+        default=MEMORY_BASELINE,
+        help='Memory baseline file')
+    parser.add_argument(
+        '--update-baseline',
+        action="store_true",
+        help='Write the measured memory use as the new baseline')
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.10,
+        help='Allowed memory growth over the baseline, 0.10 is 10%%')
+    args = parser.parse_args()
+    runall = not (
+        args.query or args.lazy or args.parallel or args.compression
+        or args.index or args.history or args.build or args.serialize
+        or args.shard or args.async_ or args.pool or args.memory)
+
+    ok = True
+    if args.query or runall:
+        ok = bench_query(
+            args.artefacts, args.formats, args.rounds, args.debug) and ok
+    if args.lazy or runall:
+        ok = bench_lazy(
+            args.artefacts, args.formats, args.rounds, args.debug) and ok
+    if args.parallel or runall:
+        ok = bench_parallel(
+            args.artefacts, args.formats, args.rounds, args.workers,
+            args.debug) and ok
+    if args.compression or runall:
+        ok = bench_compression(
+            args.artefacts, args.formats, args.rounds, args.debug) and ok
+    if args.index or runall:
+        ok = bench_index(
+            args.artefacts, args.formats, args.rounds, args.debug) and ok
+    if args.history or runall:
+        ok = bench_history(
+            args.artefacts, args.formats, args.rounds, args.debug) and ok
+    if args.build or runall:
+        ok = bench_build(args.rounds, args.workers, args.debug) and ok
+    if args.serialize or runall:
+        ok = bench_serialize(
+            args.artefacts, args.formats, args.rounds, args.debug) and ok
+    if args.shard or runall:
+        ok = bench_shard(
+            args.artefacts, args.formats, args.rounds, args.debug) and ok
+    if args.async_ or runall:
+        ok = bench_async(
+            args.artefacts, args.formats, args.rounds, args.debug) and ok
+    if args.pool or runall:
+        ok = bench_pool(
+            args.artefacts, args.formats, args.rounds, args.debug) and ok
+    if args.memory or runall:
+        ok = bench_memory(
+            args.baseline, args.update_baseline, args.tolerance,
+            args.debug) and ok
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
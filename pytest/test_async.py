@@ -0,0 +1,23 @@
+"""Tests of the asyncio API."""
+import asyncio
+import json
+import os
+import tco
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "..", "test_data")
+
+
+def test_not_an_object():
+    assert tco.dict2object([1, 2], debug=False) is None
+    assert asyncio.run(tco.dict2object_async([1, 2], debug=False)) is None
+    assert tco.check_spec("text")[0] == 1
+
+
+def test_validate_many_reports_each_file(tmp_path):
+    listfile = tmp_path / "list.json"
+    listfile.write_text(json.dumps([1, 2]))
+    good = os.path.join(TEST_DATA, "collection01.json")
+    bad = os.path.join(TEST_DATA, "collection01-no-uuid.json")
+    results = asyncio.run(tco.validate_many_async(
+        [good, str(listfile), bad, 12345, good], debug=False))
+    assert results == [True, False, False, False, True]
@@ -0,0 +1,31 @@
+"""Tests of building collections from artefact files."""
+import hashlib
+import os
+import tco
+
+
+def test_build(tmp_path):
+    (tmp_path / "sbom.json").write_bytes(b"{}")
+    (tmp_path / "sbom.json.sig").write_bytes(b"sig")
+    col = tco.build_collection(
+        str(tmp_path), debug=False, algorithms=("sha256", "sha512"))
+    assert col is not None
+    arts = col.collection["artefacts"]
+    assert len(arts) == 1
+    form = arts[0].artefact["formats"][0].format
+    assert form["url"] == "sbom.json"
+    assert form["sigurl"] == "sbom.json.sig"
+    assert "sha256:" + hashlib.sha256(b"{}").hexdigest() in form["hash"]
+
+
+def test_build_unreadable_file(tmp_path, capsys):
+    (tmp_path / "a.txt").write_bytes(b"a")
+    os.symlink(str(tmp_path / "missing"), str(tmp_path / "dangling"))
+    assert tco.build_collection(str(tmp_path), debug=False) is None
+    assert "Can't read" in capsys.readouterr().out
+
+
+def test_build_variable_length_digest(tmp_path):
+    (tmp_path / "a.txt").write_bytes(b"a")
+    assert tco.build_collection(
+        str(tmp_path), debug=False, algorithms=("shake_128",)) is None
@@ -0,0 +1,67 @@
+"""Tests of the batch checkpoint database."""
+import os
+import pytest
+from tea_collection import checkpoint
+from tea_collection import checkpoint_db
+
+
+@pytest.fixture
+def queue(tmp_path):
+    myqueue = checkpoint_db(str(tmp_path / "checkpoint.db"), debug=False)
+    assert myqueue.open()
+    yield myqueue
+    myqueue.close()
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = list()
+    for name in ("a.json", "b.json"):
+        (tmp_path / name).write_text("{}")
+        paths.append(str(tmp_path / name))
+    return paths
+
+
+def test_claim_and_finish(queue, files):
+    assert queue.enqueue(files) == 2
+    claimed = queue.claim(5)
+    assert sorted(claimed) == sorted(os.path.realpath(f) for f in files)
+    assert queue.claim() == []
+    for path in claimed:
+        queue.finish(path, True)
+    assert queue.counts()["ok"] == 2
+
+
+def test_same_file_other_path(queue, files, tmp_path, monkeypatch):
+    assert queue.enqueue(files) == 2
+    monkeypatch.chdir(str(tmp_path))
+    assert queue.enqueue(["a.json", "./b.json"]) == 0
+
+
+def test_changed_file_queued_again(queue, files):
+    queue.enqueue(files)
+    for path in queue.claim(5):
+        queue.finish(path, True)
+    with open(files[0], "a") as filehandle:
+        filehandle.write(" ")
+    assert queue.enqueue(files) == 1
+    assert queue.counts()["pending"] == 1
+
+
+def test_reclaim_dead_process(queue, files):
+    queue.enqueue(files)
+    queue.claim(5)
+    queue._db.execute("UPDATE jobs SET pid = 0x7ffffff0")
+    assert queue.reclaim() == 2
+
+
+def test_reclaim_reused_pid(queue, files):
+    if checkpoint._process_start(os.getpid()) is None:
+        pytest.skip("no process start times on this system")
+    queue.enqueue(files)
+    queue.claim(5)
+    # A live worker keeps its jobs
+    assert queue.reclaim() == 0
+    # The same PID with another start time is another process
+    queue._db.execute("UPDATE jobs SET pidstart = pidstart - 1")
+    assert queue.reclaim() == 2
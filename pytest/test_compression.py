@@ -0,0 +1,33 @@
+"""Tests of compressed collection files."""
+import json
+import os
+import pytest
+import tco
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "..", "test_data")
+
+
+@pytest.fixture
+def col():
+    filename = os.path.join(TEST_DATA, "collection01.json")
+    with open(filename, encoding="utf-8") as filehandle:
+        return tco.dict2object(json.load(filehandle), debug=False)
+
+
+@pytest.mark.parametrize("suffix", [".json", ".json.gz", ".json.xz"])
+def test_round_trip(tmp_path, col, suffix):
+    filename = str(tmp_path / ("out" + suffix))
+    assert tco.write_collection(col, filename, debug=False, level=1)
+    filehandle = tco.open_collection_file(filename, "r", debug=False)
+    assert filehandle.read() == str(col)
+    filehandle.close()
+
+
+@pytest.mark.parametrize("suffix,level", [
+    (".json.gz", 42), (".json.gz", -1), (".json.xz", 10), (".json.zst", 23)])
+def test_bad_level_keeps_file(tmp_path, col, suffix, level):
+    filename = tmp_path / ("out" + suffix)
+    filename.write_bytes(b"old")
+    assert not tco.write_collection(
+        col, str(filename), debug=False, level=level)
+    assert filename.read_bytes() == b"old"
@@ -0,0 +1,110 @@
+"""Tests of collection deltas and the version history store."""
+import copy
+import json
+import os
+import pytest
+from tea_collection import history_store
+from tea_collection.history import apply_delta
+from tea_collection.history import make_delta
+
+UUID = "6f6c6c65-0000-4000-8000-000000000001"
+TEST_DATA = os.path.join(os.path.dirname(__file__), "..", "test_data")
+
+
+@pytest.fixture
+def colldict():
+    filename = os.path.join(TEST_DATA, "collection01.json")
+    with open(filename, encoding="utf-8") as filehandle:
+        return json.load(filehandle)
+
+
+def round_trip(old, new):
+    """Check that a delta turns old into new, without changing old."""
+    before = copy.deepcopy(old)
+    delta = make_delta(old, new)
+    assert delta is not None
+    # Deltas are stored as JSON
+    delta = json.loads(json.dumps(delta))
+    assert apply_delta(old, delta) == new
+    assert old == before
+    return delta
+
+
+def test_unchanged(colldict):
+    delta = round_trip(colldict, copy.deepcopy(colldict))
+    assert delta == {"fields": {}}
+
+
+def test_fields(colldict):
+    new = copy.deepcopy(colldict)
+    new["version"] += 1
+    new["author_org"] = "Changed Inc"
+    del new["product_tei_id"]
+    delta = round_trip(colldict, new)
+    assert "artefacts" not in delta
+    assert delta["removed"] == ["product_tei_id"]
+
+
+def test_artefact_and_format_changes(colldict):
+    new = copy.deepcopy(colldict)
+    art = new["artefacts"][0]
+    art["name"] = "Changed"
+    art["formats"][0]["url"] = "https://example.com/changed"
+    del art["formats"][0]["size"]
+    art["formats"].append(dict(art["formats"][0], uuid=UUID))
+    delta = round_trip(colldict, new)
+    artuuid = art["uuid"]
+    assert list(delta["artefacts"]["changed"].keys()) == [artuuid]
+    assert "order" in delta["artefacts"]["changed"][artuuid]["formats"]
+
+
+def test_artefact_order_add_remove(colldict):
+    new = copy.deepcopy(colldict)
+    added = copy.deepcopy(new["artefacts"][0])
+    added["uuid"] = UUID
+    new["artefacts"].reverse()
+    new["artefacts"].append(added)
+    new["artefacts"].pop(0)
+    delta = round_trip(colldict, new)
+    assert delta["artefacts"]["changed"][UUID] == {"full": added}
+
+
+def test_no_uuid_keys(colldict):
+    new = copy.deepcopy(colldict)
+    del new["artefacts"][0]["uuid"]
+    assert make_delta(colldict, new) is None
+
+
+def test_store(tmp_path, colldict):
+    store = history_store(str(tmp_path), debug=False, snapshot_every=3)
+    versions = list()
+    col = copy.deepcopy(colldict)
+    for version in range(1, 8):
+        col = copy.deepcopy(col)
+        col["version"] = version
+        col["artefacts"][0]["name"] = "Version {}".format(version)
+        assert store.add(col)
+        versions.append(col)
+    assert store.versions(colldict["UUID"]) == list(range(1, 8))
+    for col in versions:
+        assert store.get(colldict["UUID"], col["version"]) == col
+    assert not store.add(versions[0])
+
+
+def test_store_rejects_bad_uuid(tmp_path, colldict):
+    store = history_store(str(tmp_path / "store"), debug=False)
+    colldict["UUID"] = "../../escape"
+    assert not store.add(colldict)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_store_same_version_again(tmp_path, colldict):
+    store = history_store(str(tmp_path), debug=False)
+    assert store.add(colldict)
+    assert store.add(copy.deepcopy(colldict))
+    # A new store object reads the latest version from disk
+    store = history_store(str(tmp_path), debug=False)
+    assert store.add(copy.deepcopy(colldict))
+    assert store.versions(colldict["UUID"]) == [colldict["version"]]
+    colldict["author_org"] = "Changed Inc"
+    assert not store.add(colldict)
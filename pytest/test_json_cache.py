@@ -0,0 +1,132 @@
+"""Tests of the cached JSON fragments.
+
+After every setter, printing must give the same text as encoding the
+whole collection again.
+"""
+import json
+import os
+import pytest
+import tco
+from tea_collection import artefact
+from tea_collection import format
+
+UUID = "6f6c6c65-0000-4000-8000-000000000001"
+TEST_DATA = os.path.join(os.path.dirname(__file__), "..", "test_data")
+
+
+def full_encoding(col):
+    """Encode a collection from its dicts, without any cache."""
+    colldict = dict(col.collection)
+    colldict["artefacts"] = list()
+    for art in col.collection["artefacts"]:
+        artdict = dict(art.get_struct())
+        artdict["formats"] = art.get_formats()
+        colldict["artefacts"].append(artdict)
+    return json.dumps(colldict, sort_keys=False, indent=4)
+
+
+@pytest.fixture
+def col():
+    filename = os.path.join(TEST_DATA, "collection01.json")
+    with open(filename, encoding="utf-8") as filehandle:
+        colldict = json.load(filehandle)
+    mycol = tco.dict2object(colldict, debug=False)
+    assert mycol is not None
+    # Fill all caches
+    assert str(mycol) == full_encoding(mycol)
+    return mycol
+
+
+def first_artefact(mycol):
+    return mycol.collection["artefacts"][0]
+
+
+def first_format(mycol):
+    return first_artefact(mycol).artefact["formats"][0]
+
+
+@pytest.mark.parametrize("change", [
+    lambda c: c.set_author("Arthur Dent", "Earth", "arthur@example.com"),
+    lambda c: c.set_product("Towel", "42", "20240101", "purl:towel"),
+    lambda c: c.set_version(7),
+    lambda c: c.replace_uuid(UUID),
+])
+def test_collection_setters(col, change):
+    assert change(col)
+    assert str(col) == full_encoding(col)
+
+
+@pytest.mark.parametrize("change", [
+    lambda a: a.set_author("Arthur Dent", "Earth", "arthur@example.com"),
+    lambda a: a.set_name("Changed name"),
+    lambda a: a.set_description("Changed description"),
+    lambda a: a.replace_uuid(UUID),
+    lambda a: a.add_format(format(debug=False)),
+])
+def test_artefact_setters(col, change):
+    assert change(first_artefact(col))
+    assert str(col) == full_encoding(col)
+
+
+@pytest.mark.parametrize("change", [
+    lambda f: f.set_mediatype("text/plain"),
+    lambda f: f.set_category("attestation"),
+    lambda f: f.set_hash("sha256:00"),
+    lambda f: f.set_size(4711),
+    lambda f: f.set_attributes("sha256:11", 17),
+    lambda f: f.set_url("https://example.com/x", "https://example.com/x.sig"),
+    lambda f: f.set_bomidentifier("urn:uuid:" + UUID),
+    lambda f: f.replace_uuid(UUID),
+])
+def test_format_setters(col, change):
+    assert change(first_format(col))
+    assert str(col) == full_encoding(col)
+
+
+def test_direct_change_and_invalidate(col):
+    first_artefact(col).artefact["name"] = "Direct"
+    first_artefact(col).invalidate()
+    first_format(col).format["url"] = "https://example.com/direct"
+    first_format(col).invalidate()
+    col.collection["author_org"] = "Direct Inc"
+    col.invalidate()
+    assert str(col) == full_encoding(col)
+
+
+def test_shared_format():
+    form = format(debug=False)
+    arts = [artefact(debug=False), artefact(debug=False)]
+    for art in arts:
+        art.add_format(form)
+        str(art)
+    form.set_url("https://example.com/shared", None)
+    for art in arts:
+        assert "https://example.com/shared" in str(art)
+
+
+def test_levels(col):
+    art = first_artefact(col)
+    for level in (0, 2, 1, 2):
+        artdict = dict(art.get_struct())
+        artdict["formats"] = art.get_formats()
+        text = json.dumps(artdict, indent=4)
+        assert art.get_fragment(level) == text.replace(
+            "\n", "\n" + " " * (4 * level))
+
+
+def test_freed_without_cycle_collector():
+    import gc
+    import weakref
+
+    filename = os.path.join(TEST_DATA, "collection01.json")
+    with open(filename, encoding="utf-8") as filehandle:
+        mycol = tco.dict2object(json.load(filehandle), debug=False)
+    str(mycol)
+    refs = [weakref.ref(mycol), weakref.ref(first_artefact(mycol)),
+            weakref.ref(first_format(mycol))]
+    gc.disable()
+    try:
+        del mycol
+        assert [ref() for ref in refs] == [None, None, None]
+    finally:
+        gc.enable()
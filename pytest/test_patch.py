@@ -0,0 +1,126 @@
+"""Tests of field patches and JSON Patch (RFC 6902)."""
+import copy
+from tea_collection import patch
+
+
+def make_collection():
+    return {
+        "UUID": "6f6c6c65-0000-4000-8000-000000000001",
+        "author_org": "Example Inc",
+        "artefacts": [
+            {"uuid": "a1", "name": "SBOM", "formats": [
+                {"uuid": "f1", "url": "https://x/?a!=b", "mediatype": "m1"},
+                {"uuid": "f2", "url": "https://x/2", "mediatype": "m2"}]},
+            {"uuid": "a2", "name": "VEX", "formats": []}
+        ]
+    }
+
+
+def apply(patchdata, colldict):
+    mypatch = patch(debug=False)
+    errors, errmsg = mypatch.load(patchdata)
+    assert errors == 0, errmsg
+    return mypatch.apply(colldict)
+
+
+def test_move():
+    colldict = make_collection()
+    changes, fieldschanged, touched, errors, _ = apply([
+        {"op": "move", "from": "/artefacts/0/formats/1",
+         "path": "/artefacts/1/formats/-"}], colldict)
+    assert errors == 0
+    assert changes == 1
+    assert not fieldschanged
+    assert [form["uuid"] for form in colldict["artefacts"][0]["formats"]] \
+        == ["f1"]
+    assert colldict["artefacts"][1]["formats"][0]["uuid"] == "f2"
+    assert sorted(art["uuid"] for art in touched) == ["a1", "a2"]
+
+
+def test_move_into_itself():
+    colldict = make_collection()
+    original = copy.deepcopy(colldict)
+    _, _, _, errors, _ = apply([
+        {"op": "move", "from": "/artefacts/0",
+         "path": "/artefacts/0/formats/0"}], colldict)
+    assert errors == 1
+    assert colldict == original
+
+
+def test_copy():
+    colldict = make_collection()
+    changes, _, touched, errors, _ = apply([
+        {"op": "copy", "from": "/artefacts/0/name",
+         "path": "/artefacts/1/description"}], colldict)
+    assert errors == 0
+    assert changes == 1
+    assert colldict["artefacts"][1]["description"] == "SBOM"
+    assert [art["uuid"] for art in touched] == ["a2"]
+    # The copy is not shared with the source
+    apply([{"op": "copy", "from": "/artefacts/0/formats/0",
+            "path": "/artefacts/1/formats/0"}], colldict)
+    colldict["artefacts"][1]["formats"][0]["url"] = "changed"
+    assert colldict["artefacts"][0]["formats"][0]["url"] == "https://x/?a!=b"
+
+
+def test_test_operation():
+    colldict = make_collection()
+    changes, fieldschanged, _, errors, _ = apply([
+        {"op": "test", "path": "/author_org", "value": "Example Inc"},
+        {"op": "replace", "path": "/author_org", "value": "Other Inc"}],
+        colldict)
+    assert errors == 0
+    assert changes == 1
+    assert fieldschanged
+    assert colldict["author_org"] == "Other Inc"
+
+
+def test_failed_test_rolls_back():
+    colldict = make_collection()
+    original = copy.deepcopy(colldict)
+    changes, _, touched, errors, errmsg = apply([
+        {"op": "replace", "path": "/artefacts/0/name", "value": "New"},
+        {"op": "test", "path": "/author_org", "value": "Wrong Inc"}],
+        colldict)
+    assert errors == 1
+    assert "test failed" in errmsg[0]
+    assert changes == 0
+    assert touched == []
+    assert colldict == original
+
+
+def test_error_rolls_back():
+    colldict = make_collection()
+    original = copy.deepcopy(colldict)
+    _, _, _, errors, _ = apply([
+        {"op": "add", "path": "/artefacts/0/name2", "value": "x"},
+        {"op": "remove", "path": "/artefacts/5"}], colldict)
+    assert errors == 1
+    assert colldict == original
+
+
+def test_pointer_escapes():
+    colldict = make_collection()
+    apply([{"op": "add", "path": "/a~1b~0c", "value": 1}], colldict)
+    assert colldict["a/b~c"] == 1
+
+
+def test_bad_operations():
+    mypatch = patch(debug=False)
+    errors, _ = mypatch.load([
+        {"op": "move", "path": "/x"},
+        {"op": "add", "path": "/x"},
+        {"op": "frobnicate", "path": "/x"}])
+    assert errors == 3
+
+
+def test_field_patch_where():
+    colldict = make_collection()
+    changes, _, touched, errors, _ = apply({"patch": [
+        {"replace": "format.url", "old": "https://x/", "new": "https://y/",
+         "where": ["format.url==https://x/?a!=b"]}]}, colldict)
+    assert errors == 0
+    assert changes == 1
+    assert colldict["artefacts"][0]["formats"][0]["url"] == "https://y/?a!=b"
+    assert colldict["artefacts"][0]["formats"][1]["url"] == "https://x/2"
+    assert [art["uuid"] for art in touched] == ["a1"]
@@ -0,0 +1,87 @@
+"""Tests of query filters and the parser hook pruning."""
+import json
+import pytest
+from tea_collection import query
+
+
+def make_text():
+    return json.dumps({
+        "UUID": "6f6c6c65-0000-4000-8000-000000000001",
+        "product_name": "Towel",
+        "artefacts": [
+            {"uuid": "a1", "name": "SBOM", "formats": [
+                {"uuid": "f1", "url": "https://x/?a!=b",
+                 "mediatype": "application/cyclonedx"},
+                {"uuid": "f2", "url": "https://x/2",
+                 "mediatype": "text/spdx"}]},
+            {"uuid": "a2", "name": "VEX", "formats": [
+                {"uuid": "f3", "url": "https://x/3", "mediatype": None}]},
+            {"uuid": "a3", "name": "Empty", "formats": []}
+        ]
+    })
+
+
+@pytest.mark.parametrize("spec,expected", [
+    ("format.url==https://x/?a!=b", ("format", "url", "==", "https://x/?a!=b")),
+    ("format.url!=a==b", ("format", "url", "!=", "a==b")),
+    ("artefact.name~=x!=y==z", ("artefact", "name", "~=", "x!=y==z")),
+    ("collection.product_name==", ("collection", "product_name", "==", "")),
+])
+def test_add_filter_split(spec, expected):
+    myquery = query(debug=False)
+    assert myquery.add_filter(spec)
+    level, key, operator, value = expected
+    assert myquery.filters[level] == [(key, operator, value)]
+
+
+@pytest.mark.parametrize("spec", [
+    None, "format.url", "format.nokey==x", "nolevel==x", "format.url=x"])
+def test_add_filter_rejects(spec):
+    assert not query(debug=False).add_filter(spec)
+
+
+def uuids(myquery):
+    colldict = myquery.load(make_text())
+    return [(art["uuid"], [form["uuid"] for form in art["formats"]])
+            for art in colldict["artefacts"]]
+
+
+def test_no_filters():
+    assert uuids(query(debug=False)) == [
+        ("a1", ["f1", "f2"]), ("a2", ["f3"]), ("a3", [])]
+
+
+def test_format_filter_prunes_artefacts():
+    myquery = query(debug=False)
+    myquery.add_filter("format.url==https://x/?a!=b")
+    assert uuids(myquery) == [("a1", ["f1"])]
+
+
+def test_null_and_not_equal():
+    myquery = query(debug=False)
+    myquery.add_filter("format.mediatype==null")
+    assert uuids(myquery) == [("a2", ["f3"])]
+    myquery = query(debug=False)
+    myquery.add_filter("format.mediatype!=text/spdx")
+    assert uuids(myquery) == [("a1", ["f1"]), ("a2", ["f3"])]
+
+
+def test_artefact_filter_keeps_formats():
+    myquery = query(debug=False)
+    myquery.add_filter("artefact.name~=mpt")
+    assert uuids(myquery) == [("a3", [])]
+
+
+def test_collection_filter():
+    myquery = query(debug=False)
+    myquery.add_filter("collection.product_name==Other")
+    assert uuids(myquery) == []
+
+
+def test_rows():
+    myquery = query(debug=False)
+    myquery.add_field("artefact.name")
+    myquery.add_field("format.uuid")
+    myquery.add_filter("format.mediatype~=application/")
+    assert myquery.rows(make_text()) == [
+        {"artefact.name": "SBOM", "format.uuid": "f1"}]
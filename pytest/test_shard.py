@@ -0,0 +1,84 @@
+"""Tests of the sharded collection layout."""
+import copy
+import json
+import os
+import pytest
+from tea_collection import shard
+from tea_collection import sharded_collection
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "..", "test_data")
+
+
+@pytest.fixture
+def colldict():
+    filename = os.path.join(TEST_DATA, "collection01.json")
+    with open(filename, encoding="utf-8") as filehandle:
+        return json.load(filehandle)
+
+
+def shard_files(path):
+    return sorted(os.listdir(os.path.join(path, shard.SHARD_DIR)))
+
+
+def test_round_trip(tmp_path, colldict):
+    sharded = sharded_collection(str(tmp_path), debug=False)
+    assert sharded.write(colldict) == len(colldict["artefacts"])
+    reader = sharded_collection(str(tmp_path), debug=False)
+    assert reader.open()
+    assert reader.load() == colldict
+    artuuid = colldict["artefacts"][-1]["uuid"]
+    assert reader.load([artuuid])["artefacts"] == [colldict["artefacts"][-1]]
+
+
+def test_only_changed_shards(tmp_path, colldict):
+    sharded = sharded_collection(str(tmp_path), debug=False)
+    sharded.write(colldict)
+    before = shard_files(str(tmp_path))
+    colldict["artefacts"][0]["name"] = "Changed"
+    assert sharded.write(colldict) == 1
+    after = shard_files(str(tmp_path))
+    # The old shard is replaced by one with a new name
+    assert len(after) == len(before)
+    assert len(set(after) - set(before)) == 1
+    reader = sharded_collection(str(tmp_path), debug=False)
+    assert reader.open()
+    assert reader.load() == colldict
+
+
+def test_failed_manifest_write(tmp_path, colldict, monkeypatch):
+    sharded = sharded_collection(str(tmp_path), debug=False)
+    sharded.write(colldict)
+    original = copy.deepcopy(colldict)
+    colldict["artefacts"][0]["name"] = "Changed"
+    write_atomic = shard._write_atomic
+
+    def failing(filename, data):
+        if filename.endswith(shard.MANIFEST):
+            raise OSError("disk full")
+        write_atomic(filename, data)
+
+    monkeypatch.setattr(shard, "_write_atomic", failing)
+    with pytest.raises(OSError):
+        sharded.write(colldict)
+    reader = sharded_collection(str(tmp_path), debug=False)
+    assert reader.open()
+    assert reader.load() == original
+
+
+def test_duplicate_uuid_in_other_case(tmp_path, colldict):
+    colldict["artefacts"].append(copy.deepcopy(colldict["artefacts"][0]))
+    colldict["artefacts"][-1]["uuid"] = colldict["artefacts"][0][
+        "uuid"].upper()
+    sharded = sharded_collection(str(tmp_path), debug=False)
+    assert sharded.write(colldict) is None
+
+
+def test_removed_artefact(tmp_path, colldict):
+    sharded = sharded_collection(str(tmp_path), debug=False)
+    sharded.write(colldict)
+    colldict["artefacts"].pop(0)
+    sharded.write(colldict)
+    assert len(shard_files(str(tmp_path))) == len(colldict["artefacts"])
+    reader = sharded_collection(str(tmp_path), debug=False)
+    reader.open()
+    assert reader.load() == colldict
@@ -0,0 +1,112 @@
+"""Tests of the shared memory collection pool."""
+import copy
+import json
+import os
+import pytest
+from tea_collection import collection_pool
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), "..", "test_data")
+
+
+@pytest.fixture
+def colldict():
+    filename = os.path.join(TEST_DATA, "collection01.json")
+    with open(filename, encoding="utf-8") as filehandle:
+        return json.load(filehandle)
+
+
+@pytest.fixture
+def owner(colldict):
+    pool = collection_pool("tcotest-{}".format(os.getpid()), debug=False)
+    assert pool.create([colldict])
+    yield pool
+    if pool._control is not None:
+        pool.unlink()
+
+
+@pytest.fixture
+def reader(owner):
+    pool = collection_pool(owner.name, debug=False)
+    assert pool.attach()
+    yield pool
+    pool.close()
+
+
+def test_attach(reader, colldict):
+    assert reader.uuids() == [colldict["UUID"]]
+    assert reader.get_struct(colldict["UUID"]) == colldict
+    assert reader.get_collection(colldict["UUID"].upper()).to_dict() \
+        == colldict
+
+
+def test_replace(owner, reader, colldict):
+    changed = copy.deepcopy(colldict)
+    changed["version"] += 1
+    assert owner.replace(changed)
+    # The reader keeps its generation until it refreshes
+    assert reader.get_struct(colldict["UUID"]) == colldict
+    assert reader.refresh()
+    assert reader.generation == owner.generation
+    assert reader.get_struct(colldict["UUID"]) == changed
+
+
+def test_replace_then_unlink(owner, reader, colldict):
+    assert owner.replace(colldict)
+    owner.unlink()
+    assert not reader.refresh()
+
+
+def test_bad_uuid(owner):
+    assert not owner.publish([{"UUID": "short"}])
+
+
+def test_get_artefact_and_format(reader, colldict):
+    art = colldict["artefacts"][0]
+    form = art["formats"][-1]
+    assert reader.artefact_uuids(colldict["UUID"]) == [
+        myart["uuid"] for myart in colldict["artefacts"]]
+    assert reader.get_artefact(art["uuid"].upper()).to_dict() == art
+    assert reader.get_format(form["uuid"]).to_dict() == form
+    # Only the touched objects are decoded
+    assert len(reader._cache) == 1 + len(art["formats"])
+    # The frozen objects are shared with the full collection
+    col = reader.get_collection(colldict["UUID"])
+    assert col.get_artefact(art["uuid"]) is reader.get_artefact(art["uuid"])
+    assert reader.get_artefact(colldict["UUID"]) is None
+    assert reader.get_format("not a uuid") is None
+
+
+def test_raw_slices(reader, colldict):
+    import json
+    from tea_collection import shmpool
+
+    fields = json.loads(bytes(reader.get_raw(colldict["UUID"])))
+    assert "artefacts" not in fields
+    assert fields["version"] == colldict["version"]
+    art = colldict["artefacts"][0]
+    view = reader.get_raw(art["uuid"], shmpool.ARTEFACT)
+    assert json.loads(bytes(view))["name"] == art["name"]
+    view.release()
+
+
+def test_replace_keeps_others(owner, reader, colldict):
+    other = copy.deepcopy(colldict)
+    other["UUID"] = "6f6c6c65-0000-4000-8000-000000000001"
+    other["artefacts"] = other["artefacts"][:1]
+    other["artefacts"][0]["name"] = "Other"
+    assert owner.replace(other)
+    changed = copy.deepcopy(colldict)
+    changed["version"] += 1
+    assert owner.replace(changed)
+    assert reader.refresh()
+    assert reader.uuids() == [other["UUID"], colldict["UUID"]]
+    assert reader.get_struct(other["UUID"]) == other
+    assert reader.get_struct(colldict["UUID"]) == changed
+    # The artefact UUID is in both, the collection published first wins
+    artuuid = other["artefacts"][0]["uuid"]
+    assert reader.get_artefact(artuuid)["name"] == "Other"
+
+
+def test_bad_artefact_uuid(owner, colldict):
+    colldict["artefacts"][0]["formats"][0]["uuid"] = "short"
+    assert not owner.publish([colldict])
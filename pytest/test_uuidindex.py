@@ -0,0 +1,57 @@
+"""Tests of the identifier index."""
+import copy
+import json
+import os
+import pytest
+from tea_collection import uuid_index
+
+UUID = "6f6c6c65-0000-4000-8000-000000000001"
+TEST_DATA = os.path.join(os.path.dirname(__file__), "..", "test_data")
+
+
+@pytest.fixture
+def colldict():
+    filename = os.path.join(TEST_DATA, "collection01.json")
+    with open(filename, encoding="utf-8") as filehandle:
+        return json.load(filehandle)
+
+
+@pytest.fixture
+def index(tmp_path, colldict):
+    myindex = uuid_index(
+        str(tmp_path / "index.db"), debug=False, capacity=1000)
+    assert myindex.open()
+    assert myindex.add(colldict) > 0
+    yield myindex
+    myindex.close()
+
+
+def test_same_collection(index, colldict):
+    assert index.check(colldict) == (0, [])
+
+
+def test_reused_uuid_in_other_case(index, colldict):
+    other = copy.deepcopy(colldict)
+    other["UUID"] = UUID
+    artuuid = other["artefacts"][0]["uuid"]
+    other["artefacts"][0]["uuid"] = artuuid.upper()
+    errors, errmsg = index.check(other)
+    assert errors > 0
+    assert any(artuuid in msg for msg in errmsg)
+
+
+def test_duplicate_in_collection(index, colldict):
+    other = copy.deepcopy(colldict)
+    other["artefacts"].append(copy.deepcopy(other["artefacts"][0]))
+    other["artefacts"][-1]["uuid"] = other["artefacts"][0]["uuid"].upper()
+    errors, _ = index.check(other)
+    assert errors > 0
+
+
+def test_reopen(tmp_path, index, colldict):
+    index.close()
+    myindex = uuid_index(
+        str(tmp_path / "index.db"), debug=False, capacity=1000)
+    assert myindex.open()
+    assert myindex.add(colldict) == 0
+    myindex.close()
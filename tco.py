@@ -7,47 +7,183 @@ For testing."""
 import argparse
 import sys
 
-def test_file_exists(filename: str, debug=False) -> bool:
-    """Check if file exists."""
-    from pathlib import Path
-    from os import path
+# Below this number of artefacts validation stays serial, even
+# when workers are requested. Pool startup costs more than it saves.
+PARALLEL_THRESHOLD = 500
 
-    if filename is None or filename == "":
-        if debug:
-            print("ERROR: File name not given (None)")
-        return False
+# Bytes read from archive members to see if they are collections
+SNIFF_SIZE = 4096
 
-    if path.exists(filename) is False:
-        if debug:
-            print("ERROR: File does not exist: {}".format(filename))
-        return False
+# Artefacts per executor call in the asyncio API, and the default
+# number of sources validated at the same time
+ASYNC_CHUNK_SIZE = 100
+ASYNC_CONCURRENCY = 8
 
-    if path.isfile(filename) is False:
-        if debug:
-            print(
-                "ERROR: File is not a regular file: {}"
-                .format(filename))
-        return False
+# File name endings of collection files patched by --apply-patch
+PATCH_SUFFIXES = (".json", ".json.gz", ".json.xz", ".json.zst")
 
-    # non zero size
-    if Path(filename).stat().st_size == 0:
-        if debug:
-            print("ERROR: File is empty: {}".format(filename))
-        return False
+# Jobs claimed at a time by a --batch worker, and seconds between
+# progress reports
+BATCH_CLAIM_SIZE = 8
+BATCH_REPORT_INTERVAL = 10.0
+
+# Digests computed for each file by --build, and the read size
+BUILD_DIGESTS = ("sha256",)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Media types by file name suffix, checked before the mimetypes module
+MEDIATYPE_SUFFIX = (
+    (".cdx.json", "application/vnd.cyclonedx+json"),
+    (".cdx.xml", "application/vnd.cyclonedx+xml"),
+    (".spdx.json", "application/spdx+json"),
+    (".spdx.xml", "application/spdx+xml"),
+    (".spdx", "text/spdx"),
+    (".openvex.json", "application/vnd.openvex+json"),
+    (".vex.json", "application/vnd.openvex+json")
+)
+
+# Compressed collection files, recognized by content when reading
+# and by file name suffix when writing
+COMPRESSION_MAGIC = (
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd")
+)
+COMPRESSION_SUFFIX = {
+    ".gz": "gzip",
+    ".xz": "xz",
+    ".zst": "zstd"
+}
+# Compression levels accepted when writing, lowest and highest
+COMPRESSION_LEVELS = {
+    "gzip": (0, 9),
+    "xz": (0, 9),
+    "zstd": (-131072, 22)
+}
+
+
+def detect_compression(head: bytes):
+    """Return the compression of data from its first bytes, or None."""
+    for magic, compression in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def _zstd_module():
+    """Return a zstd module, or None if there is none installed.
+
+    Python 3.14 has compression.zstd, older versions need the
+    zstandard package."""
+    try:
+        from compression import zstd
+        return zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def open_collection_file(
+        filename: str,
+        mode: str,
+        debug: bool,
+        compression: str = None,
+        level: int = None
+        ):
+    """Open a collection file as a text stream.
+
+    Mode is "r" or "w". When reading, gzip, xz and zstd compression is
+    detected from the content. When writing, compression is taken from
+    the argument or the file name suffix (.gz, .xz, .zst), with the
+    compression level from level. The level is checked before the file
+    is opened, so a bad level leaves an existing file as it is.
+    Returns None on failure.
+    """
+    import gzip
+    import lzma
+    from os import path
+
+    if mode == "r":
+        with open(filename, "rb") as filehandle:
+            compression = detect_compression(filehandle.read(6))
+    elif compression is None:
+        compression = COMPRESSION_SUFFIX.get(path.splitext(filename)[1])
     if debug:
-        print("DEBUG: File exists and is not empty: {}".format(filename))
+        print("DEBUG: Opening {} ({}) compression {} level {}".format(
+            filename, mode, compression, level))
+    if mode == "w" and level is not None and compression is not None:
+        lowest, highest = COMPRESSION_LEVELS.get(compression, (0, 0))
+        if (not isinstance(level, int) or level < lowest
+                or level > highest):
+            print("ERROR: {} compression level must be {} to {}: {}".format(
+                compression, lowest, highest, level))
+            return None
 
-    return True
+    if compression is None:
+        return open(filename, mode, encoding="utf-8")
+    if compression == "gzip":
+        if level is None:
+            level = 9
+        return gzip.open(
+            filename, mode + "t", compresslevel=level, encoding="utf-8")
+    if compression == "xz":
+        if mode == "r":
+            return lzma.open(filename, "rt", encoding="utf-8")
+        return lzma.open(filename, "wt", preset=level, encoding="utf-8")
+    if compression == "zstd":
+        zstd = _zstd_module()
+        if zstd is None:
+            print("ERROR: zstd support needs the zstandard package")
+            return None
+        if mode == "r":
+            return zstd.open(filename, "rt", encoding="utf-8")
+        if zstd.__name__ == "compression.zstd":
+            return zstd.open(filename, "wt", level=level, encoding="utf-8")
+        # zstandard takes the level through a compressor context
+        if level is None:
+            level = 3
+        return zstd.open(
+            filename, "wt", cctx=zstd.ZstdCompressor(level=level),
+            encoding="utf-8")
+    print("ERROR: Unknown compression: {}".format(compression))
+    return None
 
 
 # Read file as buffer
 def getfile(filename: str, debug: bool):
-    filehandle = open(filename, "r")
+    """Read a collection file, decompressing it if needed."""
+    filehandle = open_collection_file(filename, "r", debug=debug)
+    if filehandle is None:
+        return None
     filetext = filehandle.read()
     filehandle.close()
     return filetext
 
 
+def write_collection(
+        col,
+        filename: str,
+        debug: bool,
+        compression: str = None,
+        level: int = None
+        ):
+    """Write a collection as json, compressed if the name or
+    compression argument asks for it."""
+    filehandle = open_collection_file(
+        filename, "w", debug=debug, compression=compression, level=level)
+    if filehandle is None:
+        return False
+    filehandle.write(str(col))
+    filehandle.close()
+    if debug:
+        print("DEBUG: Wrote collection to {}".format(filename))
+    return True
+
+
 def run_base_test(debug: bool):
     """Test creating a collection with artefacts"""
     from tea_collection import collection
@@ -157,16 +293,16 @@ def check_if_in_dict(thisdict, key, debug):
         print ("ERROR: check_if_in_dict: Not a dict.")
         if debug:
             print("DEBUG: No dict={}".format(thisdict))
-        return 1, list("Not a dict")
+        return 1, ["Not a dict"]
 
     if key not in thisdict.keys():
-        return 1, list("Key {} missing".format(key))
+        return 1, ["Key {} missing".format(key)]
     return 0, None
 
-def check_artefact(tco, thisart:dict, debug):
-    """Check artefact syntax.
+def build_artefact(thisart: dict, debug):
+    """Check artefact syntax and build an artefact object.
 
-    Add artefact to object if ok."""
+    Formats are not handled."""
     from tea_collection import artefact
 
     myart = artefact(debug=debug)
@@ -180,6 +316,7 @@ def check_artefact(tco, thisart:dict, debug):
         if newerr > 0:
             errors += newerr
             errmsg += newmsg
+            continue
         if key == "uuid":
             # uuid can't be None
             if thisart[key] is None or thisart[key] == "":
@@ -206,7 +343,14 @@ def check_artefact(tco, thisart:dict, debug):
     newerr, newmsg = myart.is_valid()
     errors += newerr
     errmsg += newmsg
+    return myart, errors, errmsg
+
 
+def check_artefact(tco, thisart:dict, debug):
+    """Check artefact syntax.
+
+    Add artefact to object if ok."""
+    myart, errors, errmsg = build_artefact(thisart=thisart, debug=debug)
     if errors == 0:
         # Add artefact
         if not tco.add_artefact(myart):
@@ -215,10 +359,8 @@ def check_artefact(tco, thisart:dict, debug):
     return myart, errors, errmsg
 
 
-def check_format(art, thisformat:dict, debug):
-    """Check format syntax.
-
-    Add artefact to artefact object if ok."""
+def build_format(thisformat: dict, debug):
+    """Check format syntax and build a format object."""
     from tea_collection import format
 
     myformat = format(debug=debug)
@@ -232,6 +374,7 @@ def check_format(art, thisformat:dict, debug):
         if newerr > 0:
             errors += newerr
             errmsg += newmsg
+            continue
         if key == "uuid":
             # uuid can't be None
             if thisformat[key] is None or thisformat[key] == "":
@@ -248,7 +391,7 @@ def check_format(art, thisformat:dict, debug):
         elif key == "url":
             myformat.set_url(thisformat[key], None)
         elif key == "sigurl":
-            myformat.set_url(None, thisformat[key])
+            myformat.set_url(myformat.format["url"], thisformat[key])
         elif key == "hash":
             myformat.set_hash(thisformat[key])
         elif key == "size":
@@ -260,6 +403,15 @@ def check_format(art, thisformat:dict, debug):
     newerr, newmsg = myformat.is_valid()
     errors += newerr
     errmsg += newmsg
+    return myformat, errors, errmsg
+
+
+def check_format(art, thisformat:dict, debug):
+    """Check format syntax.
+
+    Add artefact to artefact object if ok."""
+    myformat, errors, errmsg = build_format(
+        thisformat=thisformat, debug=debug)
 
     # Add other keys to check
     if errors == 0:
@@ -279,6 +431,8 @@ def traversedict(tco, art, thisdict: dict, thiskey: str, debug):
     errors = 0
     errdict = list()
     thisart = None
+    if not isinstance(thisdict, dict):
+        return 1, ["Not an object: {}".format(thisdict)]
     for key in thisdict.keys():
         if debug:
             print("DEBUG: Checking key: {}".format(key))
@@ -288,6 +442,7 @@ def traversedict(tco, art, thisdict: dict, thiskey: str, debug):
         if isinstance(thisdict[key], dict):
             newerr, newdict = traversedict(
                 tco=tco,
+                art=art,
                 thisdict=thisdict[key],
                 thiskey=key,
                 debug=debug)
@@ -308,7 +463,7 @@ def traversedict(tco, art, thisdict: dict, thiskey: str, debug):
                     if art is None:
                         print("ERROR: Missing ART: {}".format(art))
                         errors += 1
-                        errmsg.append("Code error. missing ART")
+                        errdict.append("Code error. missing ART")
                     else:
                         newerr, newdict = check_format(art=art, thisformat=stuff, debug=debug)
                         errors += newerr
@@ -322,6 +477,10 @@ def traversedict(tco, art, thisdict: dict, thiskey: str, debug):
                     debug=debug)
                 errors += newerr
                 errdict += newdict
+        elif key == "UUID":
+            if not tco.replace_uuid(thisdict[key]):
+                errors += 1
+                errdict.append("Collection UUID is not valid")
         elif key == "product_name":
             tco.set_product(thisdict[key], None, None, None)
         elif key == "product_version":
@@ -348,15 +507,125 @@ def traversedict(tco, art, thisdict: dict, thiskey: str, debug):
     return errors, errdict
 
 
-def dict2object(colldict, debug: bool):
+def check_unknown_keys(thisdict: dict, debug):
+    """Check that all keys of a raw dict are in the vocabulary."""
+    from tea_collection import collection
+
+    errors = 0
+    errmsg = list()
+    for key in thisdict.keys():
+        if key not in collection.vocabulary:
+            if debug:
+                print("DEBUG. Check_key: {} not in vocabulary".format(key))
+            errors += 1
+            errmsg.append("Not a known key: {}".format(key))
+    return errors, errmsg
+
+
+def lazy_format(thisformat, debug):
+    """Build a format object on first access (lazy loading)."""
+    if not isinstance(thisformat, dict):
+        return None, 1, ["Format is not a dict"]
+    myformat, errors, errmsg = build_format(
+        thisformat=thisformat, debug=debug)
+    newerr, newmsg = check_unknown_keys(thisformat, debug)
+    return myformat, errors + newerr, errmsg + newmsg
+
+
+def lazy_artefact(thisart, debug):
+    """Build an artefact object on first access (lazy loading).
+
+    The formats of the artefact are loaded lazily as well."""
+    from tea_collection import lazy_list
+
+    if not isinstance(thisart, dict):
+        return None, 1, ["Artefact is not a dict"]
+    myart, errors, errmsg = build_artefact(thisart=thisart, debug=debug)
+    newerr, newmsg = check_unknown_keys(thisart, debug)
+    errors += newerr
+    errmsg += newmsg
+    formlist = thisart.get("formats")
+    if not isinstance(formlist, list):
+        errors += 1
+        errmsg.append("Artefact formats is not a list")
+        formlist = list()
+    myart.artefact["formats"] = lazy_list(formlist, lazy_format, debug)
+    return myart, errors, errmsg
+
+
+def validate_artefact_chunk(chunk: list, debug):
+    """Validate a chunk of raw artefacts, in a worker process.
+
+    Runs the serial traversal on a scratch collection and returns the
+    artefacts that passed, the error count and the error messages."""
+    from tea_collection import collection
+
+    scratch = collection(debug=debug)
+    errors, errmsg = traversedict(
+        tco=scratch,
+        art=None,
+        thisdict={"artefacts": chunk},
+        thiskey=None,
+        debug=debug)
+    return scratch.collection["artefacts"], errors, errmsg
+
+
+def traverse_parallel(tco, artlist: list, workers: int, debug):
+    """Validate the artefacts of a collection on a process pool.
+
+    The list is split in chunks, results and errors are merged
+    in document order."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    errors = 0
+    errmsg = list()
+    # A few chunks per worker evens out artefacts of different size
+    chunksize = max(1, -(-len(artlist) // (workers * 4)))
+    chunks = list()
+    for start in range(0, len(artlist), chunksize):
+        chunks.append(artlist[start:start + chunksize])
+    if debug:
+        print("DEBUG: Validating {} artefacts in {} chunks on {} workers"
+              .format(len(artlist), len(chunks), workers))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(
+            validate_artefact_chunk, chunks, [debug] * len(chunks))
+        for artefacts, newerr, newmsg in results:
+            errors += newerr
+            errmsg += newmsg
+            for art in artefacts:
+                tco.add_artefact(art)
+    return errors, errmsg
+
+
+def dict2object(
+        colldict,
+        debug: bool,
+        lazy: bool = False,
+        workers: int = 0
+        ):
     """Convert a raw data structure to objects.
 
     (like input from a json file)
+
+    With lazy set, the collection fields are checked here together
+    with the types of the artefact and format entries, so a collection
+    with entries that are not objects is invalid like when loading
+    eagerly. The fields of artefacts and formats are checked when they
+    are first accessed, errors from that are kept in the lazy lists.
+    Use validate_all() on the artefact list for a full check.
+
+    With workers above one, collections with at least
+    PARALLEL_THRESHOLD artefacts are validated on a process pool.
     """
     from tea_collection import collection
     from tea_collection import artefact
     from tea_collection import format
+    from tea_collection import lazy_list
 
+    if not isinstance(colldict, dict):
+        print("ERROR: Collection is not a JSON object")
+        return None
     if debug:
         print("DEBUG: dict2object converting data")
     # Create a collection object
@@ -364,15 +633,106 @@ def dict2object(colldict, debug: bool):
     errors = 0
     errmsg = list()
 
-    # Check syntax and add artefacts and formats
-    # ERROR: Needs to handle lists
-    errors, errmsg = traversedict(
-        tco=mycol,
-        art=None,
-        thisdict=colldict,
-        thiskey=None,
+    if lazy:
+        artlist = colldict.get("artefacts", list())
+        topdict = dict(colldict)
+        topdict.pop("artefacts", None)
+        errors, errmsg = traversedict(
+            tco=mycol,
+            art=None,
+            thisdict=topdict,
+            thiskey=None,
+            debug=debug)
+        if not isinstance(artlist, list):
+            errors += 1
+            errmsg.append("Collection artefacts is not a list")
+            artlist = list()
+        # Entries that can not become objects are found here, so a
+        # broken collection is rejected like when loading eagerly
+        for index, thisart in enumerate(artlist):
+            if not isinstance(thisart, dict):
+                errors += 1
+                errmsg.append("Artefact {} is not a dict".format(index))
+                continue
+            formlist = thisart.get("formats", list())
+            if not isinstance(formlist, list):
+                errors += 1
+                errmsg.append(
+                    "Artefact {} formats is not a list".format(index))
+                continue
+            for formindex, thisform in enumerate(formlist):
+                if not isinstance(thisform, dict):
+                    errors += 1
+                    errmsg.append("Artefact {} format {} is not a dict"
+                                  .format(index, formindex))
+        mycol.collection["artefacts"] = lazy_list(
+            artlist, lazy_artefact, debug)
+    elif (workers > 1
+            and isinstance(colldict.get("artefacts"), list)
+            and len(colldict["artefacts"]) >= PARALLEL_THRESHOLD):
+        topdict = dict(colldict)
+        topdict.pop("artefacts")
+        errors, errmsg = traversedict(
+            tco=mycol,
+            art=None,
+            thisdict=topdict,
+            thiskey=None,
+            debug=debug)
+        newerr, newmsg = traverse_parallel(
+            tco=mycol,
+            artlist=colldict["artefacts"],
+            workers=workers,
+            debug=debug)
+        errors += newerr
+        errmsg += newmsg
+    else:
+        # Check syntax and add artefacts and formats
+        # ERROR: Needs to handle lists
+        errors, errmsg = traversedict(
+            tco=mycol,
+            art=None,
+            thisdict=colldict,
+            thiskey=None,
+            debug=debug)
+
+    return check_collection(
+        mycol=mycol,
+        colldict=colldict,
+        errors=errors,
+        errmsg=errmsg,
         debug=debug)
 
+
+def check_collection(mycol, colldict, errors: int, errmsg: list, debug):
+    """Final checks of a converted collection.
+
+    Adds the format and collection checks to the errors found so far,
+    prints all errors and returns the collection object or None."""
+    newerr, newmsg = check_spec(colldict)
+    errors += newerr
+    errmsg += newmsg
+
+    newerr, newmsg = mycol.is_valid()
+    errors += newerr
+    errmsg += newmsg
+
+    # Handle errors
+    if errors > 0:
+        print("ERRORS {}:".format(errors))
+        for msg in errmsg:
+            print("  - {}".format(msg))
+        return None
+    if debug:
+        print("DEBUG: Validated the file ok.")
+    return mycol
+
+
+def check_spec(colldict):
+    """Check the format name and spec version of a raw collection."""
+    errors = 0
+    errmsg = list()
+    if not isinstance(colldict, dict):
+        return 1, ["Collection is not a JSON object."]
     # Check for TCOFormat and version
     if "tcoFormat" not in colldict.keys():
         errors += 1
@@ -388,57 +748,1001 @@ def dict2object(colldict, debug: bool):
         if colldict['specVersion'] != "1.0":
             errors += 1
             errmsg.append("Not supported specVersion")
+    return errors, errmsg
 
-    newerr, newmsg = mycol.is_valid()
-    errors += newerr
-    errmsg += newmsg
 
-    # Handle errors
-    if errors > 0:
-        print("ERRORS {}:".format(errors))
-        for msg in errmsg:
-            print("  - {}".format(msg))
+def decompress_stream(filehandle, compression: str):
+    """Return a binary stream that decompresses a file object.
+
+    Returns the file object itself if compression is None."""
+    import gzip
+    import lzma
+
+    if compression is None:
+        return filehandle
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=filehandle, mode="rb")
+    if compression == "xz":
+        return lzma.LZMAFile(filehandle)
+    if compression == "zstd":
+        zstd = _zstd_module()
+        if zstd is None:
+            print("ERROR: zstd support needs the zstandard package")
+            return None
+        if zstd.__name__ == "compression.zstd":
+            return zstd.ZstdFile(filehandle)
+        return zstd.ZstdDecompressor().stream_reader(filehandle)
+    print("ERROR: Unknown compression: {}".format(compression))
+    return None
+
+
+def _member_data(name: str, data: bytes, debug: bool):
+    """Decompress an archive member if it is compressed."""
+    import io
+
+    compression = detect_compression(data[:6])
+    if compression is None:
+        return data
+    if debug:
+        print("DEBUG: Member {} is {} compressed".format(name, compression))
+    stream = decompress_stream(io.BytesIO(data), compression)
+    if stream is None:
         return None
+    return stream.read()
+
+
+def _zip_members(archive):
+    """Yield name and open function of each file in a zip archive."""
+    for info in archive.infolist():
+        if not info.is_dir():
+            yield info.filename, lambda info=info: archive.open(info)
+
+
+def _tar_members(archive):
+    """Yield name and open function of each file in a streamed tar.
+
+    Each member must be read before the next one is requested."""
+    for info in archive:
+        if info.isfile():
+            yield info.name, lambda info=info: archive.extractfile(info)
+
+
+def _read_members(name: str, members, member: str, debug: bool):
+    """Pick collection documents from (name, open function) pairs.
+
+    With a member name, only that member is read. Otherwise members
+    are sniffed and those that look like a collection are read."""
+    docs = list()
+    for membername, memberopen in members:
+        if member is not None and membername != member:
+            continue
+        memberfh = memberopen()
+        if member is None:
+            head = memberfh.read(SNIFF_SIZE)
+            if b'"tcoFormat"' not in head:
+                if debug:
+                    print("DEBUG: Skipping member {}".format(membername))
+                continue
+            data = head + memberfh.read()
+        else:
+            data = memberfh.read()
+        data = _member_data(membername, data, debug)
+        if data is None:
+            return None
+        docs.append(("{}#{}".format(name, membername), data))
+        if member is not None:
+            break
+    if len(docs) == 0:
+        if member is not None:
+            print("ERROR: No member {} in {}".format(member, name))
+        else:
+            print("ERROR: No collection found in {}".format(name))
+        return None
+    return docs
+
+
+class _mmap_reader:
+    """A read-only, seekable file object on an mmap.
+
+    zipfile needs seekable(), which mmap lacks. Reads return only the
+    requested bytes, the mapping is never copied as a whole."""
+
+    def __init__(self, source):
+        self._source = source
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size: int = -1):
+        end = len(self._source)
+        if size is not None and size >= 0:
+            end = min(end, self._position + size)
+        data = self._source[self._position:end]
+        self._position = max(self._position, end)
+        return data
+
+    def seek(self, offset: int, whence: int = 0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += len(self._source)
+        if offset < 0:
+            raise ValueError("negative seek position {}".format(offset))
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        """The mmap belongs to the caller and is left open."""
+        return None
+
+
+def _read_fileobj(name: str, filehandle, member: str, debug: bool):
+    """Read collection documents from a seekable binary file object.
+
+    Handles zip and (compressed) tar archives and (compressed) json."""
+    import tarfile
+    import zipfile
+
+    head = filehandle.read(8)
+    filehandle.seek(0)
+    if head.startswith(b"PK\x03\x04"):
+        if debug:
+            print("DEBUG: {} is a zip archive".format(name))
+        with zipfile.ZipFile(filehandle) as archive:
+            return _read_members(name, _zip_members(archive), member, debug)
+
+    compression = detect_compression(head)
+    stream = decompress_stream(filehandle, compression)
+    if stream is None:
+        return None
+    block = stream.read(512)
+    if len(block) == 512 and block[257:262] == b"ustar":
+        if debug:
+            print("DEBUG: {} is a tar archive".format(name))
+        filehandle.seek(0)
+        stream = decompress_stream(filehandle, compression)
+        # Stream mode reads the archive once, front to back
+        with tarfile.open(fileobj=stream, mode="r|") as archive:
+            return _read_members(name, _tar_members(archive), member, debug)
+    if member is not None:
+        print("ERROR: {} is not an archive".format(name))
+        return None
+    return [(name, block + stream.read())]
+
+
+def _read_sharded(path: str, member: str, debug: bool):
+    """Read a sharded collection directory, or some of its artefacts."""
+    import json
+    from tea_collection import sharded_collection
+
+    sharded = sharded_collection(path, debug=debug)
+    if not sharded.open():
+        return None
+    uuids = None
+    if member is not None:
+        uuids = member.split(",")
+    colldict = sharded.load(uuids)
+    if colldict is None:
+        return None
+    return [(path, json.dumps(colldict).encode("utf-8"))]
+
+
+def read_sources(source, debug: bool):
+    """Read collection documents from a source in a single pass.
+
+    The source is a file name, "-" for stdin, a bytes-like buffer or an
+    mmap object of a file. Files and buffers may be json, gzip/xz/zstd compressed
+    json, or zip and tar archives (also compressed). For archives, give
+    "archive#member" to pick one member, otherwise all uncompressed
+    members that look like collections are read. A directory is read as
+    a sharded collection, "directory#uuid" reads only the artefacts
+    with the given comma separated UUIDs.
+
+    Returns a list of (name, bytes) or None on errors.
+    """
+    import io
+    import mmap
+    import os
+    import stat
+
+    if isinstance(source, mmap.mmap):
+        return _read_fileobj("<mmap>", _mmap_reader(source), None, debug)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return _read_fileobj("<buffer>", io.BytesIO(source), None, debug)
+    if source is None or source == "":
+        print("ERROR: File name not given (None)")
+        return None
+    if source == "-":
+        return _read_fileobj(
+            "<stdin>", io.BytesIO(sys.stdin.buffer.read()), None, debug)
+
+    filename = source
+    member = None
+    if "#" in source and not os.path.exists(source):
+        filename, member = source.rsplit("#", 1)
+    if os.path.isdir(filename):
+        return _read_sharded(filename, member, debug)
+    try:
+        filehandle = open(filename, "rb")
+    except OSError as err:
+        print("ERROR: Can't open {}: {}".format(filename, err.strerror))
+        return None
+    with filehandle:
+        # One fstat on the open file replaces separate stat calls
+        filestat = os.fstat(filehandle.fileno())
+        if not stat.S_ISREG(filestat.st_mode):
+            print("ERROR: File is not a regular file: {}".format(filename))
+            return None
+        if filestat.st_size == 0:
+            print("ERROR: File is empty: {}".format(filename))
+            return None
+        return _read_fileobj(filename, filehandle, member, debug)
+
+
+def detect_mediatype(filename: str):
+    """Return the media type of a file from its name."""
+    import mimetypes
+
+    lowername = filename.lower()
+    for suffix, mediatype in MEDIATYPE_SUFFIX:
+        if lowername.endswith(suffix):
+            return mediatype
+    mediatype, _ = mimetypes.guess_type(filename)
+    if mediatype is None:
+        return "application/octet-stream"
+    return mediatype
+
+
+def hash_file(filename: str, algorithms: tuple, debug: bool):
+    """Compute several digests of a file while reading it once.
+
+    Returns a dict of algorithm to hex digest and the file size.
+    hashlib releases the GIL on large updates, so this runs in
+    parallel on a thread pool."""
+    import hashlib
+
+    hashers = list()
+    for algorithm in algorithms:
+        hashers.append(hashlib.new(algorithm))
+    size = 0
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(filename, "rb", buffering=0) as filehandle:
+        while True:
+            length = filehandle.readinto(buffer)
+            if not length:
+                break
+            size += length
+            for hasher in hashers:
+                hasher.update(view[:length])
+    digests = dict()
+    for algorithm, hasher in zip(algorithms, hashers):
+        digests[algorithm] = hasher.hexdigest()
     if debug:
-        print("DEBUG: Validated the file ok.")
-    return mycol
+        print("DEBUG: Hashed {} ({} bytes)".format(filename, size))
+    return digests, size
 
 
-def validate_collection(
-        file: str,
-        debug: bool
+def build_collection(
+        directory: str,
+        debug: bool,
+        algorithms: tuple = BUILD_DIGESTS,
+        workers: int = 0,
+        baseurl: str = None
         ):
-    """Read a json file and validate it."""
+    """Build a collection from a directory of artefact files.
 
-    import json
+    Every file becomes an artefact with one format. A file "x.sig"
+    next to "x" becomes the signature URL of x. URLs are the relative
+    paths, prefixed with baseurl if given. The format hash is
+    "algorithm:hexdigest", comma separated for several algorithms.
+    Returns the collection object, or None on errors. A file that can't
+    be read, like a dangling link, is reported and makes the build
+    fail, a collection with files left out is not built.
+    """
+    import hashlib
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    from tea_collection import artefact
+    from tea_collection import collection
+    from tea_collection import format
+
+    for algorithm in algorithms:
+        if algorithm not in hashlib.algorithms_available:
+            print("ERROR: Unknown digest algorithm: {}".format(algorithm))
+            return None
+        # shake_128 and shake_256 have no fixed length to print
+        if hashlib.new(algorithm).digest_size == 0:
+            print("ERROR: Digest algorithm without a fixed length: {}"
+                  .format(algorithm))
+            return None
+    if not os.path.isdir(directory):
+        print("ERROR: Not a directory: {}".format(directory))
+        return None
 
+    files = list()
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            files.append(os.path.relpath(
+                os.path.join(dirpath, filename), directory))
+    fileset = set(files)
+    artfiles = list()
+    for relpath in files:
+        if relpath.endswith(".sig") and relpath[:-4] in fileset:
+            continue
+        artfiles.append(relpath)
     if debug:
-        print("DEBUG: Validate file: {}".format(file))
-    if not test_file_exists(filename=file, debug=debug):
-        print(
-            "ERROR: File does not exist: {}"
-            .format(file))
-        return False
-    print("DEBUG: File exists and will be read.")
-    colldata = getfile(filename=file, debug=debug)
+        print("DEBUG: Building collection from {} files".format(
+            len(artfiles)))
+
+    def hash_one(relpath):
+        filename = os.path.join(directory, relpath)
+        try:
+            return hash_file(filename, algorithms, debug)
+        except OSError as err:
+            print("ERROR: Can't read {}: {}".format(filename, err.strerror))
+            return None
+
+    if workers <= 0:
+        workers = min(32, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(hash_one, artfiles))
+    if None in results:
+        return None
+
+    def url_of(relpath):
+        urlpath = relpath.replace(os.sep, "/")
+        if baseurl is None:
+            return urlpath
+        return baseurl.rstrip("/") + "/" + urlpath
+
+    mycol = collection(debug=debug)
+    mycol.set_product(
+        os.path.basename(os.path.abspath(directory)), None, None, None)
+    mycol.set_version(1)
+    for relpath, (digests, size) in zip(artfiles, results):
+        myart = artefact(debug=debug)
+        myart.set_name(relpath)
+        myform = format(debug=debug)
+        myform.set_mediatype(detect_mediatype(relpath))
+        sigurl = None
+        if relpath + ".sig" in fileset:
+            sigurl = url_of(relpath + ".sig")
+        myform.set_url(url_of(relpath), sigurl)
+        hashlist = list()
+        for algorithm in algorithms:
+            hashlist.append("{}:{}".format(algorithm, digests[algorithm]))
+        myform.set_attributes(hash=",".join(hashlist), size=size)
+        myart.add_format(myform)
+        mycol.add_artefact(myart)
+    return mycol
+
+
+def validate_data(data, name: str, debug: bool, workers: int = 0):
+    """Parse and validate one collection document.
+
+    Returns the collection object or None."""
+    import json
 
     try:
-        collection = json.loads(colldata)
+        collection = json.loads(data)
     except Exception:
-        print("ERROR: Failed parsing data file")
-        return False
+        print("ERROR: Failed parsing data: {}".format(name))
+        return None
 
     # We have a data file
     if debug:
         print("DEBUG: Data read: {}".format(collection))
     col = dict2object(
         colldict=collection,
-        debug=debug)
+        debug=debug,
+        workers=workers)
     if col is None:
-        print("ERROR: Validation failed.")
-        return False
+        print("ERROR: Validation failed: {}".format(name))
+        return None
     if debug:
         print("DEBUG: Collection\n{}\n".format(str(col)))
+    return col
+
+
+def validate_collection(
+        file,
+        debug: bool,
+        workers: int = 0,
+        output: str = None,
+        compression: str = None,
+        level: int = None,
+        index=None,
+        history=None
+        ):
+    """Read collection documents from a source and validate them.
+
+    See read_sources() for the sources. If output is given, the
+    validated collection is written there. With a uuid_index, the
+    identifiers are checked against the index and added to it.
+    With a history_store, the collections are added to the store.
+    """
+    if debug:
+        print("DEBUG: Validate source: {}".format(file))
+    docs = read_sources(source=file, debug=debug)
+    if docs is None:
+        return False
+
+    valid = list()
+    for name, data in docs:
+        if debug:
+            print("DEBUG: Validating {}".format(name))
+        col = validate_data(
+            data=data, name=name, debug=debug, workers=workers)
+        if col is not None and index is not None:
+            errors, errmsg = index.check(col)
+            if errors > 0:
+                print("ERRORS {}:".format(errors))
+                for msg in errmsg:
+                    print("  - {}".format(msg))
+                print("ERROR: Identifier check failed: {}".format(name))
+                continue
+            index.add(col)
+        if col is not None and history is not None:
+            if not history.add(col):
+                continue
+        if col is not None:
+            valid.append(col)
+    if len(valid) != len(docs):
+        return False
+    if output is not None:
+        if len(valid) != 1:
+            print("ERROR: Can only write one collection, found {}".format(
+                len(valid)))
+            return False
+        return write_collection(
+            col=valid[0],
+            filename=output,
+            debug=debug,
+            compression=compression,
+            level=level)
+    return True
+
+
+async def dict2object_async(
+        colldict,
+        debug: bool,
+        chunk: int = ASYNC_CHUNK_SIZE,
+        executor=None
+        ):
+    """Convert a raw data structure to objects without blocking the loop.
+
+    Artefacts are validated chunk by chunk in the executor, so the event
+    loop gets control back between chunks.
+    """
+    import asyncio
+    from tea_collection import collection
+
+    if not isinstance(colldict, dict):
+        print("ERROR: Collection is not a JSON object")
+        return None
+    loop = asyncio.get_running_loop()
+    mycol = collection(debug=debug)
+    artlist = colldict.get("artefacts", list())
+    topdict = dict(colldict)
+    topdict.pop("artefacts", None)
+    errors, errmsg = traversedict(
+        tco=mycol,
+        art=None,
+        thisdict=topdict,
+        thiskey=None,
+        debug=debug)
+    if not isinstance(artlist, list):
+        errors += 1
+        errmsg.append("Collection artefacts is not a list")
+        artlist = list()
+    for start in range(0, len(artlist), chunk):
+        artefacts, newerr, newmsg = await loop.run_in_executor(
+            executor, validate_artefact_chunk,
+            artlist[start:start + chunk], debug)
+        errors += newerr
+        errmsg += newmsg
+        for art in artefacts:
+            mycol.add_artefact(art)
+    return check_collection(
+        mycol=mycol,
+        colldict=colldict,
+        errors=errors,
+        errmsg=errmsg,
+        debug=debug)
+
+
+async def load_collection_async(
+        file,
+        debug: bool,
+        limit=None,
+        executor=None
+        ):
+    """Read and validate collections from a source, asyncio version.
+
+    File reading and parsing run in the executor (default: the loop's
+    thread pool). Limit is an optional asyncio.Semaphore shared by
+    concurrent calls. Returns a list of collection objects, or None if
+    reading or any validation fails.
+    """
+    import asyncio
+    import contextlib
+    import json
+
+    if limit is None:
+        limit = contextlib.nullcontext()
+    loop = asyncio.get_running_loop()
+    async with limit:
+        docs = await loop.run_in_executor(executor, read_sources, file, debug)
+        if docs is None:
+            return None
+        valid = list()
+        for name, data in docs:
+            try:
+                colldict = await loop.run_in_executor(
+                    executor, json.loads, data)
+            except ValueError:
+                print("ERROR: Failed parsing data: {}".format(name))
+                return None
+            col = await dict2object_async(
+                colldict=colldict, debug=debug, executor=executor)
+            if col is None:
+                print("ERROR: Validation failed: {}".format(name))
+                return None
+            valid.append(col)
+    return valid
+
+
+async def validate_collection_async(
+        file,
+        debug: bool,
+        limit=None,
+        executor=None
+        ):
+    """Validate collections from a source, asyncio version.
+
+    See load_collection_async()."""
+    cols = await load_collection_async(
+        file=file, debug=debug, limit=limit, executor=executor)
+    return cols is not None
+
+
+async def write_collection_async(
+        col,
+        filename: str,
+        debug: bool,
+        compression: str = None,
+        level: int = None,
+        limit=None,
+        executor=None
+        ):
+    """Serialize and write a collection in the executor."""
+    import asyncio
+    import contextlib
+
+    if limit is None:
+        limit = contextlib.nullcontext()
+    loop = asyncio.get_running_loop()
+    async with limit:
+        return await loop.run_in_executor(
+            executor, write_collection, col, filename, debug,
+            compression, level)
+
+
+async def validate_many_async(
+        files: list,
+        debug: bool,
+        concurrency: int = ASYNC_CONCURRENCY,
+        executor=None
+        ):
+    """Validate many sources concurrently, at most concurrency at a time.
+
+    Returns a list of results in the order of files. A file that
+    fails with an exception is reported and counted as False, the
+    other files are still validated."""
+    import asyncio
+
+    limit = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(*[
+        validate_collection_async(
+            file=file, debug=debug, limit=limit, executor=executor)
+        for file in files], return_exceptions=True)
+    for position, result in enumerate(results):
+        if isinstance(result, Exception):
+            print("ERROR: Validation of {} failed: {}".format(
+                files[position], result))
+            results[position] = False
+    return results
+
+
+def query_collection(
+        file: str,
+        fields: list,
+        filters: list,
+        debug: bool
+        ):
+    """Read a collection and print the rows matching a query.
+
+    Filters are applied while parsing, so no objects are built.
+    """
+    import json
+    from tea_collection import query
+
+    myquery = query(debug=debug)
+    for field in fields:
+        if not myquery.add_field(field):
+            print("ERROR: Bad query field: {}".format(field))
+            return False
+    for filt in filters:
+        if not myquery.add_filter(filt):
+            print("ERROR: Bad query filter: {}".format(filt))
+            return False
+    docs = read_sources(source=file, debug=debug)
+    if docs is None:
+        return False
+    if len(docs) != 1:
+        print("ERROR: Can only query one collection, found {}".format(
+            len(docs)))
+        return False
+    colldata = docs[0][1]
+    if myquery.is_projecting():
+        result = myquery.rows(colldata)
+    else:
+        result = myquery.load(colldata)
+    if result is None:
+        return False
+    print(json.dumps(result, sort_keys=False, indent=4))
+    return True
+
+
+def validate_patched(colldict, touched: list, fieldschanged: bool, debug):
+    """Validate the parts of a raw collection a patch changed.
+
+    Collection fields are checked if fieldschanged is set, artefacts
+    only if they are in touched. Returns errors and error messages."""
+    from tea_collection import collection
+
+    errors = 0
+    errmsg = list()
+    if fieldschanged:
+        scratch = collection(debug=debug)
+        topdict = dict(colldict)
+        topdict.pop("artefacts", None)
+        errors, errmsg = traversedict(
+            tco=scratch,
+            art=None,
+            thisdict=topdict,
+            thiskey=None,
+            debug=debug)
+        if not isinstance(colldict.get("artefacts"), list):
+            errors += 1
+            errmsg.append("Collection artefacts is not a list")
+        newerr, newmsg = check_spec(colldict)
+        errors += newerr
+        errmsg += newmsg
+        newerr, newmsg = scratch.is_valid()
+        errors += newerr
+        errmsg += newmsg
+    if len(touched) > 0:
+        _, newerr, newmsg = validate_artefact_chunk(touched, debug)
+        errors += newerr
+        errmsg += newmsg
+    return errors, errmsg
+
+
+def write_atomic(colldict, filename: str, compression: str, level: int,
+                 debug: bool):
+    """Replace a collection file with a raw collection.
+
+    The data is written to a temporary file in the same directory
+    which is synced and renamed over the old file, so readers and a
+    crash leave either the old or the new file. Compression and file
+    mode are kept."""
+    import json
+    import os
+    import shutil
+    import tempfile
+
+    directory, name = os.path.split(os.path.abspath(filename))
+    tmpfd, tmpname = tempfile.mkstemp(
+        dir=directory, prefix="." + name + ".", suffix=".tmp")
+    os.close(tmpfd)
+    try:
+        filehandle = open_collection_file(
+            tmpname, "w", debug=debug, compression=compression, level=level)
+        if filehandle is None:
+            os.unlink(tmpname)
+            return False
+        with filehandle:
+            filehandle.write(json.dumps(colldict, sort_keys=False, indent=4))
+        # The compressor writes its last data on close, sync after that
+        syncfd = os.open(tmpname, os.O_RDONLY)
+        try:
+            os.fsync(syncfd)
+        finally:
+            os.close(syncfd)
+        shutil.copymode(filename, tmpname)
+        os.replace(tmpname, filename)
+        # Make the rename itself durable
+        dirfd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
+    except OSError as err:
+        print("ERROR: Can't write {}: {}".format(filename, err))
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+        return False
+    return True
+
+
+def patch_file(filename: str, patchdata, debug: bool, level: int = None):
+    """Apply a patch to one collection file, in a worker process.
+
+    Returns filename, number of changes, errors, error messages and
+    the size of the file read. Files are only written if the patched
+    parts validate."""
+    import json
+    import os
+    from tea_collection import patch
+
+    mypatch = patch(debug=debug)
+    errors, errmsg = mypatch.load(patchdata)
+    if errors > 0:
+        return filename, 0, errors, errmsg, 0
+    try:
+        size = os.path.getsize(filename)
+        with open(filename, "rb") as filehandle:
+            compression = detect_compression(filehandle.read(6))
+        data = getfile(filename, debug=debug)
+        colldict = json.loads(data)
+    except (OSError, ValueError) as err:
+        return filename, 0, 1, ["ERROR: Can't read: {}".format(err)], 0
+    if not isinstance(colldict, dict):
+        return filename, 0, 1, ["ERROR: Not a collection"], size
+
+    changes, fieldschanged, touched, errors, errmsg = mypatch.apply(colldict)
+    if errors > 0 or changes == 0:
+        return filename, 0, errors, errmsg, size
+    errors, errmsg = validate_patched(
+        colldict, touched, fieldschanged, debug)
+    if errors > 0:
+        return filename, 0, errors, errmsg, size
+    if not write_atomic(colldict, filename, compression, level, debug):
+        return filename, 0, 1, ["ERROR: Write failed"], size
+    if debug:
+        print("DEBUG: Patched {}: {} changes, {} artefacts validated".format(
+            filename, changes, len(touched)))
+    return filename, changes, 0, list(), size
+
+
+def collection_files(directory: str):
+    """Return the sorted collection files below a directory."""
+    import os
+
+    files = list()
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(PATCH_SUFFIXES):
+                files.append(os.path.join(dirpath, filename))
+    return files
+
+
+def apply_patch(
+        patchfile: str,
+        directory: str,
+        debug: bool,
+        workers: int = 0,
+        level: int = None
+        ):
+    """Apply a field patch or JSON Patch to every collection in a directory.
+
+    Files are patched on a process pool. Changed files are listed,
+    followed by a summary with the throughput. Returns True if no file
+    failed.
+    """
+    import json
+    import os
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    from tea_collection import patch
+
+    patchtext = getfile(patchfile, debug=debug)
+    if patchtext is None:
+        return False
+    try:
+        patchdata = json.loads(patchtext)
+    except ValueError:
+        print("ERROR: Failed parsing patch: {}".format(patchfile))
+        return False
+    errors, errmsg = patch(debug=debug).load(patchdata)
+    if errors > 0:
+        print("ERRORS {}:".format(errors))
+        for msg in errmsg:
+            print("  - {}".format(msg))
+        return False
+    if not os.path.isdir(directory):
+        print("ERROR: Not a directory: {}".format(directory))
+        return False
+    files = collection_files(directory)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    if debug:
+        print("DEBUG: Patching {} files on {} workers".format(
+            len(files), workers))
+
+    start = time.perf_counter()
+    changed = 0
+    failed = 0
+    totalsize = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(
+            patch_file, files, [patchdata] * len(files),
+            [debug] * len(files), [level] * len(files),
+            chunksize=max(1, len(files) // (workers * 4)))
+        for filename, changes, errors, errmsg, size in results:
+            totalsize += size
+            if errors > 0:
+                failed += 1
+                print("ERROR: Patch failed: {}".format(filename))
+                for msg in errmsg:
+                    print("  - {}".format(msg))
+            elif changes > 0:
+                changed += 1
+                print("Patched: {} ({} changes)".format(filename, changes))
+    elapsed = time.perf_counter() - start
+    print("Patched {} of {} files, {} failed, in {:.2f} s "
+          "({:.0f} files/s, {:.1f} MB/s)".format(
+              changed, len(files), failed, elapsed,
+              len(files) / elapsed if elapsed > 0 else 0,
+              totalsize / (1024 * 1024) / elapsed if elapsed > 0 else 0))
+    return failed == 0
+
+
+def batch_worker(dbfile: str, debug: bool):
+    """Validate claimed jobs from a checkpoint database until none are left.
+
+    Runs in a worker process. The output of a failed validation is
+    stored as the job errors."""
+    import contextlib
+    import io
+    from tea_collection import checkpoint_db
+
+    queue = checkpoint_db(dbfile, debug=debug)
+    if not queue.open():
+        return False
+    while True:
+        paths = queue.claim(BATCH_CLAIM_SIZE)
+        if len(paths) == 0:
+            break
+        for path in paths:
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                try:
+                    ok = validate_collection(file=path, debug=debug)
+                except Exception as err:
+                    print("ERROR: {}: {}".format(type(err).__name__, err))
+                    ok = False
+            if debug:
+                print(output.getvalue(), end="")
+            queue.finish(path, ok, None if ok else output.getvalue())
+    queue.close()
+    return True
+
+
+def validate_batch(
+        directory: str,
+        dbfile: str,
+        debug: bool,
+        workers: int = 0,
+        retry: bool = False
+        ):
+    """Validate all collection files in a directory as a resumable batch.
+
+    Files are queued in the checkpoint database dbfile, worker
+    processes claim and validate them and record the results. Running
+    the same batch again continues with the files not done yet, files
+    already validated are not read again unless they changed since.
+    With retry, failed files are validated again. Progress is reported
+    every BATCH_REPORT_INTERVAL seconds. Returns True if no file in the
+    batch failed.
+    """
+    import multiprocessing
+    import os
+    import time
+    from tea_collection import checkpoint_db
+
+    if not os.path.isdir(directory):
+        print("ERROR: Not a directory: {}".format(directory))
+        return False
+    queue = checkpoint_db(dbfile, debug=debug)
+    if not queue.open():
+        return False
+    added = queue.enqueue(collection_files(directory))
+    if retry:
+        queue.retry_failed()
+    reclaimed = queue.reclaim()
+    counts = queue.counts()
+    total = sum(counts.values())
+    donebefore = counts["ok"] + counts["failed"]
+    print("Batch: {} files, {} new or changed, {} done before, "
+          "{} reclaimed".format(total, added, donebefore, reclaimed))
+
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    start = time.monotonic()
+    procs = list()
+    for _ in range(workers):
+        proc = multiprocessing.Process(
+            target=batch_worker, args=(dbfile, debug))
+        proc.start()
+        procs.append(proc)
+    while any(proc.is_alive() for proc in procs):
+        for proc in procs:
+            proc.join(timeout=BATCH_REPORT_INTERVAL / len(procs))
+        counts = queue.counts()
+        done = counts["ok"] + counts["failed"]
+        elapsed = time.monotonic() - start
+        rate = (done - donebefore) / elapsed if elapsed > 0 else 0
+        remaining = total - done
+        eta = "{:.0f} s".format(remaining / rate) if rate > 0 else "n/a"
+        print("Progress: {}/{} done, {} failed, {} running, "
+              "{:.1f} files/s, ETA {}".format(
+                  done, total, counts["failed"], counts["running"],
+                  rate, eta))
+
+    for path, errors in queue.failed():
+        print("Failed: {}".format(path))
+        if debug and errors:
+            print(errors, end="")
+    counts = queue.counts()
+    queue.close()
+    print("Batch done: {} ok, {} failed, {} pending, "
+          "{} running in other processes".format(
+              counts["ok"], counts["failed"], counts["pending"],
+              counts["running"]))
+    return counts["failed"] == 0 and counts["pending"] == 0
+
+
+def shard_collection(file, directory: str, debug: bool, workers: int = 0):
+    """Validate a collection and store it as a sharded directory.
+
+    An existing sharded collection in the directory is updated, only
+    shards of changed artefacts are written."""
+    import json
+    from tea_collection import sharded_collection
+
+    docs = read_sources(source=file, debug=debug)
+    if docs is None:
+        return False
+    if len(docs) != 1:
+        print("ERROR: Can only shard one collection, found {}".format(
+            len(docs)))
+        return False
+    name, data = docs[0]
+    try:
+        colldict = json.loads(data)
+    except ValueError:
+        print("ERROR: Failed parsing data: {}".format(name))
+        return False
+    if dict2object(colldict=colldict, debug=debug, workers=workers) is None:
+        print("ERROR: Validation failed: {}".format(name))
+        return False
+    written = sharded_collection(directory, debug=debug).write(colldict)
+    if written is None:
+        return False
+    print("Wrote {} of {} artefact shards to {}".format(
+        written, len(colldict["artefacts"]), directory))
     return True
 
 
@@ -467,7 +1771,108 @@ def main():
         nargs='*',
         type=str,
         action='append',
-        help='Validate a collection file. Add filename.')
+        help='Validate collection files. Add file names, "-" for stdin '
+             'or archive#member for a tar/zip member.')
+    maincommands.add_argument(
+        '--query', '-q',
+        type=str,
+        help='Query a collection file. Add filename.')
+    parser.add_argument(
+        '--field', '-f',
+        type=str,
+        action='append',
+        default=[],
+        help='Field to output from --query, like artefact.name')
+    parser.add_argument(
+        '--where', '-w',
+        type=str,
+        action='append',
+        default=[],
+        help='Filter for --query, like format.mediatype==application/cyclonedx')
+    parser.add_argument(
+        '--workers', '-j',
+        type=int,
+        default=0,
+        help='Worker processes for validating large collections, '
+             '--apply-patch and --batch, threads for --build')
+    parser.add_argument(
+        '--output', '-o',
+        type=str,
+        help='Write the validated collection to a file')
+    parser.add_argument(
+        '--compress',
+        type=str,
+        choices=("gzip", "xz", "zstd"),
+        help='Compression for --output, default from file name suffix')
+    parser.add_argument(
+        '--level',
+        type=int,
+        help='Compression level for --output')
+    parser.add_argument(
+        '--index',
+        type=str,
+        help='Check identifiers of validated collections against '
+             'an index database and add them to it')
+    parser.add_argument(
+        '--history',
+        type=str,
+        help='Version history store directory. Validated collections '
+             'are added to it')
+    maincommands.add_argument(
+        '--build', '-b',
+        type=str,
+        metavar='DIR',
+        help='Build a collection from a directory of artefact files')
+    parser.add_argument(
+        '--digest',
+        type=str,
+        action='append',
+        help='Digest algorithm for --build, can be repeated. '
+             'Variable length digests like shake_128 are not '
+             'supported. Default: {}'.format(",".join(BUILD_DIGESTS)))
+    parser.add_argument(
+        '--base-url',
+        type=str,
+        help='URL prefix of the artefact files for --build')
+    maincommands.add_argument(
+        '--apply-patch',
+        nargs=2,
+        metavar=('PATCH', 'DIR'),
+        help='Apply a field patch or JSON Patch to all collection '
+             'files in a directory')
+    maincommands.add_argument(
+        '--batch',
+        type=str,
+        metavar='DIR',
+        help='Validate all collection files in a directory as a '
+             'resumable batch, see --checkpoint')
+    parser.add_argument(
+        '--checkpoint',
+        type=str,
+        default='tco-checkpoint.db',
+        help='Checkpoint database for --batch. Run the same batch '
+             'again to resume it. Default: tco-checkpoint.db')
+    parser.add_argument(
+        '--retry-failed',
+        action="store_true",
+        help='Validate files that failed in an earlier --batch run again')
+    maincommands.add_argument(
+        '--shard',
+        nargs=2,
+        metavar=('SOURCE', 'DIR'),
+        help='Store a collection as a sharded directory with a manifest '
+             'and one file per artefact')
+    maincommands.add_argument(
+        '--unshard',
+        type=str,
+        metavar='DIR',
+        help='Convert a sharded directory to a single collection file, '
+             'written to --output or printed')
+    maincommands.add_argument(
+        '--history-get',
+        nargs=2,
+        metavar=('UUID', 'VERSION'),
+        help='Print a collection version from the --history store')
     args = parser.parse_args()
     # Parse and set debug early
     if args.debug:
@@ -485,12 +1890,128 @@ def main():
         print("ERROR: --validate requires an option.")
         sys.exit(1)
     elif validate:
-        # we get a list in a list when using append, we need a string
-        collectionfile = validate[0][0]
-        print("DEBUG: Validating file: {}".format(collectionfile))
-        validate_collection(
-            file=collectionfile,
-            debug=debug)
+        # we get a list in a list when using append
+        failed = 0
+        index = None
+        history = None
+        if args.history:
+            from tea_collection import history_store
+            history = history_store(args.history, debug=debug)
+        if args.index:
+            from tea_collection import uuid_index
+            index = uuid_index(args.index, debug=debug)
+            if not index.open():
+                sys.exit(1)
+        for collectionfile in validate[0]:
+            print("DEBUG: Validating file: {}".format(collectionfile))
+            if not validate_collection(
+                    file=collectionfile,
+                    debug=debug,
+                    workers=args.workers,
+                    output=args.output,
+                    compression=args.compress,
+                    level=args.level,
+                    index=index,
+                    history=history):
+                failed += 1
+        if index is not None:
+            index.close()
+        if failed > 0:
+            sys.exit(1)
+        sys.exit(0)
+    if args.build:
+        algorithms = BUILD_DIGESTS
+        if args.digest:
+            algorithms = tuple(args.digest)
+        col = build_collection(
+            directory=args.build,
+            debug=debug,
+            algorithms=algorithms,
+            workers=args.workers,
+            baseurl=args.base_url)
+        if col is None:
+            sys.exit(1)
+        if args.output:
+            if not write_collection(
+                    col=col,
+                    filename=args.output,
+                    debug=debug,
+                    compression=args.compress,
+                    level=args.level):
+                sys.exit(1)
+        else:
+            print(str(col))
+        sys.exit(0)
+    if args.apply_patch:
+        if not apply_patch(
+                patchfile=args.apply_patch[0],
+                directory=args.apply_patch[1],
+                debug=debug,
+                workers=args.workers,
+                level=args.level):
+            sys.exit(1)
+        sys.exit(0)
+    if args.batch:
+        if not validate_batch(
+                directory=args.batch,
+                dbfile=args.checkpoint,
+                debug=debug,
+                workers=args.workers,
+                retry=args.retry_failed):
+            sys.exit(1)
+        sys.exit(0)
+    if args.shard:
+        if not shard_collection(
+                file=args.shard[0],
+                directory=args.shard[1],
+                debug=debug,
+                workers=args.workers):
+            sys.exit(1)
+        sys.exit(0)
+    if args.unshard:
+        docs = read_sources(source=args.unshard, debug=debug)
+        if docs is None:
+            sys.exit(1)
+        col = validate_data(
+            data=docs[0][1], name=args.unshard, debug=debug,
+            workers=args.workers)
+        if col is None:
+            sys.exit(1)
+        if args.output:
+            if not write_collection(
+                    col=col,
+                    filename=args.output,
+                    debug=debug,
+                    compression=args.compress,
+                    level=args.level):
+                sys.exit(1)
+        else:
+            print(str(col))
+        sys.exit(0)
+    if args.history_get:
+        import json
+        from tea_collection import history_store
+        if not args.history:
+            print("ERROR: --history-get requires --history")
+            sys.exit(1)
+        history = history_store(args.history, debug=debug)
+        try:
+            version = int(args.history_get[1])
+        except ValueError:
+            print("ERROR: Version must be a number")
+            sys.exit(1)
+        colldict = history.get(args.history_get[0], version)
+        if colldict is None:
+            sys.exit(1)
+        print(json.dumps(colldict, sort_keys=False, indent=4))
+        sys.exit(0)
+    if args.query:
+        if not query_collection(
+                file=args.query,
+                fields=args.field,
+                filters=args.where,
+                debug=debug):
+            sys.exit(1)
         sys.exit(0)
     if args.test:
         run_base_test(debug)
@@ -5,6 +5,74 @@
 SPDX-License-Identifier: BSD
 """
 
+# JSON output is indented like json.dumps(indent=4). Artefacts keep
+# their encoded JSON with their formats, and a collection is printed
+# by joining the kept fragments. The fragments are dropped by the
+# setters.
+JSON_INDENT = 4
+# Stands in for the artefact or format list when the other fields of
+# an object are encoded
+_CHILD_MARK = "\u0000tea-collection-children\u0000"
+
+
+def _json_fragment(struct: dict, level: int):
+    """Encode a dict as it is printed when nested level containers deep."""
+    import json
+
+    text = json.dumps(struct, sort_keys=False, indent=JSON_INDENT)
+    if level == 0:
+        return text
+    # Encoded strings never hold a raw newline
+    return text.replace("\n", "\n" + " " * (JSON_INDENT * level))
+
+
+def _json_join(before: str, fragments: list, level: int, after: str):
+    """Join encoded items to a list nested level containers deep, with
+    the text before and after it, in one copy."""
+    if len(fragments) == 0:
+        return before + "[]" + after
+    inner = "\n" + " " * (JSON_INDENT * (level + 1))
+    pieces = [before, "[", inner]
+    separator = "," + inner
+    for fragment in fragments:
+        pieces.append(fragment)
+        pieces.append(separator)
+    pieces[-1] = "\n" + " " * (JSON_INDENT * level) + "]"
+    pieces.append(after)
+    return "".join(pieces)
+
+
+def _json_split(struct: dict, childkey: str, level: int):
+    """Encode a dict without its child list.
+
+    Returns the text before and after the list, or None if that can
+    not be done and the dict has to be encoded in full."""
+    import json
+
+    if childkey not in struct:
+        return None
+    head = dict(struct)
+    head[childkey] = _CHILD_MARK
+    text = _json_fragment(head, level)
+    mark = json.dumps(_CHILD_MARK)
+    if text.count(mark) != 1:
+        return None
+    before, after = text.split(mark)
+    return before, after
+
+
+def _canonical_uuid(value):
+    """Return the canonical form of a UUID, or None if it is not one.
+
+    Used where UUIDs are compared or used as names, so the same UUID
+    written in another case or form is found."""
+    import uuid
+
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
+
 
 class collection:
     """TEA Collection object handling"""
@@ -58,27 +126,42 @@ class collection:
     def __init__(self, debug):
         """Initialise collection object"""
         self.debug = debug
+        self._json = None
         self.generate_uuid()
         self.init_struct()
 
     def __str__(self):
-        """Return a printable dnsobject in json."""
-        import json
+        """Return a printable dnsobject in json.
+
+        Only artefacts and formats changed since the last call are
+        encoded again."""
         if self.collection is None:
             return "n/a"
-        newcol = dict(self.collection)
-        artlist = self.collection["artefacts"]
-        newcol["artefacts"] = list()
-        for art in artlist:
-            artstruct = art.get_struct()
-            newart = dict(artstruct)
+        if self._json is None:
+            self._json = _json_split(self.collection, "artefacts", 0)
+        if self._json is None:
+            # Encode everything, like before fragments were cached
+            newcol = dict(self.collection)
+            newcol["artefacts"] = list()
+            for art in self.collection["artefacts"]:
+                newart = dict(art.get_struct())
+                newart["formats"] = art.get_formats()
+                newcol["artefacts"].append(newart)
+            return _json_fragment(newcol, 0)
+        artlist = list()
+        for art in self.collection["artefacts"]:
             if self.debug:
                 print(
                     "DEBUG: Artefact: {}"
-                    .format(str(newart)))
-            newart["formats"] = art.get_formats()
-            newcol["artefacts"].append(newart)
-        return json.dumps(newcol, sort_keys=False, indent=4)
+                    .format(art.get_struct().get("uuid")))
+            artlist.append(art.get_fragment(2))
+        return _json_join(self._json[0], artlist, 1, self._json[1])
+
+    def invalidate(self):
+        """Drop the cached JSON of the collection fields.
+
+        Needed after changing the collection dict directly."""
+        self._json = None
 
     def generate_uuid(self):
         """Return an UUID v 4."""
@@ -109,8 +192,9 @@ class collection:
                 print("DEBUG: UUID ValueError: {}".format(uuidstr))
             return False
         if self.debug:
-            print("DEBUG: Replaced artefact UUID to {}".format(uuidstr))
-        self.collection["uuid"] = uuidstr
+            print("DEBUG: Replaced collection UUID to {}".format(uuidstr))
+        self.collection["UUID"] = uuidstr
+        self._json = None
         return True
 
     def init_struct(self):
@@ -122,6 +206,8 @@ class collection:
                     "collection structure.\n")
             return False
         collection = dict()
+        collection["tcoFormat"] = "TEA-collection"
+        collection["specVersion"] = "1.0"
         collection["UUID"] = str(self.uuid)
         collection["product_name"] = None
         collection["product_version"] = None
@@ -134,6 +220,7 @@ class collection:
         collection["artefacts"] = list()
 
         self.collection = collection
+        self._json = None
 
     def set_author(self, name: str, org: str, email: str):
         """Set author.
@@ -149,6 +236,7 @@ class collection:
             self.collection["author_org"] = org
         if email is not None and email != "":
             self.collection["author_email"] = email
+        self._json = None
         return True
 
     def set_product(self, name: str, version: str, releasedate: str, teiid: str):
@@ -164,11 +252,13 @@ class collection:
             self.collection["product_release_date"] = releasedate
         if teiid is not None and teiid != "":
             self.collection["product_tei_id"] = teiid
+        self._json = None
         return True
 
     def set_version(self, version: int):
         """Set collection version."""
         self.collection["version"] = version
+        self._json = None
         return True
 
     def add_artefact(self, art):
@@ -219,6 +309,18 @@ class collection:
                 print("DEBUG: Collection is valid. OK!")
         return errors, errmsg
 
+    def freeze(self):
+        """Return an immutable, hashable snapshot of the collection.
+
+        The snapshot does not change when this object is changed.
+        """
+        from tea_collection.frozen import frozen_collection
+
+        artlist = list()
+        for art in self.collection["artefacts"]:
+            artlist.append(art.freeze())
+        return frozen_collection(self.collection, tuple(artlist))
+
 
 class artefact:
     """TEA Collection artefact handling"""
@@ -237,18 +339,42 @@ class artefact:
     def __init__(self, debug):
         """Initialise artefact object"""
         self.debug = debug
+        self._text = None
         self.init_struct()
 
     def __str__(self):
         """Return a printable dnsobject in json."""
-        import json
-        # Create copy object
-        newart = dict(self.artefact)
-        formlist = self.get_formats()
-        
-        newart["formats"] = formlist
-
-        return json.dumps(newart, sort_keys=False, indent=4)
+        return self.get_fragment(0)
+
+    def get_fragment(self, level: int):
+        """Return the artefact in json, nested level containers deep.
+
+        The text, formats included, is kept until the artefact or one
+        of its formats changes. Formats keep no text of their own, so
+        the encoded JSON is held once. An artefact is usually printed
+        at one level, only the last one is kept."""
+        if self._text is not None and self._text[0] == level:
+            return self._text[1]
+        parts = _json_split(self.artefact, "formats", level)
+        if parts is None:
+            newart = dict(self.artefact)
+            newart["formats"] = self.get_formats()
+            return _json_fragment(newart, level)
+        formlist = list()
+        for form in self.artefact["formats"]:
+            formlist.append(form.get_fragment(level + 2))
+        text = _json_join(parts[0], formlist, level + 1, parts[1])
+        # Only formats added with add_format() report their changes,
+        # artefacts with lazy formats are encoded every time
+        if type(self.artefact["formats"]) is list:
+            self._text = (level, text)
+        return text
+
+    def invalidate(self):
+        """Drop the cached JSON of the artefact.
+
+        Needed after changing the artefact dict directly."""
+        self._text = None
 
     def init_struct(self):
         import uuid
@@ -267,6 +393,7 @@ class artefact:
         artefact["author_email"] = None
         artefact["formats"] = list()
         self.artefact = artefact
+        self.invalidate()
         return artefact
 
     def replace_uuid(self, uuidstr: str):
@@ -283,6 +410,7 @@ class artefact:
                 print("DEBUG: UUID ValueError: {}".format(uuidstr))
             return False
         self.artefact["uuid"] = uuidstr
+        self.invalidate()
         return True
 
     def valid_key(self, key):
@@ -304,6 +432,8 @@ class artefact:
     def add_format(self, format):
         """Add format to artefact."""
         self.artefact["formats"].append(format)
+        format.add_owner(self)
+        self._text = None
         return len(self.artefact["formats"])
     
     def get_formats(self):
@@ -343,11 +473,13 @@ class artefact:
             self.artefact["author_org"] = org
         if email is not None and email != "":
             self.artefact["author_email"] = email
+        self.invalidate()
         return True
 
     def set_name(self, name: str):
         """Set artefact name."""
         self.artefact["name"] = name
+        self.invalidate()
         return True
 
     def set_description(self, desc: str):
@@ -355,6 +487,7 @@ class artefact:
         if desc is None or desc == "":
             return False
         self.artefact["description"] = desc
+        self.invalidate()
         return True
 
     def is_valid(self):
@@ -373,6 +506,15 @@ class artefact:
                 print("DEBUG: Artefact is not valid.")
         return errors, errmsg
 
+    def freeze(self):
+        """Return an immutable, hashable snapshot of the artefact."""
+        from tea_collection.frozen import frozen_artefact
+
+        formlist = list()
+        for form in self.artefact["formats"]:
+            formlist.append(form.freeze())
+        return frozen_artefact(self.artefact, tuple(formlist))
+
 
 class format():
     """A format object for an artefact."""
@@ -388,18 +530,54 @@ class format():
         "hash",
         "size"
     )
+    # More artefacts the format was added to, see add_owner()
+    _shared = ()
 
     def __init__(self, debug):
         """Initialise artefact format object"""
         self.debug = debug
+        # Weak reference to the artefact the format was added to,
+        # told about changes
+        self._owner = None
         if self.debug:
             print("DEBUG: Initialising artefact format")
         self.init_struct()
 
     def __str__(self):
         """Return a printable dnsobject in json."""
-        import json
-        return json.dumps(self.format, sort_keys=False, indent=4)
+        return self.get_fragment(0)
+
+    def get_fragment(self, level: int):
+        """Return the format in json, nested level containers deep.
+
+        Not kept, the artefact keeps its text with the formats."""
+        return _json_fragment(self.format, level)
+
+    def invalidate(self):
+        """Drop the cached JSON of all artefacts the format was added to.
+
+        Needed after changing the format dict directly."""
+        for ref in (self._owner,) + self._shared:
+            owner = ref() if ref is not None else None
+            if owner is not None:
+                owner._text = None
+
+    def add_owner(self, owner):
+        """Remember an artefact the format was added to.
+
+        A format can be shared by several artefacts, all of them are
+        told when it changes. Owners are weak references, so artefacts
+        and formats don't keep each other alive in a cycle. Weak
+        references without a callback are shared, the formats of one
+        artefact hold the same one. Most formats have one owner, it is
+        kept in its own slot so they don't carry a container."""
+        import weakref
+
+        ref = weakref.ref(owner)
+        if self._owner is None or self._owner() is None:
+            self._owner = ref
+        elif self._owner is not ref and ref not in self._shared:
+            self._shared += (ref,)
 
     def get_struct(self):
         return self.format
@@ -416,6 +594,7 @@ class format():
         format["hash"] = None
         format["size"] = 0
         self.format = format
+        self.invalidate()
         if self.debug:
             print("DEBUG: Initialised format: {}".format(str(format)))
         return format
@@ -423,21 +602,25 @@ class format():
     def set_mediatype(self, mediatype: str):
         """Set media type of doc."""
         self.format["mediatype"] = mediatype
+        self.invalidate()
         return True
 
     def set_category(self, category: str):
         """Set category of doc."""
         self.format["category"] = category
+        self.invalidate()
         return True
 
     def set_hash(self, hash: str):
         """Set hash of doc."""
         self.format["hash"] = hash
+        self.invalidate()
         return True
 
     def set_size(self, size: str):
         """Set size of doc."""
         self.format["size"] = int(size)
+        self.invalidate()
         return True
     
     def set_attributes(self, hash: str, size: int):
@@ -446,6 +629,7 @@ class format():
             self.format["hash"] = hash
         if size is not None:
             self.format["size"] = size
+        self.invalidate()
         return True
 
     def set_url(self, url: str, sigurl: str):
@@ -455,6 +639,7 @@ class format():
         self.format["url"] = url
         if sigurl is not None and sigurl != "":
             self.format["sigurl"] = sigurl
+        self.invalidate()
         return True
 
     def set_bomidentifier(self, bomid: str):
@@ -462,6 +647,7 @@ class format():
         if bomid is None or bomid == "":
             return False
         self.format["bom-identifier"] = bomid
+        self.invalidate()
         return True
 
     def valid_key(self, key):
@@ -494,6 +680,7 @@ class format():
                 print("DEBUG: UUID ValueError: {}".format(uuidstr))
             return False
         self.format["uuid"] = uuidstr
+        self.invalidate()
         return True
 
     def is_valid(self):
@@ -513,3 +700,101 @@ class format():
                 print("DEBUG: Format is not valid.")
 
         return errors, errmsg
+
+    def freeze(self):
+        """Return an immutable, hashable snapshot of the format."""
+        from tea_collection.frozen import frozen_format
+
+        return frozen_format(self.format)
+
+
+class lazy_list:
+    """A list of raw structures that become objects on first access.
+
+    Used for the artefacts of a collection and the formats of an
+    artefact when loading lazily. The builder is called with a raw dict
+    and debug flag and returns (object, errors, errmsg). Errors found
+    when an entry is built are kept in the list, since there is no
+    caller to return them to. An entry the builder can not make an
+    object of is None when indexed and skipped when iterating.
+    """
+    debug = False
+
+    def __init__(self, rawlist: list, builder, debug):
+        """Initialise with raw dicts and an object builder."""
+        self.debug = debug
+        self.errors = 0
+        self.errmsg = list()
+        self._raw = list(rawlist)
+        self._objects = [None] * len(self._raw)
+        self._builder = builder
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __iter__(self):
+        for index in range(len(self._objects)):
+            obj = self[index]
+            if obj is not None:
+                yield obj
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self._objects)
+        if self._objects[index] is None and self._raw[index] is not None:
+            obj, errors, errmsg = self._builder(self._raw[index], self.debug)
+            if errors > 0:
+                self.errors += errors
+                for msg in errmsg:
+                    self.errmsg.append("Entry {}: {}".format(index, msg))
+            self._objects[index] = obj
+            # Drop the raw data, the object holds it now
+            self._raw[index] = None
+            if self.debug:
+                print("DEBUG: Materialized lazy entry {}".format(index))
+        return self._objects[index]
+
+    def append(self, obj):
+        """Add an already built object."""
+        self._raw.append(None)
+        self._objects.append(obj)
+
+    def materialized(self):
+        """Return the number of entries built so far."""
+        count = 0
+        for obj in self._objects:
+            if obj is not None:
+                count += 1
+        return count
+
+    def validate_all(self):
+        """Build all entries, including nested lazy lists.
+
+        Returns errors and error messages like is_valid().
+        """
+        errors = 0
+        errmsg = list()
+        for obj in self:
+            if obj is None or not hasattr(obj, "get_struct"):
+                continue
+            for value in obj.get_struct().values():
+                if isinstance(value, lazy_list):
+                    newerr, newmsg = value.validate_all()
+                    errors += newerr
+                    errmsg += newmsg
+        return errors + self.errors, errmsg + self.errmsg
+
+
+# Submodules re-exported at package level
+from tea_collection.query import query  # noqa: E402
+from tea_collection.frozen import frozen_collection  # noqa: E402
+from tea_collection.frozen import frozen_artefact  # noqa: E402
+from tea_collection.frozen import frozen_format  # noqa: E402
+from tea_collection.shmpool import collection_pool  # noqa: E402
+from tea_collection.uuidindex import uuid_index  # noqa: E402
+from tea_collection.history import history_store  # noqa: E402
+from tea_collection.patch import patch  # noqa: E402
+from tea_collection.checkpoint import checkpoint_db  # noqa: E402
+from tea_collection.shard import sharded_collection  # noqa: E402
@@ -0,0 +1,221 @@
+"""Checkpoint database for batch validation jobs.
+
+Every file of a batch is a job in a SQLite database, with its status,
+the process working on it and the result. A job is "pending",
+"running", "ok" or "failed". Worker processes on the same host claim
+pending jobs in a write transaction, so no job is claimed twice. A job
+left "running" by a process that no longer exists is put back in the
+queue, so an interrupted batch continues where it stopped. Besides
+the PID, the start time of the process is kept where the system tells
+it (Linux /proc), so a PID reused after a reboot or container restart
+is not taken for the worker that claimed the job.
+
+Jobs are keyed by the real path of the file, with its modification
+time and size when it was queued. A file that changed since is queued
+again, even when it was validated before.
+
+(C) Copyright Olle E. Johansson, Edvina AB - oej@edvina.net
+
+SPDX-License-Identifier: BSD
+"""
+
+import os
+import time
+
+
+def _process_start(pid: int):
+    """Return the start time of a process in clock ticks after boot,
+    or None where /proc does not have it."""
+    try:
+        with open("/proc/{}/stat".format(pid), "rb") as filehandle:
+            stat = filehandle.read()
+        # The command name may hold spaces, fields follow the last ")"
+        return int(stat[stat.rindex(b")") + 2:].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _pid_alive(pid: int, start: int = None):
+    """Check if a process exists on this host.
+
+    With a start time, a process with the same PID that started at
+    another time is a different one."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    if start is not None:
+        current = _process_start(pid)
+        if current is not None and current != start:
+            return False
+    return True
+
+
+class checkpoint_db:
+    """A queue of batch jobs with their results."""
+    debug = False
+    statuses = ("pending", "running", "ok", "failed")
+
+    def __init__(self, filename: str, debug, timeout: float = 60.0):
+        """Initialise checkpoint object. Use open() next.
+
+        Timeout is how long to wait for a lock held by another worker."""
+        self.debug = debug
+        self.filename = filename
+        self.timeout = timeout
+        self._db = None
+
+    def open(self):
+        """Open or create the checkpoint database."""
+        import sqlite3
+
+        try:
+            # Transactions are handled here, not by the sqlite3 module
+            self._db = sqlite3.connect(
+                self.filename, timeout=self.timeout, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "path TEXT PRIMARY KEY, status TEXT NOT NULL, pid INTEGER, "
+                "started REAL, finished REAL, errors TEXT, "
+                "mtime_ns INTEGER, size INTEGER, pidstart INTEGER)")
+            columns = [row[1] for row in self._db.execute(
+                "PRAGMA table_info(jobs)")]
+            # Databases from before these columns were added
+            for column in ("mtime_ns", "size", "pidstart"):
+                if column not in columns:
+                    self._db.execute(
+                        "ALTER TABLE jobs ADD COLUMN {} INTEGER".format(
+                            column))
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        except sqlite3.Error as err:
+            print("ERROR: Can't open checkpoint {}: {}".format(
+                self.filename, err))
+            return False
+        return True
+
+    def enqueue(self, paths: list):
+        """Add jobs for new paths and queue changed files again.
+
+        Paths are stored as real paths, so the same file reached
+        through another relative path or a link is one job. A job is
+        queued again when the modification time or size of the file
+        differs from when it was queued, unless it is running.
+        Return the number of new and changed jobs."""
+        files = dict()
+        for path in paths:
+            realpath = os.path.realpath(path)
+            try:
+                stat = os.stat(realpath)
+                files[realpath] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                # Left to the worker to report
+                files[realpath] = (None, None)
+        self._db.execute("BEGIN IMMEDIATE")
+        known = dict()
+        for path, status, mtime_ns, size in self._db.execute(
+                "SELECT path, status, mtime_ns, size FROM jobs"):
+            known[path] = (status, (mtime_ns, size))
+        new = list()
+        changed = list()
+        for path, state in files.items():
+            if path not in known:
+                new.append((path, state[0], state[1]))
+            elif known[path][0] != "running" and known[path][1] != state:
+                changed.append((state[0], state[1], path))
+        self._db.executemany(
+            "INSERT INTO jobs (path, status, mtime_ns, size) "
+            "VALUES (?, 'pending', ?, ?)", new)
+        self._db.executemany(
+            "UPDATE jobs SET status = 'pending', pid = NULL, started = NULL, "
+            "finished = NULL, errors = NULL, mtime_ns = ?, size = ? "
+            "WHERE path = ?", changed)
+        self._db.execute("COMMIT")
+        if self.debug:
+            print("DEBUG: Queued {} new and {} changed jobs of {}".format(
+                len(new), len(changed), len(files)))
+        return len(new) + len(changed)
+
+    def reclaim(self):
+        """Put jobs claimed by processes that are gone back in the queue.
+
+        Return the number of jobs reclaimed."""
+        self._db.execute("BEGIN IMMEDIATE")
+        stale = list()
+        for path, pid, pidstart in self._db.execute(
+                "SELECT path, pid, pidstart FROM jobs "
+                "WHERE status = 'running'"):
+            if pid is None or not _pid_alive(pid, pidstart):
+                stale.append((path,))
+        self._db.executemany(
+            "UPDATE jobs SET status = 'pending', pid = NULL, started = NULL "
+            "WHERE path = ?", stale)
+        self._db.execute("COMMIT")
+        if self.debug and len(stale) > 0:
+            print("DEBUG: Reclaimed {} stale jobs".format(len(stale)))
+        return len(stale)
+
+    def _claim_pending(self, count: int):
+        """Mark up to count pending jobs as running in this process."""
+        self._db.execute("BEGIN IMMEDIATE")
+        paths = [row[0] for row in self._db.execute(
+            "SELECT path FROM jobs WHERE status = 'pending' "
+            "ORDER BY path LIMIT ?", (count,))]
+        pid = os.getpid()
+        pidstart = _process_start(pid)
+        self._db.executemany(
+            "UPDATE jobs SET status = 'running', pid = ?, pidstart = ?, "
+            "started = ? WHERE path = ?",
+            [(pid, pidstart, time.time(), path) for path in paths])
+        self._db.execute("COMMIT")
+        return paths
+
+    def claim(self, count: int = 1):
+        """Claim up to count pending jobs for this process.
+
+        When the queue is empty, stale jobs are reclaimed first.
+        Return the list of claimed paths, empty when all work is done
+        or claimed by live processes."""
+        paths = self._claim_pending(count)
+        if len(paths) == 0 and self.reclaim() > 0:
+            paths = self._claim_pending(count)
+        return paths
+
+    def finish(self, path: str, ok: bool, errors: str = None):
+        """Record the result of a claimed job."""
+        self._db.execute(
+            "UPDATE jobs SET status = ?, finished = ?, errors = ? "
+            "WHERE path = ? AND pid = ?",
+            ("ok" if ok else "failed", time.time(), errors, path,
+             os.getpid()))
+
+    def retry_failed(self):
+        """Put failed jobs back in the queue. Return their number."""
+        cursor = self._db.execute(
+            "UPDATE jobs SET status = 'pending', pid = NULL, started = NULL, "
+            "finished = NULL, errors = NULL WHERE status = 'failed'")
+        return cursor.rowcount
+
+    def counts(self):
+        """Return a dict of status to number of jobs."""
+        counts = dict.fromkeys(self.statuses, 0)
+        for status, count in self._db.execute(
+                "SELECT status, count(*) FROM jobs GROUP BY status"):
+            counts[status] = count
+        return counts
+
+    def failed(self):
+        """Return (path, errors) of all failed jobs."""
+        return list(self._db.execute(
+            "SELECT path, errors FROM jobs WHERE status = 'failed' "
+            "ORDER BY path"))
+
+    def close(self):
+        """Close the database."""
+        if self._db is None:
+            return
+        self._db.close()
+        self._db = None
@@ -0,0 +1,336 @@
+"""Frozen, immutable snapshots of TEA collections.
+
+A frozen collection, artefact or format never changes after creation,
+so it can be shared between threads without locks or copies. Changes
+are made copy-on-write with replace() and friends, which return a new
+snapshot sharing all unchanged artefacts and formats with the old one.
+
+(C) Copyright Olle E. Johansson, Edvina AB - oej@edvina.net
+
+SPDX-License-Identifier: BSD
+"""
+
+from types import MappingProxyType
+
+
+def _freeze_value(value):
+    """Turn lists and dicts from raw data into hashable tuples."""
+    if isinstance(value, list) or isinstance(value, tuple):
+        return tuple(_freeze_value(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(
+            (key, _freeze_value(item)) for key, item in value.items())
+    return value
+
+
+def _thaw_value(value):
+    """Turn frozen tuples back to lists for JSON output."""
+    if isinstance(value, tuple):
+        return [_thaw_value(item) for item in value]
+    return value
+
+
+class _frozen:
+    """Common base for the frozen objects."""
+    __slots__ = ("_struct", "_hash")
+    _valid_keys = ()
+    _childkey = None
+
+    def __init__(self, struct: dict, children: tuple):
+        """Store a private read-only copy of the fields."""
+        fields = dict()
+        for key, value in struct.items():
+            if key == self._childkey:
+                continue
+            fields[key] = _freeze_value(value)
+        if self._childkey is not None:
+            fields[self._childkey] = children
+        object.__setattr__(self, "_struct", MappingProxyType(fields))
+        object.__setattr__(
+            self, "_hash", hash((type(self).__name__, tuple(fields.items()))))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            "{} is immutable".format(type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError(
+            "{} is immutable".format(type(self).__name__))
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        if self is other:
+            return True
+        return self._hash == other._hash and self._struct == other._struct
+
+    def __getitem__(self, key):
+        return self._struct[key]
+
+    def __contains__(self, key):
+        return key in self._struct
+
+    def __str__(self):
+        """Return a printable object in json."""
+        import json
+        return json.dumps(self.to_dict(), sort_keys=False, indent=4)
+
+    def get(self, key, default=None):
+        """Get a field value."""
+        return self._struct.get(key, default)
+
+    def get_struct(self):
+        """Return the read-only field mapping. No copy is made."""
+        return self._struct
+
+    def key_exists(self, key):
+        """Check if key exists in object."""
+        return key in self._struct
+
+    def _changed_fields(self, changes: dict):
+        """Return a field dict with changes applied, or None if invalid."""
+        fields = dict(self._struct)
+        for key, value in changes.items():
+            if key == self._childkey or key not in self._valid_keys:
+                return None
+            fields[key] = value
+        return fields
+
+
+class frozen_format(_frozen):
+    """A frozen format view."""
+    __slots__ = ()
+    _valid_keys = (
+        "uuid",
+        "bom-identifier",
+        "mediatype",
+        "category",
+        "url",
+        "sigurl",
+        "hash",
+        "size"
+    )
+
+    def __init__(self, struct: dict):
+        """Initialise from a raw format dict."""
+        super().__init__(struct, None)
+
+    def to_dict(self):
+        """Return a new mutable dict of the format."""
+        newform = dict()
+        for key, value in self._struct.items():
+            newform[key] = _thaw_value(value)
+        return newform
+
+    def replace(self, changes: dict):
+        """Return a new frozen format with some fields changed.
+
+        Returns None if a key is not a format key.
+        """
+        fields = self._changed_fields(changes)
+        if fields is None:
+            return None
+        return frozen_format(fields)
+
+    def thaw(self, debug=False):
+        """Return a new mutable format object."""
+        from tea_collection import format
+
+        myform = format(debug=debug)
+        myform.format.update(self.to_dict())
+        return myform
+
+
+class frozen_artefact(_frozen):
+    """A frozen artefact view with frozen formats."""
+    __slots__ = ()
+    _childkey = "formats"
+    _valid_keys = (
+        "uuid",
+        "name",
+        "description",
+        "author_name",
+        "author_org",
+        "author_email"
+    )
+
+    def __init__(self, struct: dict, formats: tuple = None):
+        """Initialise from a raw artefact dict.
+
+        Formats may be given as frozen formats, otherwise the raw
+        "formats" list of the dict is frozen.
+        """
+        if formats is None:
+            formats = tuple(
+                frozen_format(form) for form in struct.get("formats", ()))
+        super().__init__(struct, tuple(formats))
+
+    def get_formats(self):
+        """Return the tuple of frozen formats."""
+        return self._struct["formats"]
+
+    def get_format(self, uuid: str):
+        """Return the frozen format with a UUID or None."""
+        for form in self._struct["formats"]:
+            if form.get("uuid") == uuid:
+                return form
+        return None
+
+    def to_dict(self):
+        """Return a new mutable dict of the artefact and its formats."""
+        newart = dict()
+        for key, value in self._struct.items():
+            if key == "formats":
+                newart[key] = [form.to_dict() for form in value]
+            else:
+                newart[key] = _thaw_value(value)
+        return newart
+
+    def replace(self, changes: dict):
+        """Return a new frozen artefact with some fields changed.
+
+        The formats are shared with this artefact.
+        Returns None if a key is not an artefact key.
+        """
+        fields = self._changed_fields(changes)
+        if fields is None:
+            return None
+        return frozen_artefact(fields, self.get_formats())
+
+    def add_format(self, form: frozen_format):
+        """Return a new frozen artefact with a format added."""
+        return frozen_artefact(
+            self._struct, self.get_formats() + (form,))
+
+    def replace_format(self, form: frozen_format):
+        """Return a new frozen artefact with the format of the same UUID
+        replaced. Returns None if there is no such format."""
+        formats = list(self.get_formats())
+        for index, old in enumerate(formats):
+            if old.get("uuid") == form.get("uuid"):
+                formats[index] = form
+                return frozen_artefact(self._struct, tuple(formats))
+        return None
+
+    def remove_format(self, uuid: str):
+        """Return a new frozen artefact without the format with a UUID."""
+        formats = tuple(
+            form for form in self.get_formats() if form.get("uuid") != uuid)
+        return frozen_artefact(self._struct, formats)
+
+    def thaw(self, debug=False):
+        """Return a new mutable artefact object with its formats."""
+        from tea_collection import artefact
+
+        myart = artefact(debug=debug)
+        for key, value in self._struct.items():
+            if key != "formats":
+                myart.artefact[key] = _thaw_value(value)
+        for form in self.get_formats():
+            myart.add_format(form.thaw(debug=debug))
+        return myart
+
+
+class frozen_collection(_frozen):
+    """A frozen collection snapshot with frozen artefacts."""
+    __slots__ = ()
+    _childkey = "artefacts"
+    _valid_keys = (
+        "tcoFormat",
+        "specVersion",
+        "UUID",
+        "uuid",
+        "product_name",
+        "product_version",
+        "product_release_date",
+        "product_tei_id",
+        "version",
+        "author_name",
+        "author_org",
+        "author_email"
+    )
+
+    def __init__(self, struct: dict, artefacts: tuple = None):
+        """Initialise from a raw collection dict.
+
+        Artefacts may be given as frozen artefacts, otherwise the raw
+        "artefacts" list of the dict is frozen.
+        """
+        if artefacts is None:
+            artefacts = tuple(
+                frozen_artefact(art) for art in struct.get("artefacts", ()))
+        super().__init__(struct, tuple(artefacts))
+
+    def get_artefacts(self):
+        """Return the tuple of frozen artefacts."""
+        return self._struct["artefacts"]
+
+    def get_artefact(self, uuid: str):
+        """Return the frozen artefact with a UUID or None."""
+        for art in self._struct["artefacts"]:
+            if art.get("uuid") == uuid:
+                return art
+        return None
+
+    def to_dict(self):
+        """Return a new mutable dict of the full collection."""
+        newcol = dict()
+        for key, value in self._struct.items():
+            if key == "artefacts":
+                newcol[key] = [art.to_dict() for art in value]
+            else:
+                newcol[key] = _thaw_value(value)
+        return newcol
+
+    def replace(self, changes: dict):
+        """Return a new frozen collection with some fields changed.
+
+        The artefacts are shared with this collection.
+        Returns None if a key is not a collection key.
+        """
+        fields = self._changed_fields(changes)
+        if fields is None:
+            return None
+        return frozen_collection(fields, self.get_artefacts())
+
+    def add_artefact(self, art: frozen_artefact):
+        """Return a new frozen collection with an artefact added."""
+        return frozen_collection(
+            self._struct, self.get_artefacts() + (art,))
+
+    def replace_artefact(self, art: frozen_artefact):
+        """Return a new frozen collection with the artefact of the same
+        UUID replaced. Returns None if there is no such artefact."""
+        artefacts = list(self.get_artefacts())
+        for index, old in enumerate(artefacts):
+            if old.get("uuid") == art.get("uuid"):
+                artefacts[index] = art
+                return frozen_collection(self._struct, tuple(artefacts))
+        return None
+
+    def remove_artefact(self, uuid: str):
+        """Return a new frozen collection without the artefact with a UUID."""
+        artefacts = tuple(
+            art for art in self.get_artefacts() if art.get("uuid") != uuid)
+        return frozen_collection(self._struct, artefacts)
+
+    def thaw(self, debug=False):
+        """Return a new mutable collection object with all artefacts."""
+        import uuid
+        from tea_collection import collection
+
+        mycol = collection(debug=debug)
+        for key, value in self._struct.items():
+            if key != "artefacts":
+                mycol.collection[key] = _thaw_value(value)
+        try:
+            mycol.uuid = uuid.UUID(mycol.collection["UUID"])
+        except (TypeError, ValueError):
+            if debug:
+                print("DEBUG: Frozen collection has bad UUID")
+        for art in self.get_artefacts():
+            mycol.add_artefact(art.thaw(debug=debug))
+        return mycol
@@ -0,0 +1,358 @@
+"""Version history store for TEA collections.
+
+Every version of a collection is kept, but most versions are stored as
+a compact delta against the version before. Artefacts and formats in a
+delta are keyed by their UUID. Every snapshot_every versions a full
+snapshot is stored, so a version is rebuilt by replaying at most that
+many deltas from the nearest snapshot.
+
+Layout
+
+    <store>/<collection UUID>/<version>.snap.json   full collection
+    <store>/<collection UUID>/<version>.delta.json  delta
+
+Directory names are the canonical form of the collection UUID, other
+values are rejected so they can not point outside the store.
+
+A delta holds the changed top level fields, the artefact UUID order
+if it changed, and per changed artefact either the full new artefact
+or its changed fields, format order and changed formats.
+
+(C) Copyright Olle E. Johansson, Edvina AB - oej@edvina.net
+
+SPDX-License-Identifier: BSD
+"""
+
+import copy
+import json
+import os
+
+
+def _uuid_list(structs: list):
+    """Return the UUIDs of a list of raw dicts, or None if they are
+    missing or not unique."""
+    uuids = list()
+    for struct in structs:
+        uuid = struct.get("uuid")
+        if uuid is None:
+            return None
+        uuids.append(uuid)
+    if len(set(uuids)) != len(uuids):
+        return None
+    return uuids
+
+
+def _field_changes(old: dict, new: dict, childkey: str):
+    """Return the fields that differ, ignoring the child list."""
+    changes = dict()
+    for key, value in new.items():
+        if key == childkey:
+            continue
+        if key not in old or old[key] != value:
+            changes[key] = value
+    return changes
+
+
+def _removed_fields(old: dict, new: dict):
+    """Return the keys dropped from old."""
+    return [key for key in old.keys() if key not in new]
+
+
+def _child_delta(oldlist: list, newlist: list, childdelta):
+    """Return the delta of a list of artefacts or formats, or None if
+    the lists can not be keyed by UUID."""
+    olduuids = _uuid_list(oldlist)
+    newuuids = _uuid_list(newlist)
+    if olduuids is None or newuuids is None:
+        return None
+    oldmap = dict(zip(olduuids, oldlist))
+    delta = dict()
+    if olduuids != newuuids:
+        delta["order"] = newuuids
+    changed = dict()
+    for uuid, new in zip(newuuids, newlist):
+        if uuid not in oldmap:
+            changed[uuid] = {"full": new}
+            continue
+        if oldmap[uuid] == new:
+            continue
+        entry = childdelta(oldmap[uuid], new)
+        if entry is None:
+            return None
+        changed[uuid] = entry
+    if len(changed) > 0:
+        delta["changed"] = changed
+    return delta
+
+
+def _format_delta(old: dict, new: dict):
+    """Return the delta of one format."""
+    delta = dict()
+    delta["fields"] = _field_changes(old, new, None)
+    removed = _removed_fields(old, new)
+    if len(removed) > 0:
+        delta["removed"] = removed
+    return delta
+
+
+def _artefact_delta(old: dict, new: dict):
+    """Return the delta of one artefact, or None."""
+    delta = _format_delta(old, new)
+    delta["fields"].pop("formats", None)
+    if "removed" in delta and "formats" in delta["removed"]:
+        return None
+    formats = _child_delta(
+        old.get("formats", list()), new.get("formats", list()),
+        _format_delta)
+    if formats is None:
+        return None
+    if len(formats) > 0:
+        delta["formats"] = formats
+    return delta
+
+
+def make_delta(old: dict, new: dict):
+    """Return a delta that turns raw collection old into new.
+
+    Returns None if the collections can not be keyed by UUID, then a
+    snapshot has to be stored.
+    """
+    delta = dict()
+    delta["fields"] = _field_changes(old, new, "artefacts")
+    removed = _removed_fields(old, new)
+    if "artefacts" in removed:
+        return None
+    if len(removed) > 0:
+        delta["removed"] = removed
+    artefacts = _child_delta(
+        old.get("artefacts", list()), new.get("artefacts", list()),
+        _artefact_delta)
+    if artefacts is None:
+        return None
+    if len(artefacts) > 0:
+        delta["artefacts"] = artefacts
+    return delta
+
+
+def _apply_fields(struct: dict, delta: dict):
+    """Return a new dict with changed and removed fields applied."""
+    newstruct = dict(struct)
+    for key in delta.get("removed", ()):
+        newstruct.pop(key, None)
+    newstruct.update(delta["fields"])
+    return newstruct
+
+
+def _apply_child_delta(oldlist: list, delta: dict, applychild):
+    """Return a new list of artefacts or formats with a delta applied.
+
+    Unchanged entries are shared with the old list."""
+    oldmap = dict()
+    for struct in oldlist:
+        oldmap[struct["uuid"]] = struct
+    order = delta.get("order")
+    if order is None:
+        order = [struct["uuid"] for struct in oldlist]
+    changed = delta.get("changed", dict())
+    newlist = list()
+    for uuid in order:
+        if uuid in changed:
+            if "full" in changed[uuid]:
+                newlist.append(changed[uuid]["full"])
+            else:
+                newlist.append(applychild(oldmap[uuid], changed[uuid]))
+        else:
+            newlist.append(oldmap[uuid])
+    return newlist
+
+
+def _apply_artefact_delta(old: dict, delta: dict):
+    """Return a new artefact with a delta applied."""
+    newart = _apply_fields(old, delta)
+    if "formats" in delta:
+        newart["formats"] = _apply_child_delta(
+            old.get("formats", list()), delta["formats"], _apply_fields)
+    return newart
+
+
+def apply_delta(old: dict, delta: dict):
+    """Return raw collection old with a delta applied.
+
+    The result shares unchanged artefacts and formats with old.
+    """
+    newcol = _apply_fields(old, delta)
+    if "artefacts" in delta:
+        newcol["artefacts"] = _apply_child_delta(
+            old.get("artefacts", list()), delta["artefacts"],
+            _apply_artefact_delta)
+    return newcol
+
+
+class history_store:
+    """A directory of collection versions stored as snapshots and deltas."""
+    debug = False
+
+    def __init__(self, path: str, debug, snapshot_every: int = 10):
+        """Initialise store object for a directory."""
+        self.debug = debug
+        self.path = path
+        self.snapshot_every = snapshot_every
+        # Last version added per collection, saves rebuilding it
+        self._latest = dict()
+
+    def _canonical(self, uuid):
+        """Return the canonical form of a UUID, or None if it is not one."""
+        from tea_collection import _canonical_uuid
+
+        canonical = _canonical_uuid(uuid)
+        if canonical is None:
+            print("ERROR: Not a valid collection UUID: {}".format(uuid))
+        return canonical
+
+    def _dir(self, uuid: str):
+        return os.path.join(self.path, uuid)
+
+    def _versions(self, uuid: str):
+        """Return sorted (version, kind) of a collection, kind is
+        "snap" or "delta". The UUID must be canonical."""
+        try:
+            names = os.listdir(self._dir(uuid))
+        except FileNotFoundError:
+            return list()
+        versions = list()
+        for name in names:
+            parts = name.split(".")
+            if len(parts) == 3 and parts[2] == "json" and parts[0].isdigit():
+                versions.append((int(parts[0]), parts[1]))
+        versions.sort()
+        return versions
+
+    def versions(self, uuid: str):
+        """Return the sorted list of stored versions of a collection."""
+        uuid = self._canonical(uuid)
+        if uuid is None:
+            return list()
+        return [version for version, _ in self._versions(uuid)]
+
+    def _read(self, uuid: str, version: int, kind: str):
+        filename = os.path.join(
+            self._dir(uuid), "{}.{}.json".format(version, kind))
+        with open(filename, "r", encoding="utf-8") as filehandle:
+            return json.load(filehandle)
+
+    def _write(self, uuid: str, version: int, kind: str, data: dict):
+        """Write a file atomically."""
+        filename = os.path.join(
+            self._dir(uuid), "{}.{}.json".format(version, kind))
+        tmpname = filename + ".tmp"
+        with open(tmpname, "w", encoding="utf-8") as filehandle:
+            json.dump(data, filehandle, separators=(",", ":"))
+        os.replace(tmpname, filename)
+        if self.debug:
+            print("DEBUG: Stored {} {} version {}".format(kind, uuid, version))
+
+    def add(self, col):
+        """Store a new version of a collection.
+
+        Accepts collection objects, frozen collections and raw dicts.
+        The version must be higher than all stored versions. Adding the
+        latest version again with the same content does nothing and
+        returns True.
+        """
+        from tea_collection import collection
+        from tea_collection.frozen import frozen_collection
+
+        if isinstance(col, collection):
+            col = col.freeze().to_dict()
+        elif isinstance(col, frozen_collection):
+            col = col.to_dict()
+        else:
+            # Kept as the base of the next delta, must not change
+            col = copy.deepcopy(col)
+        uuid = col.get("UUID")
+        version = col.get("version")
+        if uuid is None or not isinstance(version, int):
+            print("ERROR: Collection needs UUID and integer version")
+            return False
+        uuid = self._canonical(uuid)
+        if uuid is None:
+            return False
+        stored = self._versions(uuid)
+        if len(stored) > 0 and stored[-1][0] == version:
+            # Adding the latest version again is not an error
+            if uuid in self._latest and self._latest[uuid][0] == version:
+                latest = self._latest[uuid][1]
+            else:
+                latest = self.get(uuid, version)
+            if latest == col:
+                if self.debug:
+                    print("DEBUG: Version {} of {} is already stored".format(
+                        version, uuid))
+                self._latest[uuid] = (version, latest)
+                return True
+            print("ERROR: Version {} of {} is stored with other content"
+                  .format(version, uuid))
+            return False
+        if len(stored) > 0 and stored[-1][0] > version:
+            print("ERROR: Version {} of {} is not newer than {}".format(
+                version, uuid, stored[-1][0]))
+            return False
+        os.makedirs(self._dir(uuid), exist_ok=True)
+
+        sincesnap = 0
+        for _, kind in reversed(stored):
+            if kind == "snap":
+                break
+            sincesnap += 1
+        delta = None
+        if len(stored) > 0 and sincesnap + 1 < self.snapshot_every:
+            if uuid in self._latest and self._latest[uuid][0] == stored[-1][0]:
+                previous = self._latest[uuid][1]
+            else:
+                previous = self.get(uuid, stored[-1][0])
+            delta = make_delta(previous, col)
+        if delta is None:
+            self._write(uuid, version, "snap", col)
+        else:
+            self._write(uuid, version, "delta", delta)
+        self._latest[uuid] = (version, col)
+        return True
+
+    def get(self, uuid: str, version: int):
+        """Return a stored version of a collection as a raw dict, or None."""
+        uuid = self._canonical(uuid)
+        if uuid is None:
+            return None
+        stored = self._versions(uuid)
+        target = None
+        for position, (stversion, _) in enumerate(stored):
+            if stversion == version:
+                target = position
+        if target is None:
+            print("ERROR: No version {} of collection {}".format(
+                version, uuid))
+            return None
+        start = target
+        while stored[start][1] != "snap":
+            start -= 1
+            if start < 0:
+                print("ERROR: No snapshot for collection {}".format(uuid))
+                return None
+        col = self._read(uuid, stored[start][0], "snap")
+        for stversion, _ in stored[start + 1:target + 1]:
+            col = apply_delta(col, self._read(uuid, stversion, "delta"))
+        if self.debug:
+            print("DEBUG: Rebuilt version {} from snapshot {} and {} "
+                  "deltas".format(version, stored[start][0], target - start))
+        return col
+
+    def size(self, uuid: str):
+        """Return the bytes stored for a collection."""
+        uuid = self._canonical(uuid)
+        if uuid is None:
+            return 0
+        total = 0
+        for version, kind in self._versions(uuid):
+            total += os.path.getsize(os.path.join(
+                self._dir(uuid), "{}.{}.json".format(version, kind)))
+        return total
@@ -0,0 +1,319 @@
+"""Patches for raw TEA collection documents.
+
+Two patch formats are accepted. A field patch is a JSON object with a
+list of operations on "level.key" fields, using the same field and
+filter syntax as query:
+
+    {"patch": [
+        {"set": "collection.author_org", "value": "Example Inc"},
+        {"replace": "format.url",
+         "old": "https://old.example.com/",
+         "new": "https://mirror.example.com/",
+         "where": ["format.mediatype==application/cyclonedx"]}
+    ]}
+
+"set" gives a field a new value, "replace" replaces a substring of a
+string field. "where" filters are optional.
+
+A JSON Patch (RFC 6902) is a JSON list of operations, like
+{"op": "replace", "path": "/artefacts/0/name", "value": "SBOM"}.
+All six operations are supported.
+
+Patches change the document in place and keep track of the artefacts
+they touched, so only those have to be validated again.
+
+(C) Copyright Olle E. Johansson, Edvina AB - oej@edvina.net
+
+SPDX-License-Identifier: BSD
+"""
+
+import copy
+
+
+class patch:
+    """A field patch or JSON Patch for raw collection dicts."""
+    debug = False
+
+    def __init__(self, debug):
+        """Initialise an empty patch."""
+        self.debug = debug
+        self.operations = list()
+        self.jsonpatch = False
+
+    def load(self, patchdata):
+        """Load a parsed patch document. Return errors and error messages."""
+        from tea_collection import query
+
+        errors = 0
+        errmsg = list()
+        if isinstance(patchdata, list):
+            self.jsonpatch = True
+            for operation in patchdata:
+                if (not isinstance(operation, dict)
+                        or operation.get("op") not in (
+                            "add", "remove", "replace", "move", "copy",
+                            "test")
+                        or not isinstance(operation.get("path"), str)):
+                    errors += 1
+                    errmsg.append(
+                        "ERROR: Bad JSON Patch operation: {}".format(
+                            operation))
+                    continue
+                if (operation["op"] in ("move", "copy")
+                        and not isinstance(operation.get("from"), str)):
+                    errors += 1
+                    errmsg.append(
+                        "ERROR: JSON Patch {} needs from: {}".format(
+                            operation["op"], operation))
+                    continue
+                if (operation["op"] in ("add", "replace", "test")
+                        and "value" not in operation):
+                    errors += 1
+                    errmsg.append(
+                        "ERROR: JSON Patch {} needs value: {}".format(
+                            operation["op"], operation))
+                    continue
+                self.operations.append(operation)
+            return errors, errmsg
+
+        if not isinstance(patchdata, dict) or not isinstance(
+                patchdata.get("patch"), list):
+            return 1, ["ERROR: Patch is neither a field patch nor JSON Patch"]
+        for operation in patchdata["patch"]:
+            if not isinstance(operation, dict):
+                errors += 1
+                errmsg.append("ERROR: Bad patch operation: {}".format(
+                    operation))
+                continue
+            filt = query(debug=self.debug)
+            if "set" in operation and "value" in operation:
+                kind = "set"
+            elif ("replace" in operation
+                    and isinstance(operation.get("old"), str)
+                    and isinstance(operation.get("new"), str)):
+                kind = "replace"
+            else:
+                errors += 1
+                errmsg.append("ERROR: Bad patch operation: {}".format(
+                    operation))
+                continue
+            split = filt.split_spec(operation[kind])
+            if split is None:
+                errors += 1
+                errmsg.append("ERROR: Bad patch field: {}".format(
+                    operation[kind]))
+                continue
+            where = operation.get("where", list())
+            if isinstance(where, str):
+                where = [where]
+            for spec in where:
+                if not filt.add_filter(spec):
+                    errors += 1
+                    errmsg.append("ERROR: Bad patch filter: {}".format(spec))
+            self.operations.append((kind, split[0], split[1], operation, filt))
+        return errors, errmsg
+
+    def apply(self, colldict: dict):
+        """Apply the patch to a raw collection in place.
+
+        Returns changes, fieldschanged, touched, errors and error
+        messages. Changes is the number of changed values, fieldschanged
+        is True if collection fields changed and touched is the list
+        of changed artefact dicts. A JSON Patch is all or nothing, on
+        errors the collection is left as it was.
+        """
+        if self.jsonpatch:
+            return self._apply_jsonpatch(colldict)
+        changes = 0
+        fieldschanged = False
+        touched = dict()
+        for kind, level, key, operation, filt in self.operations:
+            if not filt.matches("collection", colldict):
+                continue
+            if level == "collection":
+                if self._change(colldict, kind, key, operation):
+                    changes += 1
+                    fieldschanged = True
+                continue
+            for art in colldict.get("artefacts", ()):
+                if not isinstance(art, dict) or not filt.matches(
+                        "artefact", art):
+                    continue
+                if level == "artefact":
+                    if (len(filt.filters["format"]) > 0
+                            and not any(
+                                isinstance(form, dict)
+                                and filt.matches("format", form)
+                                for form in art.get("formats", ()))):
+                        continue
+                    if self._change(art, kind, key, operation):
+                        changes += 1
+                        touched[id(art)] = art
+                    continue
+                for form in art.get("formats", ()):
+                    if not isinstance(form, dict) or not filt.matches(
+                            "format", form):
+                        continue
+                    if self._change(form, kind, key, operation):
+                        changes += 1
+                        touched[id(art)] = art
+        if self.debug:
+            print("DEBUG: Patch made {} changes in {} artefacts".format(
+                changes, len(touched)))
+        return changes, fieldschanged, list(touched.values()), 0, list()
+
+    def _change(self, thisdict: dict, kind: str, key: str, operation: dict):
+        """Change one field. Return True if the value changed."""
+        old = thisdict.get(key)
+        if kind == "set":
+            new = operation["value"]
+        elif isinstance(old, str):
+            new = old.replace(operation["old"], operation["new"])
+        else:
+            return False
+        if key in thisdict and old == new:
+            return False
+        thisdict[key] = copy.deepcopy(new)
+        return True
+
+    def _apply_jsonpatch(self, colldict: dict):
+        """Apply JSON Patch operations to a copy, then move it into place."""
+        work = copy.deepcopy(colldict)
+        errors = 0
+        errmsg = list()
+        changes = 0
+        for operation in self.operations:
+            try:
+                if self._jsonpatch_op(work, operation):
+                    changes += 1
+            except (KeyError, IndexError, TypeError, ValueError) as err:
+                errors += 1
+                errmsg.append("ERROR: JSON Patch {} {} failed: {}".format(
+                    operation["op"], operation["path"], err))
+                break
+        if errors > 0:
+            return 0, False, list(), errors, errmsg
+        if changes == 0 or work == colldict:
+            return 0, False, list(), 0, list()
+
+        # Artefacts equal to one in the original are not touched
+        oldarts = colldict.get("artefacts")
+        newarts = work.get("artefacts")
+        touched = list()
+        if isinstance(newarts, list):
+            if not isinstance(oldarts, list):
+                oldarts = list()
+            olduuid = dict()
+            for art in oldarts:
+                if isinstance(art, dict) and isinstance(
+                        art.get("uuid"), str):
+                    olduuid[art["uuid"]] = art
+            for art in newarts:
+                old = None
+                if isinstance(art, dict):
+                    old = olduuid.get(art.get("uuid"))
+                if old is None or old != art:
+                    touched.append(art)
+        fieldschanged = False
+        for key in set(colldict.keys()) | set(work.keys()):
+            if key != "artefacts" and colldict.get(key) != work.get(key):
+                fieldschanged = True
+        if (not isinstance(newarts, list)
+                or ("artefacts" in colldict) != ("artefacts" in work)):
+            fieldschanged = True
+        colldict.clear()
+        colldict.update(work)
+        if self.debug:
+            print("DEBUG: JSON Patch made {} changes in {} artefacts".format(
+                changes, len(touched)))
+        return changes, fieldschanged, touched, 0, list()
+
+    def _pointer(self, path: str):
+        """Split a JSON Pointer into unescaped tokens."""
+        if path == "":
+            return list()
+        if not path.startswith("/"):
+            raise ValueError("pointer must start with /: {}".format(path))
+        return [token.replace("~1", "/").replace("~0", "~")
+                for token in path[1:].split("/")]
+
+    def _index(self, container: list, token: str, adding: bool):
+        """Return a list index from a pointer token."""
+        if token == "-" and adding:
+            return len(container)
+        if not token.isdigit() or (token != "0" and token.startswith("0")):
+            raise ValueError("bad array index: {}".format(token))
+        index = int(token)
+        if index > len(container) or (index == len(container) and not adding):
+            raise IndexError("array index out of range: {}".format(token))
+        return index
+
+    def _parent(self, document, path: str):
+        """Return the container of a pointer and the last token."""
+        tokens = self._pointer(path)
+        if len(tokens) == 0:
+            raise ValueError("can not change the whole document")
+        parent = document
+        for token in tokens[:-1]:
+            if isinstance(parent, list):
+                parent = parent[self._index(parent, token, False)]
+            elif isinstance(parent, dict):
+                parent = parent[token]
+            else:
+                raise TypeError("not a container: {}".format(token))
+        return parent, tokens[-1]
+
+    def _get(self, document, path: str):
+        parent, token = self._parent(document, path)
+        if isinstance(parent, list):
+            return parent[self._index(parent, token, False)]
+        if isinstance(parent, dict):
+            return parent[token]
+        raise TypeError("not a container: {}".format(token))
+
+    def _remove(self, document, path: str):
+        parent, token = self._parent(document, path)
+        if isinstance(parent, list):
+            return parent.pop(self._index(parent, token, False))
+        if isinstance(parent, dict):
+            return parent.pop(token)
+        raise TypeError("not a container: {}".format(token))
+
+    def _add(self, document, path: str, value):
+        parent, token = self._parent(document, path)
+        if isinstance(parent, list):
+            parent.insert(self._index(parent, token, True), value)
+        elif isinstance(parent, dict):
+            parent[token] = value
+        else:
+            raise TypeError("not a container: {}".format(token))
+
+    def _jsonpatch_op(self, document: dict, operation: dict):
+        """Apply one JSON Patch operation. Return False for "test"."""
+        kind = operation["op"]
+        path = operation["path"]
+        if kind == "test":
+            if self._get(document, path) != operation["value"]:
+                raise ValueError("test failed")
+            return False
+        if kind == "remove":
+            self._remove(document, path)
+        elif kind == "add":
+            self._add(document, path, copy.deepcopy(operation["value"]))
+        elif kind == "replace":
+            self._get(document, path)
+            parent, token = self._parent(document, path)
+            if isinstance(parent, list):
+                parent[self._index(parent, token, False)] = copy.deepcopy(
+                    operation["value"])
+            else:
+                parent[token] = copy.deepcopy(operation["value"])
+        elif kind == "move":
+            if path.startswith(operation["from"] + "/"):
+                raise ValueError("can not move into itself")
+            self._add(document, path, self._remove(
+                document, operation["from"]))
+        elif kind == "copy":
+            self._add(document, path, copy.deepcopy(
+                self._get(document, operation["from"])))
+        return True
@@ -0,0 +1,244 @@
+"""Projection and filter queries over TEA collection documents.
+
+Filters are applied while the JSON text is parsed: artefacts and formats
+that do not match are dropped by the parser hook and never become
+collection, artefact or format objects.
+
+(C) Copyright Olle E. Johansson, Edvina AB - oej@edvina.net
+
+SPDX-License-Identifier: BSD
+"""
+
+# Marker returned from the parser hook for list entries that are dropped
+_SKIP = object()
+
+
+class query:
+    """A query with field projections and filters.
+
+    Fields and filters are given as "level.key" where level is one of
+    "collection", "artefact" or "format", for example
+    "format.mediatype==application/cyclonedx" or "artefact.name".
+    """
+    debug = False
+    levels = ("collection", "artefact", "format")
+    # A filter is split at whichever of these comes first in it
+    operators = ("!=", "~=", "==")
+    _valid_keys = {
+        "collection": (
+            "tcoFormat",
+            "specVersion",
+            "UUID",
+            "product_name",
+            "product_version",
+            "product_release_date",
+            "product_tei_id",
+            "version",
+            "author_name",
+            "author_org",
+            "author_email"
+        ),
+        "artefact": (
+            "uuid",
+            "name",
+            "description",
+            "author_name",
+            "author_org",
+            "author_email"
+        ),
+        "format": (
+            "uuid",
+            "bom-identifier",
+            "mediatype",
+            "category",
+            "url",
+            "sigurl",
+            "hash",
+            "size"
+        )
+    }
+
+    def __init__(self, debug):
+        """Initialise an empty query - everything matches."""
+        self.debug = debug
+        self.fields = dict()
+        self.filters = dict()
+        for level in self.levels:
+            self.fields[level] = list()
+            self.filters[level] = list()
+
+    def split_spec(self, spec: str):
+        """Split "level.key" into level and key. Return None if invalid."""
+        if spec is None or "." not in spec:
+            if self.debug:
+                print("DEBUG: Query field not level.key: {}".format(spec))
+            return None
+        level, key = spec.split(".", 1)
+        if level not in self.levels:
+            if self.debug:
+                print("DEBUG: Unknown query level: {}".format(level))
+            return None
+        if key not in self._valid_keys[level]:
+            if self.debug:
+                print("DEBUG: Unknown {} key: {}".format(level, key))
+            return None
+        return level, key
+
+    def add_field(self, spec: str):
+        """Add a projected field like "artefact.name"."""
+        split = self.split_spec(spec)
+        if split is None:
+            return False
+        level, key = split
+        if key not in self.fields[level]:
+            self.fields[level].append(key)
+        return True
+
+    def add_filter(self, spec: str):
+        """Add a filter like "format.mediatype==application/cyclonedx".
+
+        Operators are == (equal), != (not equal) and ~= (contains).
+        The value "null" matches JSON null. The spec is split at the
+        first operator, so values may contain operators.
+        """
+        if spec is None:
+            return False
+        operator = None
+        position = -1
+        for candidate in self.operators:
+            found = spec.find(candidate)
+            if found >= 0 and (position < 0 or found < position):
+                operator = candidate
+                position = found
+        if operator is None:
+            if self.debug:
+                print("DEBUG: No operator in query filter: {}".format(spec))
+            return False
+        field = spec[:position]
+        value = spec[position + len(operator):]
+        split = self.split_spec(field.strip())
+        if split is None:
+            return False
+        level, key = split
+        self.filters[level].append((key, operator, value))
+        if self.debug:
+            print("DEBUG: Added {} filter {} {} {}".format(
+                level, key, operator, value))
+        return True
+
+    def is_projecting(self):
+        """Check if any fields are projected."""
+        for level in self.levels:
+            if len(self.fields[level]) > 0:
+                return True
+        return False
+
+    def matches(self, level: str, thisdict: dict):
+        """Check a raw dict against all filters of a level."""
+        for key, operator, value in self.filters[level]:
+            found = thisdict.get(key)
+            if found is None:
+                found = "null"
+            else:
+                found = str(found)
+            if operator == "==" and found != value:
+                return False
+            if operator == "!=" and found == value:
+                return False
+            if operator == "~=" and value not in found:
+                return False
+        return True
+
+    def project(self, level: str, thisdict: dict):
+        """Reduce a raw dict to the projected fields of a level."""
+        if not self.is_projecting():
+            return thisdict
+        newdict = dict()
+        for key in self.fields[level]:
+            newdict[key] = thisdict.get(key)
+        return newdict
+
+    def _hook(self, thisdict: dict):
+        """JSON object hook - filter and project while parsing.
+
+        The parser calls the hook innermost first, so formats are
+        handled before their artefact and artefacts before the collection.
+        """
+        if "artefacts" in thisdict:
+            # The collection itself
+            artlist = list()
+            for art in thisdict["artefacts"]:
+                if art is not _SKIP:
+                    artlist.append(art)
+            thisdict["artefacts"] = artlist
+            return thisdict
+        if "formats" in thisdict:
+            # An artefact
+            if not self.matches("artefact", thisdict):
+                return _SKIP
+            formlist = list()
+            for form in thisdict["formats"]:
+                if form is not _SKIP:
+                    formlist.append(form)
+            if len(self.filters["format"]) > 0 and len(formlist) == 0:
+                return _SKIP
+            newart = self.project("artefact", thisdict)
+            if not self.is_projecting() or len(self.fields["format"]) > 0:
+                newart["formats"] = formlist
+            return newart
+        # A format
+        if not self.matches("format", thisdict):
+            return _SKIP
+        return self.project("format", thisdict)
+
+    def load(self, data):
+        """Parse JSON text and return the pruned collection dict."""
+        import json
+
+        try:
+            colldict = json.loads(data, object_hook=self._hook)
+        except ValueError:
+            print("ERROR: Failed parsing data for query")
+            return None
+        if not isinstance(colldict, dict) or "artefacts" not in colldict:
+            print("ERROR: Query data is not a collection")
+            return None
+        if not self.matches("collection", colldict):
+            if self.debug:
+                print("DEBUG: Collection does not match query filters")
+            colldict["artefacts"] = list()
+        return colldict
+
+    def rows(self, data):
+        """Parse JSON text and return a list of flat result rows.
+
+        Each row is a dict keyed by "level.key". With format fields
+        projected there is one row per matching format, otherwise
+        one row per matching artefact.
+        """
+        colldict = self.load(data)
+        if colldict is None:
+            return None
+        colrow = dict()
+        for key in self.fields["collection"]:
+            colrow["collection." + key] = colldict.get(key)
+        if len(self.fields["artefact"]) == 0 and len(self.fields["format"]) == 0:
+            if len(colldict["artefacts"]) == 0:
+                return list()
+            return [colrow]
+        result = list()
+        for art in colldict["artefacts"]:
+            artrow = dict(colrow)
+            for key in self.fields["artefact"]:
+                artrow["artefact." + key] = art.get(key)
+            if len(self.fields["format"]) == 0:
+                result.append(artrow)
+                continue
+            for form in art["formats"]:
+                row = dict(artrow)
+                for key in self.fields["format"]:
+                    row["format." + key] = form.get(key)
+                result.append(row)
+        if self.debug:
+            print("DEBUG: Query returned {} rows".format(len(result)))
+        return result
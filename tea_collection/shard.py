@@ -0,0 +1,283 @@
+"""Sharded on-disk layout for large TEA collections.
+
+A sharded collection is a directory with a small manifest and one
+shard file per artefact:
+
+    <dir>/manifest.json                          collection fields and index
+    <dir>/artefacts/<artefact UUID>-<hash>.json  one artefact with formats
+
+The manifest holds all collection fields except "artefacts". The
+artefact list is replaced by "artefact_index", which keeps the order
+and per artefact the UUID, name, shard file and SHA-256 digest of the
+shard. Readers load only the shards they need and check their
+digests. The writer compares digests and rewrites only the shards of
+changed artefacts.
+
+Shard names end with the first 16 hex digits of their SHA-256 digest,
+so a changed artefact is written to a new file and the shards of the
+current manifest are never overwritten. The new manifest replaces the
+old one in one rename, then the shards it no longer uses are removed.
+A writer that stops half way leaves a collection that still loads, at
+worst with unused shard files.
+
+(C) Copyright Olle E. Johansson, Edvina AB - oej@edvina.net
+
+SPDX-License-Identifier: BSD
+"""
+
+import copy
+import hashlib
+import json
+import os
+
+MANIFEST = "manifest.json"
+SHARD_DIR = "artefacts"
+SHARD_VERSION = "1.0"
+
+
+def is_sharded(path: str):
+    """Check if a path is a sharded collection directory."""
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def _encode(data: dict, indent: int = 4):
+    """Return the bytes stored for a manifest or shard.
+
+    The manifest is written compact, it grows with the collection and
+    json only has a fast encoder without indent."""
+    if indent is None:
+        return json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return json.dumps(data, sort_keys=False, indent=indent).encode("utf-8")
+
+
+def _write_atomic(filename: str, data: bytes):
+    """Write a file through a temporary file and a rename.
+
+    The data is synced before the rename, so the new name never points
+    to a partly written file."""
+    tmpname = filename + ".tmp"
+    with open(tmpname, "wb") as filehandle:
+        filehandle.write(data)
+        filehandle.flush()
+        os.fsync(filehandle.fileno())
+    os.replace(tmpname, filename)
+
+
+class sharded_collection:
+    """A collection stored as a manifest and per artefact shards."""
+    debug = False
+
+    def __init__(self, path: str, debug):
+        """Initialise object for a directory. Use open() to read an
+        existing collection."""
+        self.debug = debug
+        self.path = path
+        self.fields = dict()
+        self.index = list()
+        self._byuuid = dict()
+        # Copies of the artefacts last written, saves encoding them
+        # again to find the changed ones
+        self._written = dict()
+
+    def _shardfile(self, entry: dict):
+        return os.path.join(self.path, entry["shard"])
+
+    def open(self):
+        """Read the manifest. Return False if it is missing or broken."""
+        filename = os.path.join(self.path, MANIFEST)
+        try:
+            with open(filename, "rb") as filehandle:
+                manifest = json.loads(filehandle.read())
+        except OSError as err:
+            print("ERROR: Can't read manifest {}: {}".format(
+                filename, err.strerror))
+            return False
+        except ValueError:
+            print("ERROR: Failed parsing manifest: {}".format(filename))
+            return False
+        if (not isinstance(manifest, dict)
+                or not isinstance(manifest.get("artefact_index"), list)):
+            print("ERROR: Not a sharded collection manifest: {}".format(
+                filename))
+            return False
+        index = manifest.pop("artefact_index")
+        manifest.pop("shardVersion", None)
+        for entry in index:
+            if (not isinstance(entry, dict) or "uuid" not in entry
+                    or "shard" not in entry or "sha256" not in entry):
+                print("ERROR: Bad artefact index entry: {}".format(entry))
+                return False
+        self.fields = manifest
+        self.index = index
+        self._byuuid = dict()
+        for entry in index:
+            self._byuuid[entry["uuid"]] = entry
+        if self.debug:
+            print("DEBUG: Opened sharded collection {} with {} artefacts"
+                  .format(self.path, len(index)))
+        return True
+
+    def uuids(self):
+        """Return the artefact UUIDs in collection order."""
+        return [entry["uuid"] for entry in self.index]
+
+    def find(self, name: str):
+        """Return the UUIDs of artefacts with a name, from the index."""
+        return [entry["uuid"] for entry in self.index
+                if entry.get("name") == name]
+
+    def get_artefact(self, uuid: str):
+        """Read one artefact shard as a raw dict, or None.
+
+        The shard digest is checked against the manifest."""
+        entry = self._byuuid.get(uuid)
+        if entry is None:
+            print("ERROR: No artefact {} in {}".format(uuid, self.path))
+            return None
+        try:
+            with open(self._shardfile(entry), "rb") as filehandle:
+                data = filehandle.read()
+        except OSError as err:
+            print("ERROR: Can't read shard {}: {}".format(
+                entry["shard"], err.strerror))
+            return None
+        if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            print("ERROR: Shard {} does not match the manifest".format(
+                entry["shard"]))
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            print("ERROR: Failed parsing shard: {}".format(entry["shard"]))
+            return None
+
+    def load(self, uuids: list = None):
+        """Return the collection as a raw dict, or None.
+
+        With a list of UUIDs, only those artefacts are read and
+        included, in collection order."""
+        if uuids is None:
+            wanted = self.uuids()
+        else:
+            for uuid in uuids:
+                if uuid not in self._byuuid:
+                    print("ERROR: No artefact {} in {}".format(
+                        uuid, self.path))
+                    return None
+            uuidset = set(uuids)
+            wanted = [uuid for uuid in self.uuids() if uuid in uuidset]
+        colldict = dict(self.fields)
+        colldict["artefacts"] = list()
+        for uuid in wanted:
+            art = self.get_artefact(uuid)
+            if art is None:
+                return None
+            colldict["artefacts"].append(art)
+        if self.debug:
+            print("DEBUG: Loaded {} of {} artefact shards".format(
+                len(wanted), len(self.index)))
+        return colldict
+
+    def write(self, col):
+        """Store a collection, rewriting only changed shards.
+
+        Accepts collection objects, frozen collections and raw dicts.
+        Shards of artefacts no longer in the collection are removed.
+        Returns the number of shards written, or None on errors.
+        """
+        from tea_collection import _canonical_uuid
+        from tea_collection import collection
+        from tea_collection.frozen import frozen_collection
+
+        if len(self.index) == 0 and is_sharded(self.path):
+            # Compare with the stored shards, not an empty index
+            if not self.open():
+                return None
+        if isinstance(col, collection):
+            col = json.loads(str(col))
+        elif isinstance(col, frozen_collection):
+            col = col.to_dict()
+        artlist = col.get("artefacts")
+        if not isinstance(artlist, list):
+            print("ERROR: Collection artefacts is not a list")
+            return None
+        shards = list()
+        seen = set()
+        for art in artlist:
+            artuuid = art.get("uuid") if isinstance(art, dict) else None
+            # The file name uses the canonical form of the UUID
+            shardname = None
+            if artuuid is not None:
+                shardname = _canonical_uuid(artuuid)
+            if shardname is None:
+                print("ERROR: Artefact needs a valid UUID to be sharded: {}"
+                      .format(artuuid))
+                return None
+            # UUIDs that only differ in case would share a shard
+            if shardname in seen:
+                print("ERROR: Duplicate artefact UUID {}".format(artuuid))
+                return None
+            seen.add(shardname)
+            shards.append((artuuid, shardname, art))
+
+        os.makedirs(os.path.join(self.path, SHARD_DIR), exist_ok=True)
+        written = 0
+        index = list()
+        written_arts = dict()
+        for artuuid, shardname, art in shards:
+            old = self._byuuid.get(artuuid)
+            if old is not None and self._written.get(artuuid) == art:
+                entry = old
+                written_arts[artuuid] = self._written[artuuid]
+            else:
+                data = _encode(art)
+                digest = hashlib.sha256(data).hexdigest()
+                if (old is not None and old["sha256"] == digest
+                        and os.path.isfile(self._shardfile(old))):
+                    entry = old
+                else:
+                    entry = {
+                        "uuid": artuuid,
+                        "name": art.get("name"),
+                        "shard": "{}/{}-{}.json".format(
+                            SHARD_DIR, shardname, digest[:16]),
+                        "sha256": digest
+                    }
+                    # A new name, the current manifest is left intact
+                    if not os.path.isfile(self._shardfile(entry)):
+                        _write_atomic(self._shardfile(entry), data)
+                        written += 1
+                written_arts[artuuid] = copy.deepcopy(art)
+            index.append(entry)
+
+        fields = dict()
+        for key, value in col.items():
+            if key != "artefacts":
+                fields[key] = value
+        if fields != self.fields or index != self.index:
+            manifest = dict(fields)
+            manifest["shardVersion"] = SHARD_VERSION
+            manifest["artefact_index"] = index
+            _write_atomic(
+                os.path.join(self.path, MANIFEST), _encode(manifest, None))
+
+        # Old shards are removed after the new manifest is in place
+        removed = 0
+        inuse = set(entry["shard"] for entry in index)
+        for entry in self.index:
+            if entry["shard"] not in inuse:
+                try:
+                    os.unlink(self._shardfile(entry))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        self.fields = copy.deepcopy(fields)
+        self.index = index
+        self._written = written_arts
+        self._byuuid = dict()
+        for entry in index:
+            self._byuuid[entry["uuid"]] = entry
+        if self.debug:
+            print("DEBUG: Wrote {} of {} shards, removed {}".format(
+                written, len(index), removed))
+        return written
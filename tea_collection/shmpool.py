@@ -0,0 +1,549 @@
+"""Shared memory pool of TEA collections for multi-process workers.
+
+One process loads the collections and publishes them into a shared
+memory segment. Worker processes attach to the pool by name and read
+collection data straight from the segment, without loading or parsing
+the collection files themselves.
+
+Layout
+
+A small control segment named after the pool holds the current
+generation number:
+
+    magic "TCOC", layout version (u32), generation (u64)
+
+The data of each generation is in a segment named "<pool>-<generation>":
+
+    magic "TCOP", layout version (u32), generation (u64),
+        collection count, artefact count, format count (u32 each)
+    collection, artefact and format tables, one entry per object:
+        UUID (36 bytes ascii), offset (u64), length (u64),
+        first child (u32), child count (u32)
+    collection, artefact and format lookup tables, sorted by UUID:
+        UUID (36 bytes ascii), table position (u32)
+    payload: one compact JSON slice per object
+
+A collection slice holds the collection fields without "artefacts",
+an artefact slice the artefact fields without "formats". The children
+of an object are the child count table entries from first child on,
+in their original order.
+
+get_artefact() and get_format() find the object with a binary search
+in the lookup table and decode only its own slices. Nothing is parsed
+when attaching, and each process only builds the frozen objects it
+touches. get_collection() and get_struct() assemble a full collection
+when it is asked for.
+
+UUIDs are stored in their canonical 36 character form. Collections,
+artefacts and formats without a valid UUID are not published. If two
+collections have an artefact or format with the same UUID, lookups
+find the one published first. Lookups accept any form uuid.UUID()
+accepts.
+
+Updates
+
+Collections are never changed in place. publish() and replace() write
+a complete new generation segment, then bump the generation in the
+control segment and unlink the old data segment. Readers call refresh()
+before a unit of work and move to the new generation when it has
+changed. A reader that still holds the old segment keeps a valid
+mapping of it until it refreshes.
+
+(C) Copyright Olle E. Johansson, Edvina AB - oej@edvina.net
+
+SPDX-License-Identifier: BSD
+"""
+
+import struct
+import threading
+
+CONTROL_FORMAT = "<4sIQ"
+HEADER_FORMAT = "<4sIQIII"
+ENTRY_FORMAT = "<36sQQII"
+LOOKUP_FORMAT = "<36sI"
+LAYOUT_VERSION = 2
+# Object kinds, also the order of the tables in a data segment
+COLLECTION = 0
+ARTEFACT = 1
+FORMAT = 2
+# Key of the child list in the raw dicts of each kind
+CHILD_KEYS = ("artefacts", "formats", None)
+# Times refresh() looks again when the pool is replaced while it looks
+REFRESH_RETRIES = 100
+
+_entry_struct = struct.Struct(ENTRY_FORMAT)
+_lookup_struct = struct.Struct(LOOKUP_FORMAT)
+_attach_lock = threading.Lock()
+_no_tables = ((0, 0, 0),) * 3
+
+
+def _open_segment(name: str, create=False, size=0):
+    """Open or create a shared memory segment.
+
+    Segments attached by a reader are not tracked, so the resource
+    tracker does not unlink them when the reader exits.
+    """
+    from multiprocessing import shared_memory
+
+    if create:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Python before 3.13 has no track argument. Unregistering after the
+    # fact would drop the owner's registration when the tracker process
+    # is shared after fork, so registration is skipped while attaching.
+    from multiprocessing import resource_tracker
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = _no_register
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def _no_register(name, rtype):
+    """Resource tracker stand-in used while attaching to segments."""
+    return None
+
+
+def _slice(fields: dict, childkey) -> bytes:
+    """Return compact JSON bytes of a dict without its child list."""
+    import json
+
+    data = dict()
+    for key, value in fields.items():
+        if key != childkey:
+            data[key] = value
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def _encode(col):
+    """Return the pool record of a collection, or None.
+
+    A record is (UUID, JSON slice, child records) for the collection
+    and each of its artefacts and formats. Accepts collection objects,
+    frozen collections and raw dicts.
+    """
+    from tea_collection import _canonical_uuid
+    from tea_collection import collection
+    from tea_collection.frozen import frozen_collection
+
+    if isinstance(col, collection):
+        colldict = col.freeze().to_dict()
+    elif isinstance(col, frozen_collection):
+        colldict = col.to_dict()
+    else:
+        colldict = col
+    coluuid = _canonical_uuid(colldict.get("UUID"))
+    if coluuid is None:
+        print("ERROR: Collection without a valid UUID can't be published")
+        return None
+    artefacts = list()
+    for art in colldict.get("artefacts", ()):
+        artuuid = _canonical_uuid(art.get("uuid"))
+        if artuuid is None:
+            print("ERROR: Artefact without a valid UUID in collection {} "
+                  "can't be published".format(coluuid))
+            return None
+        formats = list()
+        for form in art.get("formats", ()):
+            formuuid = _canonical_uuid(form.get("uuid"))
+            if formuuid is None:
+                print("ERROR: Format without a valid UUID in artefact {} "
+                      "can't be published".format(artuuid))
+                return None
+            formats.append((formuuid, _slice(form, None), ()))
+        artefacts.append((artuuid, _slice(art, "formats"), formats))
+    return (coluuid, _slice(colldict, "artefacts"), artefacts)
+
+
+def _layout(counts: tuple):
+    """Return (table, lookup, count) per kind and the payload offset."""
+    entry = struct.calcsize(ENTRY_FORMAT)
+    lookup = struct.calcsize(LOOKUP_FORMAT)
+    table = struct.calcsize(HEADER_FORMAT)
+    lookupbase = table + entry * sum(counts)
+    tables = list()
+    for count in counts:
+        tables.append((table, lookupbase, count))
+        table += entry * count
+        lookupbase += lookup * count
+    return tuple(tables), lookupbase
+
+
+class collection_pool:
+    """A named pool of collections in shared memory."""
+    debug = False
+
+    def __init__(self, name: str, debug):
+        """Initialise pool object. Use create() or attach() next."""
+        self.debug = debug
+        self.name = name
+        self.generation = 0
+        self._control = None
+        self._data = None
+        self._tables = _no_tables
+        self._cache = dict()
+        self._retired = list()
+
+    def _data_name(self, generation: int):
+        return "{}-{}".format(self.name, generation)
+
+    def _write_generation(self, records: list):
+        """Write a new data segment from collection records.
+
+        Return the new segment or None.
+        """
+        generation = self.generation + 1
+        # Flatten the records to one table per kind, children of an
+        # object get consecutive positions in the next table.
+        entries = (list(), list(), list())
+        for coluuid, coldata, artefacts in records:
+            entries[COLLECTION].append(
+                (coluuid, coldata, len(entries[ARTEFACT]), len(artefacts)))
+            for artuuid, artdata, formats in artefacts:
+                entries[ARTEFACT].append(
+                    (artuuid, artdata, len(entries[FORMAT]), len(formats)))
+                for formuuid, formdata, _ in formats:
+                    entries[FORMAT].append((formuuid, formdata, 0, 0))
+        counts = tuple(len(table) for table in entries)
+        tables, offset = _layout(counts)
+        size = offset
+        for table in entries:
+            for _, data, _, _ in table:
+                size += len(data)
+        try:
+            segment = _open_segment(
+                self._data_name(generation), create=True, size=size)
+        except FileExistsError:
+            print("ERROR: Pool segment already exists: {}".format(
+                self._data_name(generation)))
+            return None
+        buf = segment.buf
+        struct.pack_into(
+            HEADER_FORMAT, buf, 0,
+            b"TCOP", LAYOUT_VERSION, generation, *counts)
+        entry = struct.calcsize(ENTRY_FORMAT)
+        lookup = struct.calcsize(LOOKUP_FORMAT)
+        for kind, table in enumerate(entries):
+            tablebase, lookupbase, _ = tables[kind]
+            for position, (uuid, data, first, count) in enumerate(table):
+                struct.pack_into(
+                    ENTRY_FORMAT, buf, tablebase + position * entry,
+                    uuid.encode("ascii"), offset, len(data), first, count)
+                buf[offset:offset + len(data)] = data
+                offset += len(data)
+            keys = sorted(
+                (uuid, position)
+                for position, (uuid, _, _, _) in enumerate(table))
+            for index, (uuid, position) in enumerate(keys):
+                struct.pack_into(
+                    LOOKUP_FORMAT, buf, lookupbase + index * lookup,
+                    uuid.encode("ascii"), position)
+        del buf
+        if self.debug:
+            print("DEBUG: Wrote pool generation {}: {} collections, "
+                  "{} artefacts, {} formats, {} bytes".format(
+                      generation, *counts, size))
+        return segment
+
+    def _switch(self, segment):
+        """Make a new data segment current for a pool owner."""
+        old = self._data
+        self._data = segment
+        self._read_index()
+        struct.pack_into(
+            CONTROL_FORMAT, self._control.buf, 0,
+            b"TCOC", LAYOUT_VERSION, self.generation)
+        if old is not None:
+            old.close()
+            old.unlink()
+
+    def _read_index(self):
+        """Read the header of the current data segment.
+
+        The tables are read in place when looking up objects.
+        """
+        magic, layout, generation, *counts = struct.unpack_from(
+            HEADER_FORMAT, self._data.buf, 0)
+        if magic != b"TCOP" or layout != LAYOUT_VERSION:
+            print("ERROR: Not a collection pool segment: {}".format(
+                self._data.name))
+            return False
+        self.generation = generation
+        self._tables, _ = _layout(tuple(counts))
+        self._cache = dict()
+        return True
+
+    def _entry(self, kind: int, position: int):
+        """Return UUID, offset, length, first child and child count."""
+        table, _, _ = self._tables[kind]
+        uuid, offset, length, first, count = _entry_struct.unpack_from(
+            self._data.buf, table + position * _entry_struct.size)
+        return uuid.decode("ascii"), offset, length, first, count
+
+    def _find(self, kind: int, uuid: str):
+        """Return the table position of an object, or None.
+
+        Binary search in the lookup table, which is sorted by UUID.
+        """
+        from tea_collection import _canonical_uuid
+
+        uuid = _canonical_uuid(uuid)
+        if uuid is None:
+            return None
+        key = uuid.encode("ascii")
+        _, lookupbase, count = self._tables[kind]
+        size = _lookup_struct.size
+        low = 0
+        high = count
+        while low < high:
+            middle = (low + high) // 2
+            found, _ = _lookup_struct.unpack_from(
+                self._data.buf, lookupbase + middle * size)
+            if found < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == count:
+            return None
+        found, position = _lookup_struct.unpack_from(
+            self._data.buf, lookupbase + low * size)
+        if found != key:
+            return None
+        return position
+
+    def _load(self, offset: int, length: int):
+        """Decode the JSON slice of one object to a new dict."""
+        import json
+
+        return json.loads(bytes(self._data.buf[offset:offset + length]))
+
+    def _struct_at(self, kind: int, position: int):
+        """Return a new raw dict of an object and its children."""
+        _, offset, length, first, count = self._entry(kind, position)
+        data = self._load(offset, length)
+        if CHILD_KEYS[kind] is not None:
+            data[CHILD_KEYS[kind]] = [
+                self._struct_at(kind + 1, child)
+                for child in range(first, first + count)]
+        return data
+
+    def _frozen_at(self, kind: int, position: int):
+        """Return the frozen object at a table position.
+
+        Built once per process and generation.
+        """
+        from tea_collection import frozen
+
+        if (kind, position) in self._cache:
+            return self._cache[(kind, position)]
+        _, offset, length, first, count = self._entry(kind, position)
+        data = self._load(offset, length)
+        if kind == FORMAT:
+            obj = frozen.frozen_format(data)
+        else:
+            children = tuple(
+                self._frozen_at(kind + 1, child)
+                for child in range(first, first + count))
+            if kind == ARTEFACT:
+                obj = frozen.frozen_artefact(data, children)
+            else:
+                obj = frozen.frozen_collection(data, children)
+        self._cache[(kind, position)] = obj
+        return obj
+
+    def _record_at(self, kind: int, position: int):
+        """Return the pool record of an object, copying its slices."""
+        uuid, offset, length, first, count = self._entry(kind, position)
+        children = list()
+        if CHILD_KEYS[kind] is not None:
+            for child in range(first, first + count):
+                children.append(self._record_at(kind + 1, child))
+        return (uuid, bytes(self._data.buf[offset:offset + length]),
+                children)
+
+    def create(self, collections: list):
+        """Create the pool and publish the first generation."""
+        if self._control is not None:
+            print("ERROR: Pool is already open: {}".format(self.name))
+            return False
+        try:
+            self._control = _open_segment(
+                self.name, create=True,
+                size=struct.calcsize(CONTROL_FORMAT))
+        except FileExistsError:
+            print("ERROR: Pool already exists: {}".format(self.name))
+            return False
+        return self.publish(collections)
+
+    def publish(self, collections: list):
+        """Publish a new generation with exactly these collections."""
+        records = list()
+        for col in collections:
+            record = _encode(col)
+            if record is None:
+                return False
+            records.append(record)
+        segment = self._write_generation(records)
+        if segment is None:
+            return False
+        self._switch(segment)
+        return True
+
+    def replace(self, col):
+        """Publish a new generation with one collection added or replaced.
+
+        The other collections are copied as bytes, without parsing.
+        """
+        record = _encode(col)
+        if record is None:
+            return False
+        records = list()
+        for position in range(self._tables[COLLECTION][2]):
+            if self._entry(COLLECTION, position)[0] != record[0]:
+                records.append(self._record_at(COLLECTION, position))
+        records.append(record)
+        segment = self._write_generation(records)
+        if segment is None:
+            return False
+        self._switch(segment)
+        return True
+
+    def attach(self):
+        """Attach to an existing pool as a reader."""
+        try:
+            self._control = _open_segment(self.name)
+        except FileNotFoundError:
+            print("ERROR: No such pool: {}".format(self.name))
+            return False
+        return self.refresh()
+
+    def refresh(self):
+        """Move to the current generation if it has changed.
+
+        Readers call this before each unit of work. Returns False if
+        the pool is gone, like after the owner called unlink().
+        """
+        missing = None
+        for _ in range(REFRESH_RETRIES):
+            magic, layout, generation = struct.unpack_from(
+                CONTROL_FORMAT, self._control.buf, 0)
+            if magic != b"TCOC" or layout != LAYOUT_VERSION:
+                print("ERROR: Not a collection pool: {}".format(self.name))
+                return False
+            if generation == self.generation and self._data is not None:
+                return True
+            if generation == missing:
+                # Not replaced since, the segment is gone for good
+                break
+            try:
+                segment = _open_segment(self._data_name(generation))
+            except FileNotFoundError:
+                # Replaced again while we looked - read the control again
+                missing = generation
+                continue
+            if self._data is not None:
+                try:
+                    self._data.close()
+                except BufferError:
+                    # Views from get_raw() are still in use
+                    self._retired.append(self._data)
+            self._data = segment
+            if self.debug:
+                print("DEBUG: Attached pool generation {}".format(generation))
+            return self._read_index()
+        print("ERROR: Pool data segment is gone: {}".format(
+            self._data_name(generation)))
+        return False
+
+    def uuids(self):
+        """Return the UUIDs of all collections in the pool."""
+        return [self._entry(COLLECTION, position)[0]
+                for position in range(self._tables[COLLECTION][2])]
+
+    def artefact_uuids(self, uuid: str):
+        """Return the artefact UUIDs of a collection, or None.
+
+        Only the tables are read, no artefact is decoded.
+        """
+        position = self._find(COLLECTION, uuid)
+        if position is None:
+            return None
+        _, _, _, first, count = self._entry(COLLECTION, position)
+        return [self._entry(ARTEFACT, child)[0]
+                for child in range(first, first + count)]
+
+    def get_raw(self, uuid: str, kind: int = COLLECTION):
+        """Return the JSON slice of an object as a memoryview, or None.
+
+        The slice holds the fields of the object without its child
+        list. The view points into shared memory, no data is copied.
+        Release it before calling close().
+        """
+        position = self._find(kind, uuid)
+        if position is None:
+            return None
+        _, offset, length, _, _ = self._entry(kind, position)
+        return self._data.buf[offset:offset + length]
+
+    def get_struct(self, uuid: str):
+        """Return a new raw dict of a full collection, or None."""
+        position = self._find(COLLECTION, uuid)
+        if position is None:
+            return None
+        return self._struct_at(COLLECTION, position)
+
+    def get_format(self, uuid: str):
+        """Return a frozen format, or None.
+
+        Only the slice of the format is decoded.
+        """
+        position = self._find(FORMAT, uuid)
+        if position is None:
+            return None
+        return self._frozen_at(FORMAT, position)
+
+    def get_artefact(self, uuid: str):
+        """Return a frozen artefact with its formats, or None.
+
+        Only the slices of the artefact and its formats are decoded.
+        """
+        position = self._find(ARTEFACT, uuid)
+        if position is None:
+            return None
+        return self._frozen_at(ARTEFACT, position)
+
+    def get_collection(self, uuid: str):
+        """Return a frozen collection, or None.
+
+        Each object is decoded once per process and generation, and
+        shared with get_artefact() and get_format(). The frozen
+        collection can be shared between threads.
+        """
+        position = self._find(COLLECTION, uuid)
+        if position is None:
+            return None
+        return self._frozen_at(COLLECTION, position)
+
+    def close(self):
+        """Detach from the pool."""
+        self._tables = _no_tables
+        self._cache = dict()
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        if self._control is not None:
+            self._control.close()
+            self._control = None
+
+    def unlink(self):
+        """Remove the pool. Only the owner that created it does this."""
+        if self._data is not None:
+            self._data.unlink()
+        if self._control is not None:
+            self._control.unlink()
+        self.close()
@@ -0,0 +1,269 @@
+"""Corpus wide index of collection, artefact and format identifiers.
+
+A collection UUID, artefact or format UUID or bom-identifier that is
+used by two different collections is an integrity problem. The index
+keeps every identifier seen, with the UUID of the collection that owns
+it, in a SQLite database. A Bloom filter in memory answers most lookups
+for new identifiers without touching the database.
+
+(C) Copyright Olle E. Johansson, Edvina AB - oej@edvina.net
+
+SPDX-License-Identifier: BSD
+"""
+
+import math
+
+
+class bloom_filter:
+    """A Bloom filter for strings.
+
+    No false negatives, false positives at about the error rate as
+    long as no more than capacity keys are added.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        """Initialise an empty filter sized for capacity keys."""
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = max(
+            8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, key: str):
+        """Return the bit positions of a key (double hashing)."""
+        import hashlib
+
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for num in range(self.hashes):
+            yield (first + num * second) % self.bits
+
+    def add(self, key: str):
+        """Add a key."""
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str):
+        for position in self._positions(key):
+            if not self._array[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def to_bytes(self):
+        """Return the bit array."""
+        return bytes(self._array)
+
+    def load_bytes(self, data: bytes, count: int):
+        """Load a bit array saved with to_bytes(). Return False if the
+        size does not match."""
+        if len(data) != len(self._array):
+            return False
+        self._array = bytearray(data)
+        self.count = count
+        return True
+
+
+def _struct(obj):
+    """Return the field mapping of an object, frozen object or dict."""
+    if hasattr(obj, "get_struct"):
+        return obj.get_struct()
+    return obj
+
+
+def _uuid_key(value):
+    """Return the index key of a UUID, its canonical form if it has one."""
+    from tea_collection import _canonical_uuid
+
+    canonical = _canonical_uuid(value)
+    if canonical is None:
+        return str(value)
+    return canonical
+
+
+def collection_ids(col):
+    """Return (identifier, kind) pairs of a collection.
+
+    Accepts collection objects, frozen collections and raw dicts.
+    Kinds are "collection", "artefact", "format" and "bom-identifier".
+    UUIDs are returned in canonical form, so a UUID reused in another
+    case is found. Bom-identifiers are returned as they are.
+    """
+    from tea_collection import collection
+
+    if isinstance(col, collection):
+        col = col.collection
+    idlist = list()
+    if col.get("UUID") is not None:
+        idlist.append((_uuid_key(col["UUID"]), "collection"))
+    for art in col.get("artefacts", ()):
+        art = _struct(art)
+        if art.get("uuid") is not None:
+            idlist.append((_uuid_key(art["uuid"]), "artefact"))
+        for form in art.get("formats", ()):
+            form = _struct(form)
+            if form.get("uuid") is not None:
+                idlist.append((_uuid_key(form["uuid"]), "format"))
+            if form.get("bom-identifier") is not None:
+                idlist.append((str(form["bom-identifier"]), "bom-identifier"))
+    return idlist
+
+
+class uuid_index:
+    """A persistent index of identifiers and the collections owning them."""
+    debug = False
+
+    def __init__(
+            self,
+            filename: str,
+            debug,
+            capacity: int = 4000000,
+            error_rate: float = 0.001):
+        """Initialise index object. Use open() next.
+
+        Capacity and error rate size the Bloom filter. Memory use is
+        about 1.8 bytes per identifier of capacity at 0.1% error rate.
+        """
+        self.debug = debug
+        self.filename = filename
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filter = None
+        self._db = None
+        self._dirty = False
+
+    def open(self):
+        """Open or create the index database and load the filter."""
+        import sqlite3
+
+        try:
+            self._db = sqlite3.connect(self.filename)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ids ("
+                "id TEXT PRIMARY KEY, kind TEXT, owner TEXT) WITHOUT ROWID")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS meta ("
+                "key TEXT PRIMARY KEY, value)")
+            self._db.commit()
+        except sqlite3.Error as err:
+            print("ERROR: Can't open index {}: {}".format(self.filename, err))
+            return False
+        self.filter = bloom_filter(self.capacity, self.error_rate)
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE key = 'filter'").fetchone()
+        countrow = self._db.execute(
+            "SELECT value FROM meta WHERE key = 'filter_count'").fetchone()
+        total = self._db.execute("SELECT count(*) FROM ids").fetchone()[0]
+        # A filter saved with another size, or before a crash, is rebuilt
+        if (row is None or countrow is None or countrow[0] != total
+                or not self.filter.load_bytes(row[0], total)):
+            self.rebuild_filter()
+        if self.debug:
+            print("DEBUG: Opened index {} with {} identifiers".format(
+                self.filename, total))
+        return True
+
+    def rebuild_filter(self):
+        """Rebuild the Bloom filter from the database."""
+        self.filter = bloom_filter(self.capacity, self.error_rate)
+        for (key,) in self._db.execute("SELECT id FROM ids"):
+            self.filter.add(key)
+        self._dirty = True
+        if self.debug:
+            print("DEBUG: Rebuilt index filter with {} identifiers".format(
+                self.filter.count))
+        if self.filter.count > self.capacity:
+            print("WARNING: Index holds {} identifiers, filter capacity "
+                  "is {}".format(self.filter.count, self.capacity))
+
+    def lookup(self, keys: list):
+        """Return a dict of identifier to (kind, owner) for known keys.
+
+        Keys not in the filter are never looked up in the database."""
+        found = dict()
+        maybe = [key for key in keys if key in self.filter]
+        # Stay below the SQLite host parameter limit
+        for start in range(0, len(maybe), 500):
+            batch = maybe[start:start + 500]
+            query = "SELECT id, kind, owner FROM ids WHERE id IN ({})".format(
+                ",".join("?" * len(batch)))
+            for key, kind, owner in self._db.execute(query, batch):
+                found[key] = (kind, owner)
+        if self.debug:
+            print("DEBUG: Index lookup: {} keys, {} passed filter, "
+                  "{} found".format(len(keys), len(maybe), len(found)))
+        return found
+
+    def check(self, col):
+        """Check a collection against the index and itself.
+
+        An identifier is an error if it is owned by another collection
+        in the index. UUIDs are also errors if used twice within the
+        collection.
+        Returns errors and error messages like is_valid().
+        """
+        errors = 0
+        errmsg = list()
+        idlist = collection_ids(col)
+        owner = None
+        seen = set()
+        for key, kind in idlist:
+            if kind == "collection":
+                owner = key
+            elif kind == "bom-identifier":
+                # Formats of one artefact may describe the same BOM
+                continue
+            elif key in seen:
+                errors += 1
+                errmsg.append(
+                    "ERROR: Duplicate {} {} in collection".format(kind, key))
+            seen.add(key)
+        found = self.lookup([key for key, _ in idlist])
+        for key, kind in idlist:
+            if key in found and found[key][1] != owner:
+                errors += 1
+                errmsg.append(
+                    "ERROR: {} {} is already used as {} in collection {}"
+                    .format(kind, key, found[key][0], found[key][1]))
+        return errors, errmsg
+
+    def add(self, col):
+        """Add all identifiers of a collection. Return number of new ones."""
+        idlist = collection_ids(col)
+        owner = None
+        for key, kind in idlist:
+            if kind == "collection":
+                owner = key
+        cursor = self._db.executemany(
+            "INSERT OR IGNORE INTO ids (id, kind, owner) VALUES (?, ?, ?)",
+            [(key, kind, owner) for key, kind in idlist])
+        added = cursor.rowcount
+        self._db.commit()
+        # Adding a known key again leaves the bits as they are,
+        # the count is kept in step with the table
+        count = self.filter.count
+        for key, _ in idlist:
+            self.filter.add(key)
+        self.filter.count = count + added
+        self._dirty = True
+        if self.debug:
+            print("DEBUG: Added {} new identifiers to index".format(added))
+        return added
+
+    def close(self):
+        """Save the filter and close the database."""
+        if self._db is None:
+            return
+        if self._dirty:
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                ("filter", self.filter.to_bytes()))
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                ("filter_count", self.filter.count))
+            self._db.commit()
+        self._db.close()
+        self._db = None